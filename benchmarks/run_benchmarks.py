@@ -0,0 +1,217 @@
+"""
+Offline benchmark of the pipeline stages on deterministic synthetic inputs.
+
+Times every stage at each H3 resolution, stores the timings as a baseline and compares later
+runs against it:
+
+    python benchmarks/run_benchmarks.py --save-baseline
+    python benchmarks/run_benchmarks.py --compare
+"""
+import os
+import sys
+import io
+import json
+import time
+import argparse
+import platform
+import subprocess
+import tempfile
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from inputs.osm_tags import *
+from tile_table import TileTable
+from tile_adjacency import grid_disk_adjacency
+from obtain_tile_function import process_multiple_tags, process_roads_and_assign_width
+from obtain_tile_dim import process_building_heights_and_assign_width
+from obtain_tile_names import process_osm_names_and_assign_to_tiles
+from obtain_height_and_grad_score import process_tile_heights, soften_tile_heights, calculate_gradient_scores
+from csv_export import export_tiles_map_to_csv
+from synthetic_inputs import aoi_bounds, synthetic_tiles, synthetic_features, synthetic_dtm
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+ALL_FUNCTIONS = ["na", "road", "veg", "park", "built", "school", "religious", "amenity", "water", "food", "gov"]
+
+tags_and_functions = [
+    [buildings_tags, 'built'],
+    [parks_tags, 'park'],
+    [schools_tags, 'school'],
+    [water_tags, 'water'],
+]
+
+def _timed(timings, name, stage, repeat):
+    """Run a stage `repeat` times and keep the fastest wall time, the stage output is silenced."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with redirect_stdout(io.StringIO()):
+            stage()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    timings[name] = round(best, 6)
+
+def benchmark_resolution(res, bounds, features, dtm_path, work_dir, repeat=3, mode="intersects"):
+    """
+    Time every stage at one resolution.
+
+    Args:
+        res (int): The H3 resolution.
+        bounds (tuple): (west, south, east, north) of the AOI.
+        features (GeoDataFrame): Synthetic features.
+        dtm_path (str): Synthetic DTM path.
+        work_dir (str): Directory the export writes under.
+        repeat (int): Runs per stage, the fastest one is kept.
+        mode (str): The classification mode.
+
+    Returns:
+        dict: Seconds per stage, plus the tile count.
+    """
+    tile_ids = synthetic_tiles(bounds, res)
+    timings = {'tiles': len(tile_ids)}
+
+    # Build the table outside of the timings of the geometry-dependent stages
+    tile_table = TileTable(tile_ids)
+    _timed(timings, 'tile_geometry', lambda: TileTable(tile_ids).geometry.polygons, repeat)
+    tile_table.geometry.polygons
+
+    _timed(timings, 'multiple_tags', lambda: process_multiple_tags(tags_and_functions, None, tile_table, features, mode), repeat)
+    _timed(timings, 'roads', lambda: process_roads_and_assign_width(None, tile_table, roads_tags, features), repeat)
+    _timed(timings, 'dims', lambda: process_building_heights_and_assign_width(None, tile_table, features), repeat)
+    _timed(timings, 'names', lambda: process_osm_names_and_assign_to_tiles(None, tile_table, features), repeat)
+    _timed(timings, 'heights', lambda: process_tile_heights({dtm_path: ALL_FUNCTIONS}, tile_table, softening_disk_k=None), repeat)
+
+    # The neighbor adjacency is cached on first use, build it up front so softening and gradient
+    # time the same work whatever the repeat count
+    def build_adjacency():
+        grid_disk_adjacency(tile_ids, 2)
+        grid_disk_adjacency(tile_ids, 1, include_center=False)
+    _timed(timings, 'adjacency', build_adjacency, repeat)
+    tile_table.geometry.adjacency(2)
+    tile_table.geometry.adjacency(1, include_center=False)
+
+    _timed(timings, 'softening', lambda: soften_tile_heights(tile_table, disk_k=2), repeat)
+    _timed(timings, 'gradient', lambda: calculate_gradient_scores(tile_table), repeat)
+
+    # The CSV export writes to ../Outputs/CSVs relative to the working directory
+    export_cwd = os.path.join(work_dir, "run")
+    os.makedirs(export_cwd, exist_ok=True)
+    current_dir = os.getcwd()
+    os.chdir(export_cwd)
+    try:
+        _timed(timings, 'export', lambda: export_tiles_map_to_csv(tile_table), repeat)
+    finally:
+        os.chdir(current_dir)
+
+    return timings
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def run_benchmarks(resolutions, side_m=600, density_per_km2=400, repeat=3, seed=0, mode="intersects"):
+    """
+    Generate the synthetic inputs and benchmark every resolution.
+
+    Args:
+        resolutions (list): H3 resolutions to time.
+        side_m (float): AOI side in meters.
+        density_per_km2 (float): Synthetic feature density.
+        repeat (int): Runs per stage.
+        seed (int): Random seed of the inputs.
+        mode (str): The classification mode.
+
+    Returns:
+        dict: The benchmark results, with the settings and the commit they were taken on.
+    """
+    bounds = aoi_bounds(32.0803, 34.7818, side_m)
+    # One shared frame, every stage selects its own view as with a shared fetch
+    features = synthetic_features(bounds, density_per_km2, seed)
+    print(f"Synthetic features: {len(features)}")
+
+    results = {
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'settings': {'side_m': side_m, 'density_per_km2': density_per_km2, 'repeat': repeat, 'seed': seed,
+                     'mode': mode},
+        'results': {},
+    }
+    with tempfile.TemporaryDirectory() as work_dir:
+        dtm_path = synthetic_dtm(os.path.join(work_dir, "dtm.tif"), bounds, "EPSG:32636", seed=seed)
+        for res in resolutions:
+            timings = benchmark_resolution(res, bounds, features, dtm_path, work_dir, repeat, mode)
+            results['results'][str(res)] = timings
+            print(f"res {res}: {timings['tiles']} tiles, " + ", ".join(
+                f"{stage} {seconds:.3f}s" for stage, seconds in timings.items() if stage != 'tiles'))
+    return results
+
+def compare_results(baseline, results, tolerance=0.2, min_seconds=0.01):
+    """
+    Compare benchmark results against a baseline.
+
+    Args:
+        baseline (dict): Results of a previous run.
+        results (dict): Results of this run.
+        tolerance (float): Relative slowdown reported as a regression.
+        min_seconds (float): Stages faster than this in both runs are timer noise and never regress.
+
+    Returns:
+        list: (res, stage, baseline seconds, seconds) of every regression.
+    """
+    regressions = []
+    print(f"Comparing against baseline from commit {baseline.get('commit')}")
+    for res, timings in results['results'].items():
+        baseline_timings = baseline['results'].get(res)
+        if baseline_timings is None:
+            print(f"res {res}: not in the baseline")
+            continue
+        for stage, seconds in timings.items():
+            if stage == 'tiles' or stage not in baseline_timings:
+                continue
+            baseline_seconds = baseline_timings[stage]
+            ratio = seconds / baseline_seconds if baseline_seconds > 0 else float('inf')
+            flag = ""
+            if ratio > 1 + tolerance and max(seconds, baseline_seconds) >= min_seconds:
+                flag = "  REGRESSION"
+                regressions.append((res, stage, baseline_seconds, seconds))
+            print(f"res {res} {stage:>14}: {baseline_seconds:8.3f}s -> {seconds:8.3f}s ({ratio:5.2f}x){flag}")
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline stages on synthetic inputs.")
+    parser.add_argument("--res", type=int, nargs="+", default=[12, 13, 14, 15], help="H3 resolutions to time")
+    parser.add_argument("--side-m", type=float, default=600, help="AOI side in meters")
+    parser.add_argument("--density", type=float, default=400, help="synthetic features per km2")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per stage, the fastest is kept")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--mode", default="intersects", help="tile classification mode")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline JSON path")
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as the new baseline")
+    parser.add_argument("--compare", action="store_true", help="compare against the baseline, exit 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="relative slowdown counted as a regression")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.res, args.side_m, args.density, args.repeat, args.seed, args.mode)
+
+    exit_code = 0
+    if args.compare:
+        if not os.path.exists(args.baseline):
+            print(f"No baseline at {args.baseline}, run with --save-baseline first")
+            exit_code = 1
+        else:
+            with open(args.baseline) as baseline_file:
+                baseline = json.load(baseline_file)
+            if baseline.get('settings') != results['settings']:
+                print("Warning: the baseline was taken with different settings")
+            exit_code = 1 if compare_results(baseline, results, args.tolerance) else 0
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump(results, baseline_file, indent=2)
+        print(f"Saved baseline to {args.baseline}")
+
+    sys.exit(exit_code)
@@ -0,0 +1,140 @@
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import rasterio
+import shapely
+from h3 import LatLngPoly
+from h3.api.numpy_int import h3shape_to_cells
+from rasterio.transform import from_origin
+from tile_geometry import project_geometries
+from inputs.osm_tags import roads_tags
+
+# Degrees per meter, close enough for sizing synthetic features
+DEGREES_PER_M = 1 / 111_320
+
+def aoi_bounds(center_lat, center_lng, side_m):
+    """
+    Get the (west, south, east, north) bounds of a square AOI.
+
+    Args:
+        center_lat (float): AOI center latitude.
+        center_lng (float): AOI center longitude.
+        side_m (float): AOI side in meters.
+
+    Returns:
+        tuple: (west, south, east, north) in degrees.
+    """
+    half_lat = side_m / 2 * DEGREES_PER_M
+    half_lng = half_lat / np.cos(np.radians(center_lat))
+    return center_lng - half_lng, center_lat - half_lat, center_lng + half_lng, center_lat + half_lat
+
+def synthetic_tiles(bounds, res):
+    """
+    Get the H3 tiles of an AOI.
+
+    Args:
+        bounds (tuple): (west, south, east, north) in degrees.
+        res (int): The H3 resolution.
+
+    Returns:
+        ndarray: uint64 H3 tile IDs.
+    """
+    west, south, east, north = bounds
+    return h3shape_to_cells(LatLngPoly([(south, west), (south, east), (north, east), (north, west)]), res)
+
+def synthetic_features(bounds, density_per_km2=400, seed=0):
+    """
+    Generate deterministic OSM-like features in the layout of ox.features_from_polygon.
+
+    Buildings (with height / building:levels tags), roads (highway lines with width / lanes),
+    parks, schools and water polygons, and named points with Hebrew, Arabic and Latin names.
+
+    Args:
+        bounds (tuple): (west, south, east, north) in degrees.
+        density_per_km2 (float): Number of features per square kilometer.
+        seed (int): Random seed, the same seed gives the same features.
+
+    Returns:
+        GeoDataFrame: The features in EPSG:4326, indexed by (element, id).
+    """
+    rng = np.random.default_rng(seed)
+    west, south, east, north = bounds
+    area_km2 = ((north - south) / DEGREES_PER_M) * ((east - west) / DEGREES_PER_M * np.cos(np.radians(south))) / 1e6
+    feature_count = max(1, int(density_per_km2 * area_km2))
+
+    x = rng.uniform(west, east, feature_count)
+    y = rng.uniform(south, north, feature_count)
+    size = rng.uniform(10, 60, feature_count) * DEGREES_PER_M
+    kinds = rng.choice(["building", "road", "park", "school", "water", "named"], feature_count,
+                       p=[0.45, 0.25, 0.08, 0.04, 0.03, 0.15])
+
+    def optional_numbers(low, high, probability):
+        values = rng.integers(low, high, feature_count).astype(str).astype(object)
+        values[rng.random(feature_count) > probability] = None
+        return values
+
+    columns = {
+        'building': np.where(kinds == "building", "yes", None),
+        'height': np.where(kinds == "building", optional_numbers(3, 60, 0.3), None),
+        'building:levels': np.where(kinds == "building", optional_numbers(1, 15, 0.5), None),
+        'highway': np.where(kinds == "road", rng.choice(roads_tags["highway"], feature_count), None),
+        'width': np.where(kinds == "road", optional_numbers(4, 20, 0.1), None),
+        'lanes': np.where(kinds == "road", optional_numbers(1, 5, 0.5), None),
+        'leisure': np.where(kinds == "park", "park", None),
+        'amenity': np.where(kinds == "school", "school", np.where(kinds == "named", "cafe", None)),
+        'natural': np.where(kinds == "water", "water", None),
+    }
+    name_pool = np.array(["Café Levinsky", "מאפיית השוק", "مقهى البلد", "Park Hayarkon", "مدرسة الأمل", "בית ספר"])
+    columns['name'] = np.where(np.isin(kinds, ["named", "park", "school"]),
+                               rng.choice(name_pool, feature_count).astype(object), None)
+
+    # Squares for polygons, random segments for roads, points for named features
+    squares = shapely.box(x, y, x + size, y + size)
+    angle = rng.uniform(0, 2 * np.pi, feature_count)
+    road_length = size * 5
+    segments = shapely.linestrings(np.stack([
+        np.column_stack([x, y]),
+        np.column_stack([x + road_length * np.cos(angle), y + road_length * np.sin(angle)]),
+    ], axis=1))
+    points = shapely.points(x, y)
+    geometries = np.where(kinds == "road", segments, np.where(kinds == "named", points, squares))
+
+    element = np.where(kinds == "named", "node", "way")
+    index = pd.MultiIndex.from_arrays([element, np.arange(1, feature_count + 1)], names=["element", "id"])
+    return gpd.GeoDataFrame(pd.DataFrame(columns, index=index), geometry=geometries, crs="EPSG:4326")
+
+def synthetic_dtm(path, bounds, crs, pixel_size_m=1.0, seed=0):
+    """
+    Write a deterministic synthetic DTM GeoTIFF covering an AOI.
+
+    The layout follows the real DTM: 3 uint8 bands in a metric CRS, the red band carrying the
+    elevation. The terrain is smooth hills plus noise, a strip along the west edge is nodata (0).
+
+    Args:
+        path (str): The output path.
+        bounds (tuple): (west, south, east, north) in degrees.
+        crs: The raster CRS, a metric projection such as a UTM zone.
+        pixel_size_m (float): Pixel size in meters.
+        seed (int): Random seed.
+
+    Returns:
+        str: `path`.
+    """
+    rng = np.random.default_rng(seed)
+    west, south, east, north = bounds
+    aoi = project_geometries(np.array([shapely.box(west, south, east, north)]), crs)[0]
+    # Pad by a pixel margin so border tiles are fully covered
+    min_x, min_y, max_x, max_y = aoi.buffer(10 * pixel_size_m).bounds
+    width = int(np.ceil((max_x - min_x) / pixel_size_m))
+    height = int(np.ceil((max_y - min_y) / pixel_size_m))
+
+    rows, cols = np.mgrid[0:height, 0:width]
+    terrain = 120 + 60 * np.sin(rows / 150) * np.cos(cols / 110) + rng.normal(0, 3, (height, width))
+    elevation = np.clip(terrain, 1, 255).astype(np.uint8)
+    elevation[:, : max(1, width // 50)] = 0
+
+    with rasterio.open(path, 'w', driver='GTiff', width=width, height=height, count=3, dtype='uint8', crs=crs,
+                       transform=from_origin(min_x, max_y, pixel_size_m, pixel_size_m), nodata=0,
+                       tiled=True, blockxsize=256, blockysize=256) as dataset:
+        dataset.write(np.stack([elevation, elevation // 2, elevation // 4]))
+    return path
@@ -0,0 +1,131 @@
+import os
+import glob
+import json
+import hashlib
+import numpy as np
+from instrumentation import span, count
+
+def file_fingerprint(path):
+    """
+    Identify a file by path, size and modification time, without reading it.
+
+    Args:
+        path (str): The file path.
+
+    Returns:
+        list: [path, size, mtime], or [path, None, None] when the file does not exist.
+    """
+    if path is None or not os.path.exists(path):
+        return [path, None, None]
+    stat = os.stat(path)
+    return [path, stat.st_size, stat.st_mtime]
+
+def inputs_hash(*inputs):
+    """
+    Hash stage inputs (dicts, lists, strings, numbers and NumPy arrays) to a stable hex key.
+
+    Args:
+        *inputs: The inputs. Arrays are hashed by their bytes, everything else by its JSON form.
+
+    Returns:
+        str: SHA-1 hex digest.
+    """
+    digest = hashlib.sha1()
+    for value in inputs:
+        if isinstance(value, np.ndarray):
+            digest.update(str(value.dtype).encode())
+            digest.update(np.ascontiguousarray(value).tobytes())
+        else:
+            digest.update(json.dumps(value, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+class StageCheckpoints:
+    """
+    Persist the tile-level outputs of pipeline stages and reload them on re-runs.
+
+    Every stage is keyed by a hash of its own inputs and of the keys of the stages it depends on,
+    so changing one input recomputes that stage and everything downstream of it, while the other
+    stages are reloaded. A checkpoint holds the columns the stage writes, as they are after the
+    stage, and the dynamics entries it appends. Stages have to be run in pipeline order.
+
+    Args:
+        checkpoint_dir (str): Directory of the checkpoint files, None runs every stage without checkpoints.
+        tile_table (TileTable): The tiles of the area of interest.
+        base_inputs (list): Inputs shared by every stage, e.g. the tile IDs.
+    """
+
+    def __init__(self, checkpoint_dir, tile_table, base_inputs=()):
+        self.checkpoint_dir = checkpoint_dir
+        self.tile_table = tile_table
+        self.base_key = inputs_hash(*base_inputs)
+        self.keys = {}
+        if checkpoint_dir is not None:
+            os.makedirs(checkpoint_dir, exist_ok=True)
+
+    def run(self, name, inputs, columns, stage, depends_on=(), appends_dynamics=False):
+        """
+        Run a stage, or reload its outputs when a checkpoint with the same key exists.
+
+        Args:
+            name (str): The stage name, e.g. "roads".
+            inputs (list): The stage's own inputs (tags, config constants, file fingerprints...).
+            columns (list): The TileTable columns the stage writes.
+            stage (callable): Runs the stage on the tile table, without arguments.
+            depends_on (list): Names of the stages whose outputs this stage reads or overwrites. Stages
+                left out of the run count as a missing input.
+            appends_dynamics (bool): Whether the stage appends dynamics.
+
+        Returns:
+            bool: True when the stage was reloaded from its checkpoint.
+        """
+        with span(name):
+            count('tiles', len(self.tile_table))
+            return self._run(name, inputs, columns, stage, depends_on, appends_dynamics)
+
+    def _run(self, name, inputs, columns, stage, depends_on, appends_dynamics):
+        if self.checkpoint_dir is None:
+            stage()
+            return False
+
+        key = inputs_hash(self.base_key, name, inputs, [self.keys.get(dependency) for dependency in depends_on])
+        self.keys[name] = key
+        path = os.path.join(self.checkpoint_dir, f"{name}_{key}.npz")
+
+        if os.path.exists(path):
+            try:
+                self._load(path, columns, appends_dynamics)
+                print(f"Loaded {name} from checkpoint")
+                count('checkpoint_hit')
+                return True
+            except Exception as e:
+                print(f"Error loading checkpoint {path}: {e}, recomputing.")
+
+        dynamics_start = self.tile_table.dynamics_count()
+        stage()
+        self._save(name, path, columns, appends_dynamics, dynamics_start)
+        return False
+
+    def _load(self, path, columns, appends_dynamics):
+        with np.load(path) as checkpoint:
+            arrays = {name: checkpoint[name] for name in checkpoint.files}
+        dynamics = [arrays.pop(name) for name in ('dynamic_rows', 'dynamic_type_codes', 'dynamic_timestamps', 'dynamic_types')
+                    if name in arrays]
+        self.tile_table.load_columns(arrays)
+        if appends_dynamics:
+            rows, type_codes, timestamps, dynamic_types = dynamics
+            self.tile_table.extend_dynamics(rows, dynamic_types.tolist(), type_codes, timestamps)
+
+    def _save(self, name, path, columns, appends_dynamics, dynamics_start):
+        arrays = self.tile_table.column_arrays(columns)
+        if appends_dynamics:
+            rows, type_codes, timestamps = self.tile_table.dynamics_since(dynamics_start)
+            arrays.update(dynamic_rows=rows, dynamic_type_codes=type_codes, dynamic_timestamps=timestamps,
+                          dynamic_types=np.array(self.tile_table.dynamic_types, dtype=str))
+
+        # Checkpoints of older inputs of this stage are stale
+        for stale_path in glob.glob(os.path.join(self.checkpoint_dir, f"{name}_*.npz")):
+            os.remove(stale_path)
+        try:
+            np.savez(path, **arrays)
+        except Exception as e:
+            print(f"Error saving checkpoint {path}: {e}, skipping.")
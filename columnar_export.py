@@ -0,0 +1,135 @@
+import os
+from datetime import datetime
+import numpy as np
+import pyarrow as pa
+import pyarrow.ipc
+import pyarrow.parquet as pq
+from h3 import int_to_str
+
+ROW_GROUP_SIZE = 1_000_000
+COLUMNAR_OUTPUT_DIR = "../Outputs/Columnar"
+
+def tile_table_schema(string_ids=False):
+    """
+    Get the Arrow schema of the columnar tile table export.
+
+    Args:
+        string_ids (bool): Store tile and neighbor IDs as H3 hex strings instead of uint64.
+
+    Returns:
+        pa.Schema: The export schema.
+    """
+    id_type = pa.string() if string_ids else pa.uint64()
+    return pa.schema([
+        ('id', id_type),
+        ('center', pa.struct([('lat', pa.float64()), ('lng', pa.float64())])),
+        ('neighbors', pa.list_(id_type)),
+        ('height', pa.float64()),
+        ('score1', pa.float64()),
+        ('score2', pa.float64()),
+        ('tile_function', pa.dictionary(pa.int8(), pa.string())),
+        ('dynamics', pa.list_(pa.struct([('type', pa.dictionary(pa.int8(), pa.string())), ('timestamp', pa.int64())]))),
+        ('function_dimensions', pa.float64()),
+        ('name1', pa.dictionary(pa.int32(), pa.string())),
+        ('name2', pa.dictionary(pa.int32(), pa.string())),
+    ])
+
+def tile_table_batches(tile_table, row_group_size=ROW_GROUP_SIZE, string_ids=False):
+    """
+    Convert the tile table to Arrow record batches, one per row group.
+
+    Args:
+        tile_table (TileTable): The tiles of the area of interest.
+        row_group_size (int): Number of tiles per batch.
+        string_ids (bool): Store tile and neighbor IDs as H3 hex strings instead of uint64.
+
+    Yields:
+        pa.RecordBatch: Consecutive slices of the table.
+    """
+    schema = tile_table_schema(string_ids)
+    dynamic_rows, dynamic_type_codes, dynamic_timestamps = tile_table.dynamics()
+    functions = pa.array(tile_table.functions, pa.string())
+    names = pa.array(tile_table.names, pa.string())
+    dynamic_types = pa.array(tile_table.dynamic_types, pa.string())
+
+    def id_array(ids):
+        if string_ids:
+            return pa.array([int_to_str(h3_id) for h3_id in ids], pa.string())
+        return pa.array(ids, pa.uint64())
+
+    for start in range(0, len(tile_table), row_group_size):
+        end = min(start + row_group_size, len(tile_table))
+        rows = slice(start, end)
+
+        # Neighbors as a list column, built from flat values and offsets
+        neighbors = [tile_table.neighbor_ids(row) for row in range(start, end)]
+        neighbor_offsets = np.zeros(end - start + 1, dtype=np.int32)
+        np.cumsum([len(row_neighbors) for row_neighbors in neighbors], out=neighbor_offsets[1:])
+        flat_neighbors = np.concatenate(neighbors) if neighbors else np.zeros(0, dtype=np.uint64)
+
+        # Dynamics of the slice, the side table is sorted by row
+        dynamic_bounds = np.searchsorted(dynamic_rows, np.arange(start, end + 1))
+        first, last = dynamic_bounds[0], dynamic_bounds[-1]
+        dynamics_values = pa.StructArray.from_arrays(
+            [pa.DictionaryArray.from_arrays(pa.array(dynamic_type_codes[first:last], pa.int8()), dynamic_types),
+             pa.array(dynamic_timestamps[first:last], pa.int64())],
+            fields=list(schema.field('dynamics').type.value_type),
+        )
+
+        yield pa.RecordBatch.from_arrays([
+            id_array(tile_table.tile_ids[rows]),
+            pa.StructArray.from_arrays(
+                [pa.array(tile_table.center_lat[rows]), pa.array(tile_table.center_lng[rows])],
+                fields=list(schema.field('center').type),
+            ),
+            pa.ListArray.from_arrays(pa.array(neighbor_offsets), id_array(flat_neighbors)),
+            pa.array(tile_table.height[rows], pa.float64(), from_pandas=True),
+            pa.array(tile_table.score1[rows]),
+            pa.array(tile_table.score2[rows]),
+            pa.DictionaryArray.from_arrays(pa.array(tile_table.function_codes[rows]), functions),
+            pa.ListArray.from_arrays(pa.array((dynamic_bounds - first).astype(np.int32)), dynamics_values),
+            pa.array(tile_table.function_dimensions[rows]),
+            pa.DictionaryArray.from_arrays(pa.array(tile_table.name1_codes[rows]), names),
+            pa.DictionaryArray.from_arrays(pa.array(tile_table.name2_codes[rows]), names),
+        ], schema=schema)
+
+def export_tiles_map_to_columnar(tile_table, filename_prefix="tiles_map", file_format="parquet", compression="zstd",
+                                  row_group_size=ROW_GROUP_SIZE, string_ids=False, output_dir=COLUMNAR_OUTPUT_DIR):
+    """
+    Exports the tile table to a columnar Parquet or Arrow IPC file.
+
+    Neighbors, center and dynamics are native list/struct columns, tile_function, names and dynamic
+    types are dictionary-encoded, and the file is written one row group at a time.
+
+    Args:
+        tile_table (TileTable): The tiles of the area of interest.
+        filename_prefix (str): The prefix for the output file name.
+        file_format (str): "parquet" or "arrow" (Arrow IPC file).
+        compression (str): Compression codec, e.g. "zstd", "lz4" or None.
+        row_group_size (int): Number of tiles per row group (record batch for Arrow).
+        string_ids (bool): Store tile and neighbor IDs as H3 hex strings instead of uint64.
+        output_dir (str): The output directory.
+
+    Returns:
+        str: The path of the written file.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    filename = f"{output_dir}/{filename_prefix}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{file_format}"
+    schema = tile_table_schema(string_ids)
+
+    if file_format == "parquet":
+        writer = pq.ParquetWriter(filename, schema, compression=compression)
+    elif file_format == "arrow":
+        writer = pa.ipc.new_file(filename, schema, options=pa.ipc.IpcWriteOptions(compression=compression))
+    else:
+        raise ValueError(f"Unknown columnar file format: {file_format}")
+
+    with writer:
+        for batch in tile_table_batches(tile_table, row_group_size, string_ids):
+            if file_format == "parquet":
+                writer.write_batch(batch, row_group_size=row_group_size)
+            else:
+                writer.write_batch(batch)
+
+    print(f"Wrote {len(tile_table)} rows to {filename}")
+    return filename
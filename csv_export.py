@@ -2,28 +2,30 @@ import os
 from datetime import datetime
 import csv
 
-def export_tiles_map_to_csv(tiles_map, filename_prefix="tiles_map"):
+# Columns of the tiles_map CSV, in order
+CSV_FIELDNAMES = ['id', 'center', 'neighbors', 'height',
+                  'score1', 'score2', 'tile_function', 'dynamics', 'function_dimensions', 'name1', 'name2']
+CSV_OUTPUT_DIR = "../Outputs/CSVs"
+
+def export_tiles_map_to_csv(tile_table, filename_prefix="tiles_map", string_ids=True, output_dir=CSV_OUTPUT_DIR):
     """
-    Exports the tiles_map dictionary to a CSV file.
+    Exports the tile table to a CSV file.
 
     Args:
-        tiles_map (dict): The dictionary containing tile data.
+        tile_table (TileTable): The tiles of the area of interest.
         filename_prefix (str): The prefix for the output CSV file name.
+        string_ids (bool): Write tile and neighbor IDs as H3 hex strings instead of integers.
+        output_dir (str): The output directory.
     """
     # Generate a timestamped filename
-    output_dir = "../Outputs/CSVs"
     os.makedirs(output_dir, exist_ok=True)
     filename = f"{output_dir}/{filename_prefix}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
     
-    # Define the fields to export
-    fieldnames = ['id', 'center', 'neighbors', 'height', 
-                  'score1', 'score2', 'tile_function', 'dynamics', 'function_dimensions', 'name1', 'name2']
-    
     # Write the data to a CSV file
     with open(filename, 'w', newline='') as csvfile:
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+        writer = csv.DictWriter(csvfile, fieldnames=CSV_FIELDNAMES)
         writer.writeheader()
-        for tile_id, tile_data in tiles_map.items():
+        for tile_data in tile_table.iter_records(string_ids):
             writer.writerow(tile_data)
     
-    print(f"Wrote {len(tiles_map)} rows to {filename}")
\ No newline at end of file
+    print(f"Wrote {len(tile_table)} rows to {filename}")
\ No newline at end of file
@@ -0,0 +1,168 @@
+import os
+import csv
+import json
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from h3 import int_to_str
+from csv_export import CSV_FIELDNAMES
+
+DELTA_OUTPUT_DIR = "../Outputs/Deltas"
+MANIFEST_FILENAME = "manifest.json"
+DIGEST_FILENAME = "digest.npz"
+
+def tile_digest(tile_table):
+    """
+    Compute a content hash of every tile.
+
+    The hash covers the exported attributes that can change between runs: height, scores,
+    tile_function, function_dimensions, names and the dynamic types. Dynamics are hashed by type
+    only, their timestamps are the time of the run and would mark every tile with dynamics as
+    updated on every publish. Categorical columns are hashed by value, not by code, so digests of
+    separate runs are comparable. Center and neighbors follow from the tile ID and are left out.
+
+    Args:
+        tile_table (TileTable): The tiles of the area of interest.
+
+    Returns:
+        ndarray: uint64 hashes aligned with the rows.
+    """
+    names = np.array(tile_table.names, dtype=object)
+    attributes = pd.DataFrame({
+        'height': tile_table.height,
+        'score1': tile_table.score1,
+        'score2': tile_table.score2,
+        'tile_function': tile_table.tile_functions(),
+        'function_dimensions': tile_table.function_dimensions,
+        'name1': names[tile_table.name1_codes],
+        'name2': names[tile_table.name2_codes],
+    })
+    row_hashes = pd.util.hash_pandas_object(attributes, index=False).to_numpy()
+
+    # Dynamics: hash the type of each entry, then sum per row (wrapping uint64), independent of order
+    dynamic_rows, dynamic_type_codes, _ = tile_table.dynamics()
+    dynamic_hashes = np.zeros(len(tile_table), dtype=np.uint64)
+    if len(dynamic_rows):
+        dynamic_types = pd.Series(tile_table.dynamic_types, dtype=object)
+        type_hashes = pd.util.hash_pandas_object(dynamic_types, index=False).to_numpy()
+        np.add.at(dynamic_hashes, dynamic_rows, type_hashes[dynamic_type_codes])
+
+    return pd.util.hash_pandas_object(
+        pd.DataFrame({'row': row_hashes, 'dynamics': dynamic_hashes}), index=False
+    ).to_numpy()
+
+def diff_digests(previous_ids, previous_hashes, tile_ids, hashes):
+    """
+    Compare the digest of the current table with the published one.
+
+    Args:
+        previous_ids (ndarray): Sorted uint64 tile IDs of the published digest.
+        previous_hashes (ndarray): Hashes aligned with `previous_ids`.
+        tile_ids (ndarray): uint64 tile IDs of the current table.
+        hashes (ndarray): Hashes aligned with `tile_ids`.
+
+    Returns:
+        tuple: (inserted_rows, updated_rows, deleted_ids). Rows index the current table.
+    """
+    if len(previous_ids) == 0:
+        return np.arange(len(tile_ids)), np.zeros(0, dtype=np.int64), previous_ids
+
+    positions = np.minimum(np.searchsorted(previous_ids, tile_ids), len(previous_ids) - 1)
+    found = previous_ids[positions] == tile_ids
+
+    inserted_rows = np.flatnonzero(~found)
+    updated_rows = np.flatnonzero(found & (previous_hashes[positions] != hashes))
+    deleted_ids = previous_ids[~np.isin(previous_ids, tile_ids)]
+    return inserted_rows, updated_rows, deleted_ids
+
+def _write_records(filename, tile_table, rows, string_ids, change=None, deleted_ids=()):
+    fieldnames = CSV_FIELDNAMES if change is None else ['change'] + CSV_FIELDNAMES
+    format_id = int_to_str if string_ids else int
+    with open(filename, 'w', newline='') as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+        writer.writeheader()
+        for tile_data in tile_table.iter_records(string_ids, rows):
+            if change is not None:
+                tile_data['change'] = change[tile_data['id']]
+            writer.writerow(tile_data)
+        for h3_id in deleted_ids:
+            writer.writerow({'change': 'delete', 'id': format_id(h3_id)})
+
+def export_tiles_map_delta(tile_table, filename_prefix="tiles_map", output_dir=DELTA_OUTPUT_DIR, string_ids=True,
+                           max_delta_ratio=0.5):
+    """
+    Publish only the tiles that changed since the previous publish.
+
+    A digest (tile ID and content hash of every published tile) and a manifest are kept in
+    `output_dir`. The first publish writes a full base snapshot. Later publishes write a delta CSV
+    holding the inserted and updated tiles in the full tiles_map layout plus the IDs of deleted
+    tiles, with a leading `change` column ("insert", "update" or "delete"). Consumers load the base
+    and apply the manifest's deltas in order. When more than `max_delta_ratio` of the tiles changed,
+    a new base snapshot is written instead and the delta chain restarts.
+
+    Args:
+        tile_table (TileTable): The tiles of the area of interest.
+        filename_prefix (str): The prefix for the output file names.
+        output_dir (str): Directory holding the snapshots, deltas, digest and manifest.
+        string_ids (bool): Write tile and neighbor IDs as H3 hex strings instead of integers.
+        max_delta_ratio (float): Fraction of changed tiles above which a new base is written.
+
+    Returns:
+        str: The path of the written snapshot or delta, None when nothing changed.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, MANIFEST_FILENAME)
+    digest_path = os.path.join(output_dir, DIGEST_FILENAME)
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+
+    hashes = tile_digest(tile_table)
+    order = np.argsort(tile_table.tile_ids)
+
+    manifest = None
+    if os.path.exists(manifest_path) and os.path.exists(digest_path):
+        with open(manifest_path) as manifest_file:
+            manifest = json.load(manifest_file)
+        digest = np.load(digest_path)
+        inserted_rows, updated_rows, deleted_ids = diff_digests(digest['tile_ids'], digest['hashes'],
+                                                                tile_table.tile_ids, hashes)
+        changed_count = len(inserted_rows) + len(updated_rows) + len(deleted_ids)
+        if changed_count == 0:
+            print("No tile changes since the last publish, no delta written")
+            return None
+        if changed_count > max_delta_ratio * max(len(tile_table), 1):
+            print(f"{changed_count} tiles changed, writing a new base snapshot")
+            manifest = None
+
+    if manifest is None:
+        # Full snapshot, the base of a new delta chain
+        filename = f"{filename_prefix}_base_{timestamp}.csv"
+        _write_records(os.path.join(output_dir, filename), tile_table, order, string_ids)
+        manifest = {
+            'base': {'file': filename, 'created': timestamp, 'tiles': len(tile_table)},
+            'deltas': [],
+        }
+        print(f"Wrote base snapshot of {len(tile_table)} rows to {output_dir}/{filename}")
+    else:
+        filename = f"{filename_prefix}_delta_{timestamp}.csv"
+        format_id = int_to_str if string_ids else int
+        change = {format_id(h3_id): 'insert' for h3_id in tile_table.tile_ids[inserted_rows]}
+        change.update({format_id(h3_id): 'update' for h3_id in tile_table.tile_ids[updated_rows]})
+        changed_rows = np.concatenate([inserted_rows, updated_rows])
+        changed_rows = changed_rows[np.argsort(tile_table.tile_ids[changed_rows])]
+        _write_records(os.path.join(output_dir, filename), tile_table, changed_rows, string_ids, change, deleted_ids)
+        manifest['deltas'].append({
+            'file': filename,
+            'created': timestamp,
+            'inserted': len(inserted_rows),
+            'updated': len(updated_rows),
+            'deleted': len(deleted_ids),
+        })
+        print(f"Wrote delta to {output_dir}/{filename}: {len(inserted_rows)} inserted, "
+              f"{len(updated_rows)} updated, {len(deleted_ids)} deleted")
+
+    # The digest always describes the table as published after this call
+    np.savez(digest_path, tile_ids=tile_table.tile_ids[order], hashes=hashes[order])
+    with open(manifest_path, 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+
+    return os.path.join(output_dir, filename)
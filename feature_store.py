@@ -0,0 +1,151 @@
+import os
+import json
+import hashlib
+from datetime import datetime
+import geopandas as gpd
+import shapely
+from shapely import wkt
+from osm_features import merge_tag_sets, select_features_by_tags, fetch_features
+from instrumentation import span, count
+
+INDEX_FILENAME = "index.json"
+
+def tags_cover(stored_tags, tags):
+    """
+    Check whether features fetched for `stored_tags` include every feature matching `tags`.
+
+    Args:
+        stored_tags (dict): Tags of a stored pull.
+        tags (dict): Requested tags.
+
+    Returns:
+        bool: True when `stored_tags` is a superset of `tags`.
+    """
+    for key, value in tags.items():
+        stored_value = stored_tags.get(key)
+        if stored_value is True:
+            continue
+        if stored_value is None or value is True:
+            return False
+        values = {value} if isinstance(value, str) else set(value)
+        stored_values = {stored_value} if isinstance(stored_value, str) else set(stored_value)
+        if not values <= stored_values:
+            return False
+    return True
+
+def _read_index(store_dir):
+    index_path = os.path.join(store_dir, INDEX_FILENAME)
+    if not os.path.exists(index_path):
+        return []
+    with open(index_path) as index_file:
+        return json.load(index_file)
+
+def _write_index(store_dir, entries):
+    with open(os.path.join(store_dir, INDEX_FILENAME), 'w') as index_file:
+        json.dump(entries, index_file, indent=2)
+
+def find_stored_features(store_dir, polygon, tags):
+    """
+    Find the smallest stored pull whose tags and coverage include the request.
+
+    Args:
+        store_dir (str): The feature store directory.
+        polygon (Polygon): The requested area.
+        tags (dict): The requested (merged) tags.
+
+    Returns:
+        dict: The index entry, None when no stored pull covers the request.
+    """
+    best_entry, best_area = None, None
+    for entry in _read_index(store_dir):
+        coverage = wkt.loads(entry['coverage'])
+        if not tags_cover(entry['tags'], tags) or not coverage.covers(polygon):
+            continue
+        if best_area is None or coverage.area < best_area:
+            best_entry, best_area = entry, coverage.area
+    return best_entry
+
+def load_stored_features(store_dir, entry, polygon, tags):
+    """
+    Read a stored pull and cut it down to a request.
+
+    Keeps the features intersecting `polygon` (what features_from_polygon returns for it) and
+    matching `tags`, and drops the tag columns left empty.
+
+    Args:
+        store_dir (str): The feature store directory.
+        entry (dict): The index entry to read.
+        polygon (Polygon): The requested area.
+        tags (dict): The requested (merged) tags.
+
+    Returns:
+        GeoDataFrame: The features of the request.
+    """
+    features = gpd.read_parquet(os.path.join(store_dir, entry['file']))
+    features = features.iloc[sorted(features.sindex.query(polygon, predicate="intersects"))]
+    features = select_features_by_tags(features, tags)
+    return features.dropna(axis=1, how="all")
+
+def store_features(store_dir, polygon, tags, features):
+    """
+    Save a pull to the store as GeoParquet and register it in the index.
+
+    Args:
+        store_dir (str): The feature store directory.
+        polygon (Polygon): The area the features were fetched for.
+        tags (dict): The (merged) tags the features were fetched for.
+        features (GeoDataFrame): The fetched features.
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    key = hashlib.sha1(json.dumps([tags, polygon.wkt], sort_keys=True).encode()).hexdigest()
+    filename = f"features_{key}.parquet"
+
+    # Nested OSM members (node and way lists) are not needed by the stages and do not always serialize
+    columns = [column for column in features.columns if column not in ("nodes", "ways")]
+    features[columns].to_parquet(os.path.join(store_dir, filename))
+
+    entries = [entry for entry in _read_index(store_dir) if entry['file'] != filename]
+    entries.append({
+        'file': filename,
+        'tags': tags,
+        'coverage': polygon.wkt,
+        'created': datetime.now().strftime('%Y%m%d_%H%M%S'),
+        'features': len(features),
+    })
+    _write_index(store_dir, entries)
+
+def fetch_features_with_store(polygon, tag_sets, store_dir, offline=False):
+    """
+    Get the features of every tag set from the local feature store, fetching and storing them on a miss.
+
+    A request is served from the store when a stored pull covers its polygon and includes its
+    tags, so a smaller or shifted AOI inside an already fetched region needs no network call.
+
+    Args:
+        polygon (Polygon): The bounding polygon for the area of interest.
+        tag_sets (list): A list of tags dicts, one per pipeline stage.
+        store_dir (str): The feature store directory.
+        offline (bool): Never fetch, fail when the store does not cover the request.
+
+    Returns:
+        GeoDataFrame: All features matching any of the tag sets, as fetch_features returns them.
+    """
+    merged_tags = merge_tag_sets(tag_sets)
+    entry = find_stored_features(store_dir, polygon, merged_tags)
+    if entry is not None:
+        with span("feature_store"):
+            count('read_bytes', os.path.getsize(os.path.join(store_dir, entry['file'])))
+            features = load_stored_features(store_dir, entry, polygon, merged_tags)
+            count('features', len(features))
+        print(f"Loaded {len(features)} OSM features from the feature store ({entry['file']})")
+        return features
+
+    if offline:
+        raise ValueError(f"The feature store in {store_dir} does not cover the requested area and tags")
+
+    features = fetch_features(polygon, tag_sets)
+    try:
+        store_features(store_dir, shapely.normalize(polygon), merged_tags, features)
+    except Exception as e:
+        print(f"Error storing features: {e}, skipping.")
+    return features
@@ -8,7 +8,61 @@ SOFTENING_STRENGTH = 1
 # H3_RES = 15
 # SOFTENING_STRENGTH = 6
 
+# How process_multiple_tags classifies tiles: "intersects" tests every tile against each tag set,
+# "polyfill" converts the features to H3 cells (faster for sparse feature classes over big AOIs),
+# "coverage" gives every tile the function covering most of its area
+TILE_CLASSIFICATION_MODE = "intersects"
+
+# Coverage mode: the minimum covered fraction of a tile for a function to be picked
+# (COVERAGE_MIN_FRACTIONS overrides it per function), and the function priorities: a function with
+# a higher priority wins over a larger coverage of a lower one, default 0
+COVERAGE_MIN_FRACTION = 0.3
+COVERAGE_MIN_FRACTIONS = {'school': 0.1, 'religious': 0.1, 'gov': 0.1}
+COVERAGE_PRIORITIES = {'school': 1, 'religious': 1, 'gov': 1}
+
+# The intersects mode tests parent cells of up to HIERARCHY_LEVELS coarser resolutions before the
+# tiles, for tile sets of at least HIERARCHY_MIN_TILES tiles
+HIERARCHY_LEVELS = 4
+HIERARCHY_MIN_TILES = 20_000
+
 NO_SOFTEN_TILE_FUNCTIONS = [ "road", "built", "school", "religious", "amenity", "food"]
+# Height rasters are read window by window: a window side in pixels, "blocks" for the file's native
+# blocks, or None for the raster under the tiles at once. RASTER_MAX_MEMORY_MB caps the buffers of a window
+# and the GDAL block cache, None for no cap
+RASTER_WINDOW_SIZE = None
+RASTER_MAX_MEMORY_MB = None
+
+# Output formats written at the end of a run: "csv", "parquet" and/or "arrow" (Arrow IPC), and
+# "delta" to publish only the tiles changed since the last delta publish. The columnar formats need pyarrow
+EXPORT_FORMATS = ["csv"]
+
+# Local store of fetched OSM features (GeoParquet + index), None to always query Overpass.
+# Requests inside an already fetched area and tag set are served from it; OFFLINE fails instead of fetching
+FEATURE_STORE_DIR = "feature_store"
+OFFLINE = False
+
+# Local .osm.pbf extract to read the features from instead of Overpass (needs pyosmium), None to query Overpass
+OSM_PBF_PATH = None
+
+# Directory of the per-stage checkpoints, stages whose inputs did not change are reloaded from it.
+# None recomputes every stage
+CHECKPOINT_DIR = "checkpoints"
+
+# Per-run JSON report of every stage (wall/CPU time, memory, counts, I/O), None to skip it.
+# TRACE_MEMORY adds tracemalloc peaks (slower), PROFILE_RUN dumps a cProfile .prof next to the report
+RUN_REPORT_DIR = "../Outputs/Reports"
+TRACE_MEMORY = False
+PROFILE_RUN = False
+
+# Run the per-tile stages on this many processes, partitioned by H3 parent cells of PARTITION_RES
+# (picked from the process count when None). None runs every stage serially
+PARALLEL_PROCESSES = None
+PARTITION_RES = None
+
+# Seed of the simulated dynamics and the random scores, the same seed gives the same values. None for
+# random ones. Set it when publishing deltas, random values change tiles on every run
+SIMULATION_SEED = None
+
 DEFAULT_LEVEL_HEIGHT_M = 3.0  # Default height per building level if height is not explicitly provided
 DEFAULT_BUILDING_HEIGHT_M = 12.1  # Default height for buildings without explicit height
 # OFFSET_LEFT = (1/111.320)*0.05
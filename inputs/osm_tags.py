@@ -146,3 +146,17 @@ government_tags = {
     "border_control": True,
     "customs": True
 }
+
+
+# Tags to query OSM for named features
+name_tags = {
+    "place": True,
+    "highway": True,
+    "natural": True,
+    "landuse": True,
+    "amenity": True,
+    "building": True,
+    "leisure": True,
+    "shop": True,
+    "tourism": True
+}
@@ -0,0 +1,146 @@
+import os
+import json
+import time
+import cProfile
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+# Spans of the current run, in start order, and the stack of open spans
+_spans = []
+_open_spans = []
+_run = {'started': None, 'profiler': None, 'traced_peak': 0}
+
+def _current_rss_mb():
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    # ru_maxrss is in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+@contextmanager
+def span(name):
+    """
+    Measure a pipeline stage or an inner loop.
+
+    Records wall time, CPU time, RSS before/after and peak, the tracemalloc peak when memory
+    tracing is on, and the counters added with `count` while the span is the innermost one.
+    Spans nest, the report names them by path, e.g. "heights/zonal_statistics".
+
+    Args:
+        name (str): The span name.
+    """
+    record = {
+        'name': '/'.join([open_span['name'] for open_span in _open_spans] + [name]),
+        'counts': {},
+    }
+    open_span = {'name': name, 'record': record, 'child_peak': 0}
+    _spans.append(record)
+    _open_spans.append(open_span)
+    if tracemalloc.is_tracing():
+        # The peak is reset for this span, keep the peak so far of the enclosing span (or of the run) first
+        peak_so_far = tracemalloc.get_traced_memory()[1]
+        if len(_open_spans) > 1:
+            _open_spans[-2]['child_peak'] = max(_open_spans[-2]['child_peak'], peak_so_far)
+        else:
+            _run['traced_peak'] = max(_run['traced_peak'], peak_so_far)
+        tracemalloc.reset_peak()
+        traced_before = tracemalloc.get_traced_memory()[0]
+    rss_before = _current_rss_mb()
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    try:
+        yield record['counts']
+    finally:
+        record['wall_s'] = round(time.perf_counter() - wall_start, 6)
+        record['cpu_s'] = round(time.process_time() - cpu_start, 6)
+        record['rss_before_mb'] = rss_before
+        record['rss_after_mb'] = _current_rss_mb()
+        record['peak_rss_mb'] = _peak_rss_mb()
+        _open_spans.pop()
+        if tracemalloc.is_tracing():
+            # Nested spans reset the tracemalloc peak, their peaks are carried up to the parent
+            traced_peak = max(tracemalloc.get_traced_memory()[1], open_span['child_peak'])
+            record['traced_peak_delta_mb'] = round((traced_peak - traced_before) / 2**20, 3)
+            if _open_spans:
+                _open_spans[-1]['child_peak'] = max(_open_spans[-1]['child_peak'], traced_peak)
+            else:
+                _run['traced_peak'] = max(_run['traced_peak'], traced_peak)
+
+def count(key, value=1):
+    """
+    Add to a counter of the innermost open span, e.g. features fetched or bytes read.
+
+    Args:
+        key (str): The counter name.
+        value (int | float): The amount to add.
+    """
+    if _open_spans:
+        counts = _open_spans[-1]['record']['counts']
+        counts[key] = counts.get(key, 0) + value
+
+def start_run(trace_memory=False, profile=False):
+    """
+    Start collecting a run report.
+
+    Args:
+        trace_memory (bool): Trace Python allocations with tracemalloc (slows the run down).
+        profile (bool): Run cProfile over the whole run, dumped next to the report.
+    """
+    _spans.clear()
+    _run['started'] = datetime.now()
+    _run['traced_peak'] = 0
+    if trace_memory:
+        tracemalloc.start()
+    if profile:
+        _run['profiler'] = cProfile.Profile()
+        _run['profiler'].enable()
+
+def write_report(report_dir, filename_prefix="run_report", extra=None):
+    """
+    Write the spans of the run as a JSON report, and the cProfile dump when profiling.
+
+    Args:
+        report_dir (str): The output directory.
+        filename_prefix (str): The prefix for the output file names.
+        extra (dict, optional): Run metadata to include, e.g. the resolution and tile count.
+
+    Returns:
+        str: The path of the JSON report.
+    """
+    os.makedirs(report_dir, exist_ok=True)
+    timestamp = (_run['started'] or datetime.now()).strftime('%Y%m%d_%H%M%S')
+    filename = f"{report_dir}/{filename_prefix}_{timestamp}.json"
+
+    report = {
+        'started': timestamp,
+        'run': extra or {},
+        'peak_rss_mb': _peak_rss_mb(),
+        'spans': _spans,
+    }
+
+    profiler = _run['profiler']
+    if profiler is not None:
+        profiler.disable()
+        report['profile'] = f"{report_dir}/{filename_prefix}_{timestamp}.prof"
+        profiler.dump_stats(report['profile'])
+        _run['profiler'] = None
+    if tracemalloc.is_tracing():
+        report['traced_peak_mb'] = round(max(_run['traced_peak'], tracemalloc.get_traced_memory()[1]) / 2**20, 3)
+        tracemalloc.stop()
+
+    with open(filename, 'w') as report_file:
+        json.dump(report, report_file, indent=2)
+
+    print(f"Wrote run report to {filename}")
+    return filename
@@ -1,71 +1,25 @@
-from shapely.geometry import Polygon
-from h3 import h3shape_to_cells, LatLngPoly, cell_to_latlng, grid_ring
+"""
+Build the tiles map of a bounding box.
 
-# internal  
+    python main.py
+    python main.py --bbox 34.7718 32.0753 34.7918 32.0853 --res 13 --stages functions roads names --export csv parquet
+
+Every option defaults to inputs/config.py. The pipeline can also be run from Python with
+run_pipeline(), heavy libraries (osmnx, rasterio, pyarrow...) are only imported by the stages
+and exports that use them.
+"""
+import os
+import argparse
+
+# internal
 from inputs.osm_tags import *
 from inputs.config import *
-from obtain_tile_function import process_multiple_tags, process_roads_and_assign_width
-from obtain_tile_dynamics import process_tags_and_append_dynamics, mark_flood_risk_tiles
-from obtain_height_and_grad_score import process_tile_heights, calculate_gradient_scores
-from csv_export import export_tiles_map_to_csv
-from obtain_tile_dim import process_building_heights_and_assign_width
-from obtain_tile_names import process_osm_names_and_assign_to_tiles
-
-from tile_dynamics_simulator import simulate_tile_dynamics
-import random
-
-
-# Create bounding box Polygon (lng, lat)
-# -----------------------------------------
-polygon = Polygon([
-    (BOUNDING_BOX['west'], BOUNDING_BOX['south']),
-    (BOUNDING_BOX['east'], BOUNDING_BOX['south']),
-    (BOUNDING_BOX['east'], BOUNDING_BOX['north']),
-    (BOUNDING_BOX['west'], BOUNDING_BOX['north']),
-    (BOUNDING_BOX['west'], BOUNDING_BOX['south'])
-])
-res15Poly = Polygon([
-    (ZOOM_IN_BBOX['west'], ZOOM_IN_BBOX['south']),
-    (ZOOM_IN_BBOX['east'], ZOOM_IN_BBOX['south']),
-    (ZOOM_IN_BBOX['east'], ZOOM_IN_BBOX['north']),
-    (ZOOM_IN_BBOX['west'], ZOOM_IN_BBOX['north']),
-    (ZOOM_IN_BBOX['west'], ZOOM_IN_BBOX['south'])  
-])
-
-# Convert to H3-compatible LatLngPoly (lat, lng)
-# -------------------------------------------------
-outer = [(lat, lng) for lng, lat in res15Poly.exterior.coords]
-if outer[0] != outer[-1]:
-    outer.append(outer[0])
-latlng_poly = LatLngPoly(outer)
-
-# Get H3 tiles and init structure
-# ----------------------------------
-tile_ids = h3shape_to_cells(latlng_poly, H3_RES)
-tile_count = len(tile_ids)
-print(f"H3 tiles count: {tile_count}")
-# Initialize a hash (dictionary) with each tile_id mapped to an empty object
-
-tiles_map = {tile_id: {
-    'id': tile_id,
-    'center': list(cell_to_latlng(tile_id)),
-    'neighbors': [neighbor for neighbor in grid_ring(tile_id, 1) if neighbor != tile_id],
-    'tile_function': 'na',  
-    'height': None, 
-    'score1': random.choices([0.1, 0.5, 1], weights=[0.99, 0.005, 0.005])[0] if SKIP_HEIGHTS else 0, 
-    'score2': random.choices([0.1, 0.5, 1], weights=[0.99, 0.005, 0.005])[0], 
-    'dynamics': [],  
-    'function_dimensions': 0.0, 
-    **({} if SKIP_HEIGHTS else {'hard_height': 0}),
-    'name1': '',
-    'name2': '',
-} for tile_id in tile_ids}
-
-# random Dynamics
-simulate_tile_dynamics(tiles_map)
-
-
-tags_and_functions = [
+
+# Stages in run order. "heights" covers the heights, the gradient scores and the flood marking
+STAGES = ["simulate", "functions", "roads", "dynamics", "dims", "heights", "names"]
+EXPORT_FORMAT_CHOICES = ["csv", "parquet", "arrow", "delta"]
+
+TAGS_AND_FUNCTIONS = [
     [buildings_tags, 'built'],
     [vegetation_tags, 'veg'],
     [parks_tags, 'park'],
@@ -75,23 +29,370 @@ tags_and_functions = [
     [water_tags, 'water'],
     [government_tags, 'gov']
 ]
-process_multiple_tags(tags_and_functions, polygon, tile_ids, tiles_map)
-process_roads_and_assign_width(polygon, tile_ids, tiles_map, roads_tags)
-tif_paths_with_functions = {
-    # "../Assets/dsm_clip.tif": ["na", "road", "veg", "park", "built", "school", "religious", "amenity", "water", "food", "gov"], #RES15
-    "../Assets/dtm_clip.tif": ["na", "road", "veg", "park", "built", "school", "religious", "amenity", "water", "food", "gov"], #RES12
-}
-tags_and_dynamics = [
+TAGS_AND_DYNAMICS = [
     [food_tags, "FOOD"],
 ]
-process_tags_and_append_dynamics(tags_and_dynamics, polygon, tile_ids, tiles_map)
-process_building_heights_and_assign_width(polygon, tile_ids, tiles_map)
 
-if not SKIP_HEIGHTS:
-    process_tile_heights(tif_paths_with_functions, tile_ids, tiles_map, SOFTENING_STRENGTH)
-    calculate_gradient_scores(tiles_map, tile_ids)
-    mark_flood_risk_tiles(tiles_map, tile_ids)
-    
-process_osm_names_and_assign_to_tiles(polygon, tile_ids, tiles_map)
+ALL_TILE_FUNCTIONS = ["na", "road", "veg", "park", "built", "school", "religious", "amenity", "water", "food", "gov"]
+TIF_PATHS_WITH_FUNCTIONS = {
+    # "../Assets/dsm_clip.tif": ALL_TILE_FUNCTIONS, #RES15
+    "../Assets/dtm_clip.tif": ALL_TILE_FUNCTIONS, #RES12
+}
+
+def default_stages():
+    """Get the stages run by default, every stage but the heights when SKIP_HEIGHTS is set."""
+    return [stage for stage in STAGES if not (SKIP_HEIGHTS and stage == "heights")]
+
+def bbox_polygon(bbox):
+    """
+    Create the (lng, lat) Polygon of a bounding box.
+
+    Args:
+        bbox (dict): 'north', 'south', 'east' and 'west' in degrees.
+
+    Returns:
+        Polygon: The bounding box polygon.
+    """
+    from shapely.geometry import Polygon
+    return Polygon([
+        (bbox['west'], bbox['south']),
+        (bbox['east'], bbox['south']),
+        (bbox['east'], bbox['north']),
+        (bbox['west'], bbox['north']),
+        (bbox['west'], bbox['south'])
+    ])
+
+def bbox_tile_ids(bbox, h3_res):
+    """
+    Get the H3 tiles of a bounding box.
+
+    Args:
+        bbox (dict): 'north', 'south', 'east' and 'west' in degrees.
+        h3_res (int): The H3 resolution.
+
+    Returns:
+        ndarray: uint64 H3 tile IDs.
+    """
+    from h3 import LatLngPoly
+    from h3.api.numpy_int import h3shape_to_cells
+
+    # Convert to H3-compatible LatLngPoly (lat, lng)
+    outer = [(lat, lng) for lng, lat in bbox_polygon(bbox).exterior.coords]
+    if outer[0] != outer[-1]:
+        outer.append(outer[0])
+    return h3shape_to_cells(LatLngPoly(outer), h3_res)
+
+def stage_tag_sets(tags_and_functions, tags_and_dynamics):
+    """Get the tags of every feature stage, fetched together in one request."""
+    return [
+        *(tags for tags, _ in tags_and_functions),
+        roads_tags,
+        *(tags for tags, _ in tags_and_dynamics),
+        built_heights_tags,
+        name_tags,
+    ]
+
+def run_pipeline(bbox=ZOOM_IN_BBOX, h3_res=H3_RES, stages=None, export_formats=EXPORT_FORMATS, output_dir=None,
+                 features_bbox=None, features=None, tags_and_functions=TAGS_AND_FUNCTIONS,
+                 tags_and_dynamics=TAGS_AND_DYNAMICS, tif_paths_with_functions=TIF_PATHS_WITH_FUNCTIONS,
+                 softening_strength=SOFTENING_STRENGTH, classification_mode=TILE_CLASSIFICATION_MODE,
+                 processes=PARALLEL_PROCESSES, partition_res=PARTITION_RES, osm_pbf_path=OSM_PBF_PATH,
+                 feature_store_dir=FEATURE_STORE_DIR, offline=OFFLINE, checkpoint_dir=CHECKPOINT_DIR,
+                 report_dir=RUN_REPORT_DIR, trace_memory=TRACE_MEMORY, profile=PROFILE_RUN,
+                 simulation_seed=SIMULATION_SEED):
+    """
+    Build the tiles map of a bounding box and export it.
+
+    Args:
+        bbox (dict): The tiles bounding box, 'north', 'south', 'east' and 'west' in degrees.
+        h3_res (int): The H3 resolution.
+        stages (list, optional): Stages to run, from STAGES. None runs default_stages().
+        export_formats (list): Output formats, from EXPORT_FORMAT_CHOICES. Empty skips the export.
+        output_dir (str, optional): Directory of the exports (CSVs, Columnar and Deltas sub-directories),
+            None for ../Outputs.
+        features_bbox (dict, optional): Bounding box of the OSM features, None for `bbox`.
+        features (GeoDataFrame, optional): Pre-fetched OSM features covering every stage's tags,
+            None to fetch them on first use.
+        tags_and_functions (list): A list of [tags_dict, tile_function] pairs.
+        tags_and_dynamics (list): A list of [tags_dict, dynamic_value] pairs.
+        tif_paths_with_functions (dict): Height rasters, see process_tile_heights.
+        softening_strength (int): The strength of the height softening.
+        classification_mode (str): See process_multiple_tags.
+        processes (int, optional): Run the per-tile stages on this many processes, None runs serially.
+        partition_res (int, optional): H3 resolution of the parallel partitions.
+        osm_pbf_path (str, optional): Local .osm.pbf extract to read the features from.
+        feature_store_dir (str, optional): Local feature store directory, None to always query Overpass.
+        offline (bool): Fail instead of fetching when the feature store does not cover the request.
+        checkpoint_dir (str, optional): Directory of the stage checkpoints, None recomputes every stage.
+        report_dir (str, optional): Directory of the run report, None to skip it.
+        trace_memory (bool): Add tracemalloc peaks to the run report.
+        profile (bool): Dump a cProfile .prof next to the run report.
+        simulation_seed (int, optional): Seed of the simulated dynamics and the random scores, None for random ones.
+
+    Returns:
+        TileTable: The tiles map.
+    """
+    import numpy as np
+    from tile_table import TileTable
+    from checkpoints import StageCheckpoints, file_fingerprint
+    from instrumentation import span, start_run, write_report
+
+    stages = default_stages() if stages is None else list(stages)
+    unknown_stages = set(stages) - set(STAGES)
+    if unknown_stages:
+        raise ValueError(f"Unknown stages: {sorted(unknown_stages)}")
+
+    if report_dir is not None:
+        start_run(trace_memory, profile)
+
+    polygon = bbox_polygon(features_bbox or bbox)
+
+    # Get H3 tiles and init structure
+    # ----------------------------------
+    with span("tiles"):
+        tile_ids = bbox_tile_ids(bbox, h3_res)
+        tile_count = len(tile_ids)
+        print(f"H3 tiles count: {tile_count}")
+        # Columnar tile table, every stage reads and writes it
+        tile_table = TileTable(tile_ids)
+    # Random scores, drawn from the simulation seed so seeded runs publish no spurious deltas
+    score_rng = np.random.default_rng(simulation_seed)
+    score_choices = np.array([0.1, 0.5, 1])
+    score_weights = [0.99, 0.005, 0.005]
+    tile_table.score2[:] = score_rng.choice(score_choices, size=tile_count, p=score_weights)
+    if "heights" not in stages:
+        tile_table.score1[:] = score_rng.choice(score_choices, size=tile_count, p=score_weights)
+
+    if "simulate" in stages:
+        from tile_dynamics_simulator import simulate_tile_dynamics
+        # random Dynamics
+        with span("simulate_dynamics"):
+            simulate_tile_dynamics(tile_table, simulation_seed)
+
+    # Fetch the features of every stage in one request on first use, each stage selects its own view.
+    # A run with every stage checkpointed needs none
+    tag_sets = stage_tag_sets(tags_and_functions, tags_and_dynamics)
+    loaded_features = [features]
+
+    def load_osm_features():
+        if loaded_features[0] is None:
+            if osm_pbf_path is not None:
+                # pyosmium is optional, only needed for offline extracts
+                from osm_pbf import fetch_features_from_pbf
+                loaded_features[0] = fetch_features_from_pbf(osm_pbf_path, polygon, tag_sets)
+            elif feature_store_dir is not None:
+                from feature_store import fetch_features_with_store
+                loaded_features[0] = fetch_features_with_store(polygon, tag_sets, feature_store_dir, offline)
+            else:
+                from osm_features import fetch_features
+                loaded_features[0] = fetch_features(polygon, tag_sets)
+        return loaded_features[0]
+
+    # Stage checkpoints, keyed by the inputs of every stage and of the stages it depends on
+    checkpoints = StageCheckpoints(checkpoint_dir, tile_table, [tile_table.tile_ids])
+    feature_inputs = [polygon.wkt, file_fingerprint(osm_pbf_path)]
+    raster_inputs = {path: [functions, file_fingerprint(path)] for path, functions in tif_paths_with_functions.items()}
+    run_heights = "heights" in stages
+    # The classification settings read by the selected mode
+    classification_inputs = [classification_mode]
+    if classification_mode == "coverage":
+        classification_inputs += [COVERAGE_MIN_FRACTION, COVERAGE_MIN_FRACTIONS, COVERAGE_PRIORITIES]
+
+    # The partitioned driver runs every feature stage, a partial selection runs serially
+    partitioned_stages = {"functions", "roads", "dynamics", "dims", "names"}
+    if processes and not partitioned_stages <= set(stages):
+        print("A parallel run covers every feature stage, running the selected stages serially")
+        processes = None
+
+    if processes:
+        from parallel_pipeline import run_partitioned_stages
+        checkpoints.run(
+            "partitioned",
+            [feature_inputs, tag_sets, tags_and_functions, tags_and_dynamics, classification_inputs,
+             raster_inputs if run_heights else None, softening_strength, NO_SOFTEN_TILE_FUNCTIONS, LANE_WIDTH_M,
+             DEFAULT_LEVEL_HEIGHT_M, DEFAULT_BUILDING_HEIGHT_M],
+            ['function_codes', 'function_dimensions', 'hard_height', 'height', 'name1_codes', 'name2_codes']
+            + (['score1'] if run_heights else []),
+            lambda: run_partitioned_stages(tile_table, polygon, load_osm_features(), tags_and_functions, tags_and_dynamics,
+                                           roads_tags, tif_paths_with_functions if run_heights else None,
+                                           classification_mode, softening_strength, processes=processes,
+                                           parent_res=partition_res),
+            appends_dynamics=True,
+        )
+    else:
+        if "functions" in stages:
+            from obtain_tile_function import process_multiple_tags
+            checkpoints.run(
+                "multiple_tags", [feature_inputs, tags_and_functions, classification_inputs], ['function_codes'],
+                lambda: process_multiple_tags(tags_and_functions, polygon, tile_table, load_osm_features(), classification_mode),
+            )
+        if "roads" in stages:
+            from obtain_tile_function import process_roads_and_assign_width
+            checkpoints.run(
+                "roads", [feature_inputs, roads_tags, LANE_WIDTH_M], ['function_codes', 'function_dimensions'],
+                lambda: process_roads_and_assign_width(polygon, tile_table, roads_tags, load_osm_features()),
+                depends_on=["multiple_tags"],
+            )
+        if "dynamics" in stages:
+            from obtain_tile_dynamics import process_tags_and_append_dynamics
+            checkpoints.run(
+                "dynamics", [feature_inputs, tags_and_dynamics], [],
+                lambda: process_tags_and_append_dynamics(tags_and_dynamics, polygon, tile_table, load_osm_features()),
+                appends_dynamics=True,
+            )
+        if "dims" in stages:
+            from obtain_tile_dim import process_building_heights_and_assign_width
+            checkpoints.run(
+                "dims", [feature_inputs, built_heights_tags, DEFAULT_LEVEL_HEIGHT_M, DEFAULT_BUILDING_HEIGHT_M],
+                ['function_dimensions'],
+                lambda: process_building_heights_and_assign_width(polygon, tile_table, load_osm_features()),
+                depends_on=["roads"],
+            )
+
+        if run_heights:
+            from obtain_height_and_grad_score import process_tile_heights, calculate_gradient_scores
+            from obtain_tile_dynamics import mark_flood_risk_tiles
+            checkpoints.run(
+                "heights", [raster_inputs, softening_strength, NO_SOFTEN_TILE_FUNCTIONS], ['hard_height', 'height'],
+                lambda: process_tile_heights(tif_paths_with_functions, tile_table, softening_strength),
+                depends_on=["roads"],
+            )
+            checkpoints.run(
+                "gradient", [NO_SOFTEN_TILE_FUNCTIONS], ['score1'],
+                lambda: calculate_gradient_scores(tile_table),
+                depends_on=["heights"],
+            )
+            checkpoints.run(
+                "flood", [], [],
+                lambda: mark_flood_risk_tiles(tile_table),
+                depends_on=["heights"], appends_dynamics=True,
+            )
+
+        if "names" in stages:
+            from obtain_tile_names import process_osm_names_and_assign_to_tiles
+            checkpoints.run(
+                "names", [feature_inputs, name_tags], ['name1_codes', 'name2_codes'],
+                lambda: process_osm_names_and_assign_to_tiles(polygon, tile_table, load_osm_features()),
+            )
+
+    with span("export"):
+        export_tiles_map(tile_table, export_formats, output_dir)
+
+    if report_dir is not None:
+        write_report(report_dir, extra={
+            'h3_res': h3_res,
+            'tiles': tile_count,
+            'bounding_box': bbox,
+            'stages': stages,
+            'parallel_processes': processes,
+        })
+
+    return tile_table
+
+def export_tiles_map(tile_table, export_formats, output_dir=None):
+    """
+    Export the tiles map in every requested format.
+
+    Args:
+        tile_table (TileTable): The tiles of the area of interest.
+        export_formats (list): Output formats, from EXPORT_FORMAT_CHOICES.
+        output_dir (str, optional): Directory of the exports, None for each export's default directory.
+    """
+    def format_dir(name):
+        return {} if output_dir is None else {'output_dir': os.path.join(output_dir, name)}
+
+    if "csv" in export_formats:
+        from csv_export import export_tiles_map_to_csv
+        export_tiles_map_to_csv(tile_table, **format_dir("CSVs"))
+    for file_format in ("parquet", "arrow"):
+        if file_format in export_formats:
+            # pyarrow is optional, only needed for the columnar exports
+            from columnar_export import export_tiles_map_to_columnar
+            export_tiles_map_to_columnar(tile_table, file_format=file_format, **format_dir("Columnar"))
+    if "delta" in export_formats:
+        from delta_export import export_tiles_map_delta
+        export_tiles_map_delta(tile_table, **format_dir("Deltas"))
+
+def parse_args(argv=None):
+    """
+    Parse the command line, every option defaults to inputs/config.py.
+
+    Args:
+        argv (list, optional): The arguments, None for sys.argv.
+
+    Returns:
+        Namespace: The parsed arguments.
+    """
+    parser = argparse.ArgumentParser(description="Build the H3 tiles map of a bounding box.")
+    parser.add_argument("--bbox", type=float, nargs=4, metavar=("WEST", "SOUTH", "EAST", "NORTH"),
+                        help="tiles bounding box in degrees, ZOOM_IN_BBOX when omitted")
+    parser.add_argument("--features-bbox", type=float, nargs=4, metavar=("WEST", "SOUTH", "EAST", "NORTH"),
+                        help="OSM features bounding box, --bbox when given, otherwise BOUNDING_BOX")
+    parser.add_argument("--res", type=int, default=H3_RES, help="H3 resolution")
+    parser.add_argument("--softening", type=int, default=SOFTENING_STRENGTH, help="height softening strength")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=None,
+                        help=f"stages to run, all but heights when SKIP_HEIGHTS (default: {' '.join(default_stages())})")
+    parser.add_argument("--skip", nargs="+", choices=STAGES, default=[], help="stages to leave out")
+    parser.add_argument("--mode", choices=["intersects", "polyfill", "coverage"], default=TILE_CLASSIFICATION_MODE,
+                        help="tile classification mode")
+    parser.add_argument("--export", nargs="*", choices=EXPORT_FORMAT_CHOICES, default=EXPORT_FORMATS,
+                        help="output formats, none to skip the export")
+    parser.add_argument("--output-dir", default=None, help="export directory (default: ../Outputs)")
+    parser.add_argument("--dtm", default=None, help="height raster used for every tile function")
+    parser.add_argument("--processes", type=int, default=PARALLEL_PROCESSES, help="parallel worker processes")
+    parser.add_argument("--partition-res", type=int, default=PARTITION_RES, help="H3 resolution of the partitions")
+    parser.add_argument("--pbf", default=OSM_PBF_PATH, help="local .osm.pbf extract to read the features from")
+    parser.add_argument("--feature-store", default=FEATURE_STORE_DIR, help="local feature store directory")
+    parser.add_argument("--no-feature-store", action="store_true", help="always query Overpass")
+    parser.add_argument("--offline", action="store_true", default=OFFLINE, help="never query Overpass")
+    parser.add_argument("--checkpoint-dir", default=CHECKPOINT_DIR, help="stage checkpoints directory")
+    parser.add_argument("--no-checkpoints", action="store_true", help="recompute every stage")
+    parser.add_argument("--report-dir", default=RUN_REPORT_DIR, help="run report directory")
+    parser.add_argument("--no-report", action="store_true", help="skip the run report")
+    parser.add_argument("--trace-memory", action="store_true", default=TRACE_MEMORY, help="add tracemalloc peaks to the report")
+    parser.add_argument("--profile", action="store_true", default=PROFILE_RUN, help="dump a cProfile .prof next to the report")
+    parser.add_argument("--seed", type=int, default=SIMULATION_SEED, help="seed of the simulated dynamics and random scores")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    """Run the pipeline from the command line."""
+    args = parse_args(argv)
+
+    def to_bbox(values):
+        west, south, east, north = values
+        return {'north': north, 'south': south, 'east': east, 'west': west}
+
+    bbox = ZOOM_IN_BBOX if args.bbox is None else to_bbox(args.bbox)
+    if args.features_bbox is not None:
+        features_bbox = to_bbox(args.features_bbox)
+    else:
+        features_bbox = BOUNDING_BOX if args.bbox is None else bbox
+    stages = [stage for stage in (args.stages or default_stages()) if stage not in args.skip]
+    tif_paths_with_functions = TIF_PATHS_WITH_FUNCTIONS
+    if args.dtm is not None:
+        tif_paths_with_functions = {args.dtm: ALL_TILE_FUNCTIONS}
+
+    run_pipeline(
+        bbox=bbox,
+        h3_res=args.res,
+        stages=stages,
+        export_formats=args.export,
+        output_dir=args.output_dir,
+        features_bbox=features_bbox,
+        tif_paths_with_functions=tif_paths_with_functions,
+        softening_strength=args.softening,
+        classification_mode=args.mode,
+        processes=args.processes,
+        partition_res=args.partition_res,
+        osm_pbf_path=args.pbf,
+        feature_store_dir=None if args.no_feature_store else args.feature_store,
+        offline=args.offline,
+        checkpoint_dir=None if args.no_checkpoints else args.checkpoint_dir,
+        report_dir=None if args.no_report else args.report_dir,
+        trace_memory=args.trace_memory,
+        profile=args.profile,
+        simulation_seed=args.seed,
+    )
 
-export_tiles_map_to_csv(tiles_map)
\ No newline at end of file
+if __name__ == "__main__":
+    main()
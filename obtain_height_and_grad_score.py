@@ -1,142 +1,149 @@
-from shapely.geometry import Polygon, mapping
-from h3 import grid_disk
-from h3.api.basic_str import cell_to_boundary
-import rasterio
 import numpy as np
-import pyproj
-from shapely.ops import transform as shapely_transform
-from rasterio.mask import mask
 from inputs.config import *
+from tile_adjacency import csr_rows
+from instrumentation import span, count
 
-def soften_tile_heights(tiles_map, tile_ids, disk_k=2):
+def soften_tile_heights(tile_table, disk_k=2):
     """
     Soften the height values of tiles by averaging with their neighbors.
 
+    The disk sums are one sparse product over the precomputed k-ring adjacency, tiles in
+    NO_SOFTEN_TILE_FUNCTIONS are masked out of the update.
+
     Args:
-        tiles_map (dict): The dictionary containing tile data.
-        tile_ids (list): List of H3 tile IDs.
+        tile_table (TileTable): The tiles of the area of interest.
         disk_k (int): The strength of the softening, determines the radius of neighbors to consider.
 
     Returns:
-        None: Updates the `height` in `tiles_map` in place.
+        None: Updates `height` in `tile_table` in place.
     """
-    for h3_id in tile_ids:
-        # Skip tiles with tile_function values in the NO_SOFTEN_TILE_FUNCTIONS list
-        if tiles_map[h3_id]['tile_function'] in NO_SOFTEN_TILE_FUNCTIONS:
-            continue
-
-        # Get neighbors' heights within the specified disk radius
-        neighbors_heights = []
-        for neighbor_id in grid_disk(h3_id, disk_k):
-            if neighbor_id in tiles_map and tiles_map[neighbor_id] is not None and tiles_map[neighbor_id]['hard_height'] is not None:
-                neighbors_heights.append(tiles_map[neighbor_id]['hard_height'])
-
-        # Calculate average height
-        if len(neighbors_heights) > 0:
-            avg_height = (tiles_map[h3_id]['hard_height'] + sum(neighbors_heights)) / len(neighbors_heights)
-            tiles_map[h3_id]['height'] = avg_height
-
-def process_tile_heights(tif_paths_with_functions, tile_ids, tiles_map, softening_disk_k=2):
+    indptr, indices = tile_table.geometry.adjacency(disk_k)
+    rows = csr_rows(indptr)
+    hard_heights = tile_table.hard_height
+    soften = ~tile_table.has_function(NO_SOFTEN_TILE_FUNCTIONS)
+
+    # Sum and count of the known heights in every disk, the disk includes the tile itself
+    neighbor_heights = hard_heights[indices]
+    known = ~np.isnan(neighbor_heights)
+    sums = np.bincount(rows, weights=np.where(known, neighbor_heights, 0.0), minlength=len(tile_table))
+    counts = np.bincount(rows, weights=known, minlength=len(tile_table))
+
+    # Calculate average height
+    softened = soften & (counts > 0)
+    tile_table.height[softened] = (hard_heights[softened] + sums[softened]) / counts[softened]
+
+def process_tile_heights(tif_paths_with_functions, tile_table, softening_disk_k=2,
+                         window_size=RASTER_WINDOW_SIZE, max_memory_mb=RASTER_MAX_MEMORY_MB):
     """
-    Process tile heights using multiple GeoTIFF files and update the tiles_map with height data based on tile_function.
+    Process tile heights using multiple GeoTIFF files and update the tile table with height data based on tile_function.
 
     Args:
         tif_paths_with_functions (dict): A dictionary where keys are GeoTIFF file paths and values are lists of tile_function values.
-        tile_ids (list): List of H3 tile IDs.
-        tiles_map (dict): The dictionary mapping H3 tile IDs to their properties.
+        tile_table (TileTable): The tiles of the area of interest.
         softening_disk_k (int): The strength of the softening, determines the radius of neighbors to consider.
+            None skips the softening, for callers that soften after merging partitions.
+        window_size (int | str, optional): Raster window side in pixels, "blocks" for the native blocks,
+            None to read each raster at once.
+        max_memory_mb (int, optional): Memory ceiling for the raster window buffers and the GDAL cache.
 
     Returns:
-        None: Updates the `height` in `tiles_map` in place.
+        None: Updates `height` and `hard_height` in `tile_table` in place.
     """
+    # rasterio is only needed to read the height rasters, softening and gradients run without it
+    import rasterio
+    from zonal_stats import zonal_statistics
+
     tiles_height_count = 0
 
+    # Tiles without raster data count as 0 m in the softening
+    tile_table.hard_height[:] = 0
+
+    # Keep the GDAL block cache within a quarter of the memory ceiling, the window buffers get the rest
+    max_memory_bytes = None
+    gdal_options = {}
+    if max_memory_mb is not None:
+        max_memory_bytes = max_memory_mb * 1024 * 1024 * 3 // 4
+        gdal_options['GDAL_CACHEMAX'] = max(1, max_memory_mb // 4)
+
     for tif_path, functions in tif_paths_with_functions.items():
-        with rasterio.open(tif_path) as topographic_data:
-            raster_crs = topographic_data.crs
-            project = pyproj.Transformer.from_crs("EPSG:4326", raster_crs, always_xy=True).transform
-
-            for h3_id in tile_ids:
-                # Only process tiles with matching tile_function
-                if tiles_map[h3_id]['tile_function'] not in functions:
-                    continue
-
-                boundary = cell_to_boundary(h3_id)
-                boundary_shapely = [(lng, lat) for lat, lng in boundary]
-                h3_polygon = Polygon(boundary_shapely)
-
-                # Re-project to raster CRS
-                h3_poly_proj = shapely_transform(project, h3_polygon)
-                try:
-                    out_image, out_transform = mask(topographic_data, [mapping(h3_poly_proj)], crop=True)
-
-                    # Convert each band to uint32 for math
-                    r = out_image[0].astype(np.uint32)
-                    g = out_image[1].astype(np.uint32)
-                    b = out_image[2].astype(np.uint32)
-
-                    # elevation = (0.299* r) + (0.587* g) + (0.114* b)
-                    elevation = r
-                    masked = np.ma.masked_equal(elevation, topographic_data.nodata)
-
-                    if masked.count() > 0:
-                        avg_height = round(float(masked.mean()), 2)
-                        # Assign the height to the tile
-                        tiles_map[h3_id]['hard_height'] = avg_height
-                        tiles_map[h3_id]['height'] = avg_height
-                        tiles_height_count += 1
-
-                except Exception as e:
-                    print(f"Skipping H3 cell {h3_id} due to error: {e}")
+        with rasterio.Env(**gdal_options), rasterio.open(tif_path) as topographic_data:
+            # Only process tiles with matching tile_function
+            rows = np.flatnonzero(tile_table.has_function(functions))
+            tile_polygons_proj = tile_table.geometry.projected(topographic_data.crs)[rows]
+
+            # Mean of the first band per tile, all tiles at once. The band is an RGB-encoded
+            # elevation where the red channel carries the height
+            # elevation = (0.299* r) + (0.587* g) + (0.114* b)
+            stats = zonal_statistics(topographic_data, tile_polygons_proj, band=1, dtype=np.uint32,
+                                     window_size=window_size, max_memory_bytes=max_memory_bytes)
+
+            # Assign the height to the tiles
+            with_height = stats['count'] > 0
+            avg_heights = np.round(stats['mean'][with_height], 2)
+            tile_table.hard_height[rows[with_height]] = avg_heights
+            tile_table.height[rows[with_height]] = avg_heights
+            tiles_height_count += int(with_height.sum())
 
     # Soften the heights
-    soften_tile_heights(tiles_map, tile_ids, disk_k=softening_disk_k)
-
-    # Clean up the tiles_map by removing the hard_height key
-    for h3_id in tile_ids:
-        if 'hard_height' in tiles_map[h3_id]:
-            del tiles_map[h3_id]['hard_height']
+    if softening_disk_k is not None:
+        with span("soften"):
+            soften_tile_heights(tile_table, disk_k=softening_disk_k)
 
     print(f"Total tiles with height: {tiles_height_count}")
+    count('tiles_hit', tiles_height_count)
+
+def gradient_height_differences(tile_table):
+    """
+    Get the height difference of every scored tile with its highest neighbor.
+
+    Tiles with a tile_function in NO_SOFTEN_TILE_FUNCTIONS are not scored and are not used as neighbors.
+
+    Args:
+        tile_table (TileTable): The tiles of the area of interest.
+
+    Returns:
+        tuple: (updated, height_diffs). A boolean mask of the scored tiles and their height differences.
+    """
+    indptr, indices = tile_table.geometry.adjacency(1, include_center=False)
+    rows = csr_rows(indptr)
+    heights = tile_table.height
+    scored = ~tile_table.has_function(NO_SOFTEN_TILE_FUNCTIONS)
+
+    # Highest neighbor height per tile, over neighbors with a height that are not skipped themselves
+    usable = ~np.isnan(heights[indices]) & scored[indices]
+    max_neighbor_heights = np.full(len(tile_table), -np.inf)
+    np.maximum.at(max_neighbor_heights, rows[usable], heights[indices[usable]])
+
+    updated = scored & np.isfinite(max_neighbor_heights)
+    return updated, np.abs(heights[updated] - max_neighbor_heights[updated])
+
+def normalize_gradient_scores(tile_table, height_diffs):
+    """
+    Normalize `score1` to values between 0 and 1, based on the max height difference.
+
+    Args:
+        tile_table (TileTable): The tiles of the area of interest.
+        height_diffs (ndarray): The height differences of all scored tiles.
+    """
+    max_height_diff = np.nanmax(height_diffs) if np.any(~np.isnan(height_diffs)) else 0
+
+    if max_height_diff > 0:  # Avoid division by zero
+        tile_table.score1[:] = np.round(tile_table.score1 / max_height_diff, 2)
 
-def calculate_gradient_scores(tiles_map, tile_ids):
+def calculate_gradient_scores(tile_table):
     """
     Calculate gradient scores for tiles based on the height difference with their neighbors,
     while avoiding tiles with tile_function values in NO_SOFTEN_TILE_FUNCTIONS.
 
     Args:
-        tiles_map (dict): The dictionary containing tile data.
-        tile_ids (list): List of H3 tile IDs.
+        tile_table (TileTable): The tiles of the area of interest.
 
     Returns:
-        None: Updates the `score1` in `tiles_map` in place.
+        None: Updates `score1` in `tile_table` in place.
     """
-    max_height_diff = 0
-
-    for h3_id in tile_ids:
-        # Skip tiles with tile_function values in NO_SOFTEN_TILE_FUNCTIONS
-        if tiles_map[h3_id]['tile_function'] in NO_SOFTEN_TILE_FUNCTIONS:
-            continue
-
-        # Get neighbors' heights
-        neighbors_heights = []
-        for neighbor_id in tiles_map[h3_id]['neighbors']:
-            if (
-                neighbor_id in tiles_map and
-                tiles_map[neighbor_id] is not None and
-                tiles_map[neighbor_id]['height'] is not None and
-                tiles_map[neighbor_id]['tile_function'] not in NO_SOFTEN_TILE_FUNCTIONS
-            ):
-                neighbors_heights.append(tiles_map[neighbor_id]['height'])
-
-        # Calculate gradient score
-        if len(neighbors_heights) > 0:
-            height_diff = abs(tiles_map[h3_id]['height'] - max(neighbors_heights))
-            if height_diff > max_height_diff:
-                max_height_diff = height_diff
-            tiles_map[h3_id]['score1'] = height_diff
+    # Calculate gradient score
+    updated, height_diffs = gradient_height_differences(tile_table)
+    tile_table.score1[updated] = height_diffs
 
     # Normalize gradient score (values between 0 and 1, based on max height difference)
-    for h3_id in tile_ids:
-        if max_height_diff > 0:  # Avoid division by zero
-            tiles_map[h3_id]['score1'] = round(tiles_map[h3_id]['score1'] / max_height_diff, 2)
+    normalize_gradient_scores(tile_table, height_diffs)
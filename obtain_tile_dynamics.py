@@ -1,68 +1,53 @@
-import osmnx as ox
-from shapely.geometry import Polygon
 from shapely.ops import unary_union
-from shapely.prepared import prep
-from h3.api.basic_str import cell_to_boundary
+import numpy as np
 import time
+from osm_features import features_for_tags
+from instrumentation import count
 
-def process_tags_and_append_dynamics(tags_and_dynamics, polygon, tile_ids, tiles_map):
+def process_tags_and_append_dynamics(tags_and_dynamics, polygon, tile_table, features=None):
     """
-    Process multiple tags and append values to the dynamics field for tiles that intersect with the features.
+    Process multiple tags and append values to the dynamics of tiles that intersect with the features.
 
     Args:
         tags_and_dynamics (list): A list of [tags_dict, dynamic_value] pairs.
         polygon (Polygon): The bounding polygon for the area of interest.
-        tile_ids (list): List of H3 tile IDs.
-        tiles_map (dict): The dictionary mapping H3 tile IDs to their properties.
+        tile_table (TileTable): The tiles of the area of interest.
+        features (GeoDataFrame, optional): Shared features from osm_features.fetch_features.
 
     Returns:
-        None: Updates the `dynamics` in `tiles_map` in place.
+        None: Appends to the dynamics of `tile_table` in place.
     """
-    # Prepare a dictionary to store prepared geometries for each dynamic value
-    prepped_features = {}
-
-    # Create prep objects for each tag set
     for tags, dynamic_value in tags_and_dynamics:
         print(f"Fetching data for dynamic value: {dynamic_value}...")
         try:
-            geo_data_frames = ox.features_from_polygon(polygon, tags=tags)
-            features = list(geo_data_frames.geometry)
-            print(f"Total features for {dynamic_value}: {len(features)}")
+            geo_data_frames = features_for_tags(polygon, tags, features)
+            dynamic_features = list(geo_data_frames.geometry)
+            print(f"Total features for {dynamic_value}: {len(dynamic_features)}")
+            count(f'features_{dynamic_value}', len(dynamic_features))
 
-            # Create a union of all features and prepare it for intersection checks
-            features_union = unary_union(features)
-            prepped_features[dynamic_value] = prep(features_union)
+            # Test all tiles at once against the union of the features
+            hits = tile_table.geometry.intersects(unary_union(dynamic_features))
         except Exception as e:
             print(f"Error processing {dynamic_value}: {e}, skipping.")
             continue
 
-    # Iterate over H3 tiles and append dynamics for intersecting features
-    for h3_id in tile_ids:
-        boundary = cell_to_boundary(h3_id)
-        boundary_shapely = [(lng, lat) for lat, lng in boundary]
-        h3_polygon = Polygon(boundary_shapely)
-
-        # Check intersections for all dynamic values
-        for dynamic_value, features_prep in prepped_features.items():
-            if features_prep.intersects(h3_polygon):
-                tiles_map[h3_id]['dynamics'].append({'type': dynamic_value, 'timestamp': time.time()})
+        # Append the dynamic value to intersecting tiles
+        count(f'tiles_{dynamic_value}', int(hits.sum()))
+        tile_table.append_dynamics(np.flatnonzero(hits), dynamic_value, int(time.time() * 1000))
 
-def mark_flood_risk_tiles(tiles_map, tile_ids, flood_risk_percentage=0.02):
+def mark_flood_risk_tiles(tile_table, flood_risk_percentage=0.02):
     """
     Mark the lowest percentage of tiles as flood risk based on their height.
 
     Args:
-        tiles_map (dict): The dictionary containing tile data.
-        tile_ids (list): List of H3 tile IDs.
+        tile_table (TileTable): The tiles of the area of interest.
         flood_risk_percentage (float): The percentage of tiles to mark as flood risk.
 
     Returns:
-        None: Updates the `dynamics` in `tiles_map` in place.
+        None: Appends to the dynamics of `tile_table` in place.
     """
-    # Sort tiles by height
-    sorted_tiles = sorted(tile_ids, key=lambda x: tiles_map[x]['height'])
-    num_flood_risk_tiles = int(len(sorted_tiles) * flood_risk_percentage)
+    # Sort tiles by height, tiles without height last
+    sorted_rows = np.argsort(tile_table.height, kind='stable')
+    num_flood_risk_tiles = int(len(sorted_rows) * flood_risk_percentage)
 
-    for i in range(num_flood_risk_tiles):
-        h3_id = sorted_tiles[i]
-        tiles_map[h3_id]['dynamics'].append({'type': "FLOODED", 'timestamp': time.time()})
+    tile_table.append_dynamics(np.sort(sorted_rows[:num_flood_risk_tiles]), "FLOODED", int(time.time() * 1000))
@@ -1,56 +1,192 @@
-import osmnx as ox
-from shapely.geometry import Polygon, mapping
 from shapely.ops import unary_union
-from shapely.prepared import prep
-from h3.api.basic_str import cell_to_boundary
-import math
+import numpy as np
+import shapely
+from shapely import STRtree
 from inputs.config import *
+from osm_features import features_for_tags, numeric_tag_values
+from tile_geometry import features_to_cells, project_geometries
+from instrumentation import span, count
 
-def process_multiple_tags(tags_and_functions, polygon, tile_ids, tiles_map):
+def process_multiple_tags(tags_and_functions, polygon, tile_table, features=None, mode="intersects"):
     """
-    Process multiple tags and update tiles_map with intersections for all tile functions.
+    Process multiple tags and update the tile_function of tiles intersecting each tag set.
+
+    In the intersects and polyfill modes, when several functions hit a tile, the last one in
+    `tags_and_functions` wins. The coverage mode picks the function covering most of the tile.
 
     Args:
         tags_and_functions (list): A list of [tags_dict, tile_function] pairs.
         polygon (Polygon): The bounding polygon for the area of interest.
-        tile_ids (list): List of H3 tile IDs.
-        tiles_map (dict): The dictionary mapping H3 tile IDs to their properties.
+        tile_table (TileTable): The tiles of the area of interest.
+        features (GeoDataFrame, optional): Shared features from osm_features.fetch_features.
+        mode (str): "intersects" tests every tile against the union of each tag set,
+            "polyfill" converts the features to H3 cells and works by set operations,
+            "coverage" measures the area of every tile covered by each tag set, see
+            assign_functions_by_coverage.
     """
-    # Prepare a dictionary to store prepared geometries for each tile_function
-    prepped_features = {}
-
-    # Create prep objects for each tag set
+    # Collect the features of each tile_function
+    function_features = {}
     for tags, tile_function in tags_and_functions:
         print(f"fetching {tile_function} data...")
-        try: 
-            geo_data_frames = ox.features_from_polygon(polygon, tags=tags)
-            features = list(geo_data_frames.geometry)
-            print(f"Total features for {tile_function}: {len(features)}")
-
-            # Create a union of all features and prepare it for intersection checks
-            features_union = unary_union(features)
-            prepped_features[tile_function] = prep(features_union)
+        try:
+            geo_data_frames = features_for_tags(polygon, tags, features)
+            function_features[tile_function] = list(geo_data_frames.geometry)
+            print(f"Total features for {tile_function}: {len(function_features[tile_function])}")
+            count(f'features_{tile_function}', len(function_features[tile_function]))
         except Exception as e:
             print(f"Error processing {tile_function}: {e}, skipping.")
             continue
 
-    # Iterate over H3 tiles once and check for intersections with all feature types
-    tiles_with_functions_count = {tile_function: 0 for _, tile_function in tags_and_functions}
+    with span(f"assign_by_{mode}"):
+        if mode == "polyfill":
+            tiles_with_functions_count = assign_functions_by_polyfill(function_features, tile_table)
+        elif mode == "intersects":
+            tiles_with_functions_count = assign_functions_by_intersects(function_features, tile_table)
+        elif mode == "coverage":
+            tiles_with_functions_count = assign_functions_by_coverage(function_features, tile_table)
+        else:
+            raise ValueError(f"Unknown tile classification mode: {mode}")
 
-    for h3_id in tile_ids:
-        boundary = cell_to_boundary(h3_id)
-        boundary_shapely = [(lng, lat) for lat, lng in boundary]
-        h3_polygon = Polygon(boundary_shapely)
+    # Print summary of results
+    for _, tile_function in tags_and_functions:
+        print(f"Total tiles with {tile_function}: {tiles_with_functions_count.get(tile_function, 0)}")
+        count(f'tiles_{tile_function}', tiles_with_functions_count.get(tile_function, 0))
 
-        # Check intersections for all tile functions
-        for tile_function, features_prep in prepped_features.items():
-            if features_prep.intersects(h3_polygon):
-                tiles_with_functions_count[tile_function] += 1
-                tiles_map[h3_id]['tile_function'] = tile_function
+def assign_functions_by_intersects(function_features, tile_table):
+    """
+    Assign tile functions by testing all tiles at once against the prepared union of each function's features.
 
-    # Print summary of results
-    for tile_function, count in tiles_with_functions_count.items():
-        print(f"Total tiles with {tile_function}: {count}")
+    Args:
+        function_features (dict): Maps tile_function to a list of feature geometries.
+        tile_table (TileTable): The tiles of the area of interest.
+
+    Returns:
+        dict: Number of tiles hit per tile_function.
+    """
+    tiles_with_functions_count = {}
+
+    # Later functions overwrite earlier ones
+    for tile_function, geometries in function_features.items():
+        hits = tile_table.geometry.intersects(unary_union(geometries))
+        tiles_with_functions_count[tile_function] = int(hits.sum())
+        tile_table.set_function(hits, tile_function)
+
+    return tiles_with_functions_count
+
+def assign_functions_by_polyfill(function_features, tile_table):
+    """
+    Assign tile functions from the H3 cells covered by each function's features.
+
+    Work scales with the area of the features instead of the number of tiles, which pays off for
+    sparse feature classes over large areas.
+
+    Args:
+        function_features (dict): Maps tile_function to a list of feature geometries.
+        tile_table (TileTable): The tiles of the area of interest.
+
+    Returns:
+        dict: Number of tiles hit per tile_function.
+    """
+    if len(tile_table) == 0:
+        return {}
+
+    tiles_with_functions_count = {}
+
+    # Later functions overwrite earlier ones, as in the intersects mode
+    for tile_function, geometries in function_features.items():
+        function_rows = features_to_cells(geometries, tile_table.geometry)
+        tiles_with_functions_count[tile_function] = len(function_rows)
+        tile_table.set_function(function_rows, tile_function)
+
+    return tiles_with_functions_count
+
+def _pick_functions(scores, candidates):
+    # Best scoring candidate per tile, ties go to the function listed last. -1 for tiles without one
+    reversed_scores = np.where(candidates, scores, -np.inf)[:, ::-1]
+    picks = scores.shape[1] - 1 - np.argmax(reversed_scores, axis=1)
+    return np.where(candidates.any(axis=1), picks, -1)
+
+def assign_functions_by_coverage(function_features, tile_table, min_fraction=COVERAGE_MIN_FRACTION,
+                                 min_fractions=COVERAGE_MIN_FRACTIONS, priorities=COVERAGE_PRIORITIES):
+    """
+    Assign every tile the function covering most of its area, from one overlay of all functions.
+
+    The polygons of each function are dissolved (overlapping features count once) and split into
+    parts, all parts go in a single STRtree joined against the tiles, and the covered area of every
+    (tile, part) pair comes from vectorized intersection / area calls in the metric CRS of the tiles.
+    A function is a candidate for a tile when it covers at least its minimum fraction, the candidate
+    with the highest priority and then the largest fraction is picked.
+
+    Point and line features cover no area: a tile without a candidate that touches some takes the
+    function with the highest priority among them, the last listed one on ties.
+
+    Args:
+        function_features (dict): Maps tile_function to a list of feature geometries.
+        tile_table (TileTable): The tiles of the area of interest.
+        min_fraction (float): The minimum covered fraction of a tile for a function to be picked.
+        min_fractions (dict): Per tile_function overrides of `min_fraction`.
+        priorities (dict): Priority per tile_function, 0 when missing.
+
+    Returns:
+        dict: Number of tiles assigned per tile_function.
+    """
+    functions = list(function_features)
+    if len(tile_table) == 0 or not functions:
+        return {}
+
+    crs = tile_table.geometry.metric_crs()
+    tile_polygons = tile_table.geometry.projected(crs)
+
+    # Areal parts and point / line features of every function, tagged with the function position
+    parts, part_functions, others, other_functions = [], [], [], []
+    for position, geometries in enumerate(function_features.values()):
+        geometries = project_geometries(np.asarray(geometries, dtype=object), crs)
+        is_areal = np.isin(shapely.get_type_id(geometries), [3, 6])
+        if is_areal.any():
+            function_parts = shapely.get_parts(shapely.union_all(geometries[is_areal]))
+            function_parts = function_parts[shapely.area(function_parts) > 0]
+            parts.append(function_parts)
+            part_functions.append(np.full(len(function_parts), position))
+        if not is_areal.all():
+            others.append(geometries[~is_areal])
+            other_functions.append(np.full(int((~is_areal).sum()), position))
+
+    # Covered fraction of every tile per function, from one indexed join over all functions
+    fractions = np.zeros((len(tile_polygons), len(functions)))
+    if parts:
+        parts = np.concatenate(parts)
+        part_functions = np.concatenate(part_functions)
+        with span("strtree_join"):
+            tile_idx, part_idx = STRtree(parts).query(tile_polygons, predicate="intersects")
+            count('pairs', len(tile_idx))
+        with span("overlay"):
+            covered_areas = shapely.area(shapely.intersection(tile_polygons[tile_idx], parts[part_idx]))
+            np.add.at(fractions, (tile_idx, part_functions[part_idx]), covered_areas)
+            fractions /= shapely.area(tile_polygons)[:, None]
+
+    thresholds = np.array([min_fractions.get(tile_function, min_fraction) for tile_function in functions])
+    function_priorities = np.array([priorities.get(tile_function, 0) for tile_function in functions], dtype=float)
+
+    # Fractions are at most 1, so any priority step outranks them
+    candidates = (fractions > 0) & (fractions >= thresholds)
+    picks = _pick_functions(function_priorities * 2 + fractions, candidates)
+
+    if others:
+        others = np.concatenate(others)
+        other_functions = np.concatenate(other_functions)
+        open_rows = np.flatnonzero(picks < 0)
+        tile_idx, other_idx = STRtree(others).query(tile_polygons[open_rows], predicate="intersects")
+        touched = np.zeros((len(open_rows), len(functions)), dtype=bool)
+        touched[tile_idx, other_functions[other_idx]] = True
+        picks[open_rows] = _pick_functions(np.broadcast_to(function_priorities, touched.shape), touched)
+
+    tiles_with_functions_count = {}
+    for position, tile_function in enumerate(functions):
+        rows = picks == position
+        tiles_with_functions_count[tile_function] = int(rows.sum())
+        tile_table.set_function(rows, tile_function)
+
+    return tiles_with_functions_count
 
 def tags_to_osmnx_filter(tags_dict):
     """
@@ -93,69 +229,50 @@ def tags_to_osmnx_filter(tags_dict):
     
     return "".join(filters)
 
-def process_roads_and_assign_width(polygon, tile_ids, tiles_map, roads_tags):
+def process_roads_and_assign_width(polygon, tile_table, roads_tags, features=None):
+    """
+    Mark tiles crossed by a road as 'road' and assign the widest intersecting road width to function_dimensions.
+
+    Args:
+        polygon (Polygon): The bounding polygon for the area of interest.
+        tile_table (TileTable): The tiles of the area of interest.
+        roads_tags (dict): OSM tags selecting the roads.
+        features (GeoDataFrame, optional): Shared features from osm_features.fetch_features.
+    """
     try:
-        # Generate custom filter for roads
-        roads_custom_filter = tags_to_osmnx_filter(roads_tags)
-
-        # Fetch road network graph and convert to GeoDataFrame
-        roads_system_graph = ox.graph_from_polygon(polygon, custom_filter=roads_custom_filter)
-        print(roads_system_graph)
-        roads_geo_data_frames = ox.graph_to_gdfs(roads_system_graph, nodes=False)
-        roads = list(roads_geo_data_frames.geometry)
-
-        # Fetch road features with additional attributes (e.g., width, lanes)
-        _roads = ox.features_from_polygon(polygon, tags=roads_tags)
-        roads_with_width_data = {}
-
-        # Loop through each road in the GeoDataFrame
-        for idx, road in _roads.iterrows():
-            # Try to get the width or calculate it based on lanes
-            width = road.get('width')
-            lanes = road.get('lanes')
-
-            if (width is not None and not math.isnan(float(width))) or (lanes is not None and not math.isnan(float(lanes))):
-                if isinstance(idx, tuple):
-                    element_type, osmid = idx
-                    estimated_width = 0
-                    if width is not None and not math.isnan(float(width)):
-                        estimated_width = float(width)
-                    else:
-                        estimated_width = float(lanes) * LANE_WIDTH_M
-
-                    roads_with_width_data[osmid] = {
-                        'geometry': road.geometry,
-                        'width': estimated_width
-                    }
-
-        # Create a union of all road geometries and prepare for intersection checks
-        roads_union = unary_union(roads)
-        roads_prep = prep(roads_union)
-
-        # Iterate over H3 tiles and assign road functions and widths
-        tiles_with_roads_count = 0
-        for h3_id in tile_ids:
-            boundary = cell_to_boundary(h3_id)
-            boundary_shapely = [(lng, lat) for lat, lng in boundary]
-            h3_polygon = Polygon(boundary_shapely)
-
-            # Check if the tile intersects with any road
-            has_road = roads_prep.intersects(h3_polygon)
-
-            if has_road:
-                tiles_with_roads_count += 1
-                tiles_map[h3_id]['tile_function'] = 'road'
-
-                # Try to assign the maximum road width
-                max_width = 0
-                for road in roads_with_width_data.values():
-                    if road['geometry'].intersects(h3_polygon):
-                        max_width = max(max_width, road['width'])
-
-                if max_width > 0:
-                    tiles_map[h3_id]['function_dimensions'] = max_width
-
-        print(f"Total tiles with roads: {tiles_with_roads_count}")
+        # Fetch road features with additional attributes (e.g., width, lanes). The road lines
+        # double as the road network, so no separate graph request is needed.
+        _roads = features_for_tags(polygon, roads_tags, features)
+        is_road_line = _roads.geom_type.isin(["LineString", "MultiLineString"]).to_numpy()
+        print(f"Total road features: {int(is_road_line.sum())}")
+        count('features', int(is_road_line.sum()))
+
+        # Width per road: the width tag, else lanes * LANE_WIDTH_M, NaN when neither is usable
+        widths = numeric_tag_values(_roads, 'width')
+        lanes = numeric_tag_values(_roads, 'lanes')
+        road_widths = widths.fillna(lanes * LANE_WIDTH_M).to_numpy()
+
+        # One indexed join between tiles and road features
+        tile_polygons = tile_table.geometry.polygons
+        with span("strtree_join"):
+            roads_tree = STRtree(_roads.geometry.values)
+            tile_idx, road_idx = roads_tree.query(tile_polygons, predicate="intersects")
+
+        # Tiles crossed by a road line are road tiles
+        has_road = np.zeros(len(tile_polygons), dtype=bool)
+        has_road[tile_idx[is_road_line[road_idx]]] = True
+
+        # Maximum width of the intersecting width-bearing roads per tile
+        max_widths = np.zeros(len(tile_polygons))
+        np.maximum.at(max_widths, tile_idx, np.nan_to_num(road_widths[road_idx], nan=0.0))
+
+        # Assign road functions and widths
+        tile_table.set_function(has_road, 'road')
+        with_width = has_road & (max_widths > 0)
+        tile_table.function_dimensions[with_width] = max_widths[with_width]
+
+        print(f"Total tiles with roads: {int(has_road.sum())}")
+        count('tiles_hit', int(has_road.sum()))
 
     except ValueError as e:
         print(f"Error processing roads: {e}. Skipping road processing for this polygon.")
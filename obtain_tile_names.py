@@ -1,92 +1,133 @@
-import osmnx as ox
-from shapely.geometry import Polygon
-from shapely.ops import unary_union
-from shapely.prepared import prep
-from h3.api.basic_str import cell_to_boundary
-import re
-from translation_utils import transliterate_arabic_name
+import numpy as np
+import pandas as pd
+from shapely import STRtree
+from translation_utils import transliterate_arabic_name, is_arabic, overrides_map
+from inputs.osm_tags import name_tags
+from osm_features import features_for_tags
+from instrumentation import span, count
 
 # --- Helpers ---
-def is_arabic(text):
-    return bool(re.search(r'[\u0600-\u06FF]', text))
+def _tag_values(features, key):
+    if key not in features.columns:
+        return np.full(len(features), None, dtype=object)
+    return features[key].to_numpy(dtype=object)
 
-def transliterate_name(name):
-    if not isinstance(name, str):
-        return None
-    return transliterate_arabic_name(name) if is_arabic(name) else name
+def latin_names(features):
+    """
+    Get the Latin name of every named feature, working on each distinct name once.
+
+    An overrides_map entry for the name comes first, then the name:en tag, then the transliteration
+    of the Arabic name (the name itself when it is Arabic, else the name:ar tag), else the name as is.
+
+    Args:
+        features (GeoDataFrame): Features with a "name" column.
+
+    Returns:
+        ndarray: Latin names aligned with the features.
+    """
+    names = _tag_values(features, 'name')
+    name_codes, unique_names = pd.factorize(names)
+    unique_arabic = np.array([is_arabic(name) for name in unique_names], dtype=bool)
+    unique_overrides = np.array([overrides_map.get(name) for name in unique_names] + [None], dtype=object)
+
+    # Transliterate every distinct Arabic name once, code -1 (no Arabic name) maps to the trailing None
+    arabic_names = np.where(np.append(unique_arabic, False)[name_codes], names, _tag_values(features, 'name:ar'))
+    arabic_codes, unique_arabic_names = pd.factorize(arabic_names)
+    transliterations = np.array([transliterate_arabic_name(name) for name in unique_arabic_names] + [None],
+                                dtype=object)[arabic_codes]
+
+    latin = unique_overrides[name_codes]
+    for fallback in (_tag_values(features, 'name:en'), transliterations, names):
+        missing = pd.isna(latin)
+        latin[missing] = fallback[missing]
+    return latin
+
+def intern_names(tile_table, names):
+    """
+    Intern a names column into the tile table, each distinct name once.
+
+    Args:
+        tile_table (TileTable): The tiles of the area of interest.
+        names (ndarray): Names, missing ones are stored as the empty name.
+
+    Returns:
+        ndarray: int32 name codes aligned with `names`.
+    """
+    codes, unique_names = pd.factorize(names)
+    return np.append(tile_table.name_codes(unique_names), np.int32(0))[codes]
+
+def first_feature_per_tile(tile_count, tile_idx, feature_idx):
+    """
+    Reduce (tile, feature) index pairs to the lowest feature index per tile.
+
+    Args:
+        tile_count (int): Number of tiles.
+        tile_idx (ndarray): Tile index of every pair.
+        feature_idx (ndarray): Feature index of every pair.
+
+    Returns:
+        ndarray: Feature index per tile, -1 for tiles without pairs.
+    """
+    tile_feature = np.full(tile_count, np.iinfo(np.int64).max)
+    np.minimum.at(tile_feature, tile_idx, feature_idx)
+    tile_feature[tile_feature == np.iinfo(np.int64).max] = -1
+    return tile_feature
 
-def process_osm_names_and_assign_to_tiles(polygon, tile_ids, tiles_map):
+def process_osm_names_and_assign_to_tiles(polygon, tile_table, features=None):
     """
-    Query OSM for feature names and assign them to intersecting tiles.
+    Query OSM for feature names and assign them to intersecting tiles, and to every other tile
+    the name of its nearest named feature.
 
     Args:
         polygon (Polygon): The bounding polygon for the area of interest.
-        tile_ids (list): List of H3 tile IDs.
-        tiles_map (dict): The dictionary mapping H3 tile IDs to their properties.
+        tile_table (TileTable): The tiles of the area of interest.
+        features (GeoDataFrame, optional): Shared features from osm_features.fetch_features.
 
     Returns:
-        None: Updates the `name1` and `name2` fields in `tiles_map` in place.
+        None: Updates `name1` and `name2` in `tile_table` in place.
     """
-    # Tags to query OSM for named features
-    name_tags = {
-        "place": True,
-        "highway": True,
-        "natural": True,
-        "landuse": True,
-        "amenity": True,
-        "building": True,
-        "leisure": True,
-        "shop": True,
-        "tourism": True
-    }
+    tile_geometry = tile_table.geometry
 
     print("Fetching OSM feature names...")
     try:
         # Query OSM for features with names
-        geo_data_frames = ox.features_from_polygon(polygon, tags=name_tags)
+        geo_data_frames = features_for_tags(polygon, name_tags, features)
         geo_data_frames = geo_data_frames[geo_data_frames["name"].notna()]  # Filter features with a name
-        features = list(geo_data_frames.geometry)
-
-        print(f"Total named features: {len(features)}")
-
-        # Create a union of all named feature geometries and prepare for intersection checks
-        named_features_union = unary_union(features)
-        named_features_prep = prep(named_features_union)
-
-        # Iterate over H3 tiles and assign names to intersecting tiles
-        for h3_id in tile_ids:
-            boundary = cell_to_boundary(h3_id)
-            boundary_shapely = [(lng, lat) for lat, lng in boundary]
-            h3_polygon = Polygon(boundary_shapely)
-
-            # Check if the tile intersects with any named feature
-            if named_features_prep.intersects(h3_polygon):
-                for idx, feature in geo_data_frames.iterrows():
-                    if feature.geometry.intersects(h3_polygon):
-                        name = feature.get("name")
-                        if name:
-                            if tiles_map[h3_id]["name1"]:
-                                tiles_map[h3_id]["name1"] += " / " + name
-                            else:
-                                tiles_map[h3_id]["name1"] = name
-                            tiles_map[h3_id]["name2"] = transliterate_name(name)
-                            break  # Assign the first matching name and stop
-            else:
-                # If no intersection, find the closest named feature
-                closest_feature = None
-                closest_distance = float('inf')
-                for idx, feature in geo_data_frames.iterrows():
-                    distance = h3_polygon.distance(feature.geometry)
-                    if distance < closest_distance:
-                        closest_distance = distance
-                        closest_feature = feature
-
-                if closest_feature is not None:
-                    name = closest_feature.get("name")
-                    if name:
-                        tiles_map[h3_id]["name1"] = name
-                        # tiles_map[h3_id]["name2"] = name
-                        tiles_map[h3_id]["name2"] = transliterate_name(name)
+        names = geo_data_frames["name"].to_numpy()
+
+        print(f"Total named features: {len(geo_data_frames)}")
+        count('features', len(geo_data_frames))
+        if len(geo_data_frames) == 0:
+            return
+
+        # Tiles intersecting named features take the first of them in feature order
+        tile_polygons = tile_geometry.polygons
+        named_features_tree = STRtree(geo_data_frames.geometry.values)
+        tile_idx, feature_idx = named_features_tree.query(tile_polygons, predicate="intersects")
+        tile_feature = first_feature_per_tile(len(tile_polygons), tile_idx, feature_idx)
+
+        # Every other tile takes its nearest named feature, measured in a metric projection
+        unmatched = np.flatnonzero(tile_feature < 0)
+        if len(unmatched) > 0:
+            with span("nearest"):
+                count('tiles', len(unmatched))
+                metric_crs = tile_geometry.metric_crs()
+                features_metric = geo_data_frames.geometry.to_crs(metric_crs).values
+                tiles_metric = tile_geometry.projected(metric_crs)[unmatched]
+
+                nearest_tree = STRtree(features_metric)
+                nearest_idx, feature_idx = nearest_tree.query_nearest(tiles_metric, all_matches=True)
+                tile_feature[unmatched] = first_feature_per_tile(len(unmatched), nearest_idx, feature_idx)
+
+        # Intern the names of every feature once, then assign them to tiles
+        with span("normalize_names"):
+            feature_name1_codes = intern_names(tile_table, names)
+            feature_name2_codes = intern_names(tile_table, latin_names(geo_data_frames))
+            count('distinct_names', len(tile_table.names))
+        named_rows = np.flatnonzero(tile_feature >= 0)
+        named_rows = named_rows[feature_name1_codes[tile_feature[named_rows]] != 0]
+        tile_table.name1_codes[named_rows] = feature_name1_codes[tile_feature[named_rows]]
+        tile_table.name2_codes[named_rows] = feature_name2_codes[tile_feature[named_rows]]
 
     except Exception as e:
         print(f"Error processing OSM names: {e}")
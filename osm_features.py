@@ -0,0 +1,125 @@
+import os
+import time
+import pandas as pd
+from instrumentation import span, count
+
+def merge_tag_sets(tag_sets):
+    """
+    Merge several OSM tag dictionaries into one tag dictionary that matches the union of all of them.
+
+    Args:
+        tag_sets (list): A list of tags dicts (values are True, a string or a list of strings).
+
+    Returns:
+        dict: A single tags dict usable with ox.features_from_polygon.
+    """
+    merged_tags = {}
+    for tags in tag_sets:
+        for key, value in tags.items():
+            if merged_tags.get(key) is True:
+                continue
+            if value is True:
+                merged_tags[key] = True
+                continue
+
+            values = [value] if isinstance(value, str) else list(value)
+            existing = merged_tags.setdefault(key, [])
+            existing.extend(v for v in values if v not in existing)
+
+    return merged_tags
+
+def select_features_by_tags(features, tags):
+    """
+    Select the features matching a tags dict, using the same predicate OSMnx applies to its own query results.
+
+    Args:
+        features (GeoDataFrame): Features fetched for a superset of the tags.
+        tags (dict): The tags dict of a single stage.
+
+    Returns:
+        GeoDataFrame: The rows of `features` matching any of the tags.
+    """
+    tags_filter = pd.Series(data=False, index=features.index)
+    for key, value in tags.items():
+        if key not in features.columns:
+            continue
+        if value is True:
+            tags_filter |= features[key].notna()
+        elif isinstance(value, str):
+            tags_filter |= features[key] == value
+        else:
+            tags_filter |= features[key].isin(set(value))
+
+    return features[tags_filter]
+
+def fetch_features(polygon, tag_sets):
+    """
+    Fetch the features of every tag set with a single Overpass request for the whole polygon.
+
+    Args:
+        polygon (Polygon): The bounding polygon for the area of interest.
+        tag_sets (list): A list of tags dicts, one per pipeline stage.
+
+    Returns:
+        GeoDataFrame: All features matching any of the tag sets. Use select_features_by_tags
+        to get the view of a single stage.
+    """
+    # osmnx is slow to import, runs served from the feature store or an extract never load it
+    import osmnx as ox
+
+    merged_tags = merge_tag_sets(tag_sets)
+    print(f"Fetching OSM features for {len(tag_sets)} tag sets ({len(merged_tags)} keys)...")
+    with span("overpass"):
+        start = time.time()
+        features = ox.features_from_polygon(polygon, tags=merged_tags)
+        # Overpass responses land in the osmnx cache. This is the cache growth, not the response size:
+        # 0 on a cache hit, and files other processes write meanwhile are counted too
+        count('cache_growth_bytes', _cache_bytes_written_since(start))
+        count('features', len(features))
+    print(f"Total OSM features: {len(features)}")
+    return features
+
+def _cache_bytes_written_since(start):
+    import osmnx as ox
+    cache_folder = ox.settings.cache_folder
+    if not ox.settings.use_cache or not os.path.isdir(cache_folder):
+        return 0
+    return sum(entry.stat().st_size for entry in os.scandir(cache_folder)
+               if entry.is_file() and entry.stat().st_mtime >= start)
+
+def features_for_tags(polygon, tags, features=None):
+    """
+    Get the features of a single stage, from the shared pull when one is given.
+
+    Args:
+        polygon (Polygon): The bounding polygon for the area of interest.
+        tags (dict): The tags dict of the stage.
+        features (GeoDataFrame, optional): Features returned by fetch_features. When None, the
+            stage falls back to its own Overpass request.
+
+    Returns:
+        GeoDataFrame: The features matching `tags`.
+    """
+    if features is None:
+        import osmnx as ox
+        return ox.features_from_polygon(polygon, tags=tags)
+    return select_features_by_tags(features, tags)
+
+def numeric_tag_values(features, key):
+    """
+    Parse a numeric OSM tag column (e.g. "height", "width", "lanes") into floats.
+
+    Values such as "12 m" or "2;3" are reduced to their leading number, anything else becomes NaN.
+
+    Args:
+        features (GeoDataFrame): The features holding the tag column.
+        key (str): The OSM tag key.
+
+    Returns:
+        Series: Float values aligned with `features.index`.
+    """
+    if key not in features.columns:
+        return pd.Series(float("nan"), index=features.index, dtype=float)
+
+    values = features[key].astype("string").str.extract(r"^\s*([-+]?\d*\.?\d+)", expand=False)
+    return pd.to_numeric(values, errors="coerce").astype(float)
@@ -0,0 +1,131 @@
+import os
+import geopandas as gpd
+import osmium
+import pandas as pd
+import shapely
+from osm_features import merge_tag_sets
+from instrumentation import span, count
+
+# Keys whose closed ways are lines unless tagged area=yes, as osmnx treats them
+LINEAR_KEYS = {"highway", "barrier", "waterway", "railway", "power_line", "route"}
+
+def tags_match(tags, merged_tags):
+    """
+    Test the tags of an OSM object against a merged tags dict.
+
+    Args:
+        tags (dict): The object's tags.
+        merged_tags (dict): Tags dict, values are True, a string or a list of strings.
+
+    Returns:
+        bool: True when any key/value of `merged_tags` matches.
+    """
+    for key, value in merged_tags.items():
+        tag_value = tags.get(key)
+        if tag_value is None:
+            continue
+        if value is True or tag_value == value or (not isinstance(value, str) and tag_value in value):
+            return True
+    return False
+
+def is_area_way(tags):
+    """
+    Decide whether a closed way is a polygon or a line.
+
+    Args:
+        tags (dict): The way's tags.
+
+    Returns:
+        bool: True for polygons. area=yes/no wins, otherwise linear keys make lines.
+    """
+    area = tags.get("area")
+    if area is not None:
+        return area != "no"
+    return not any(key in tags for key in LINEAR_KEYS)
+
+def fetch_features_from_pbf(pbf_path, polygon, tag_sets):
+    """
+    Read the features of every tag set from a local .osm.pbf extract in one pass, without network access.
+
+    All tag sets are merged into one filter: objects without any of the keys are dropped before
+    their geometry is built, the rest are matched against the tag values. Nodes become points,
+    closed ways and multipolygon relations become polygons (closed linear ways such as
+    roundabouts stay lines), open ways become lines. The result has the layout of
+    ox.features_from_polygon (an (element, id) index, one column per tag), so the stages can
+    select their views with select_features_by_tags.
+
+    Args:
+        pbf_path (str): Path of the .osm.pbf extract.
+        polygon (Polygon): The bounding polygon for the area of interest, None to keep the whole extract.
+        tag_sets (list): A list of tags dicts, one per pipeline stage.
+
+    Returns:
+        GeoDataFrame: All features matching any of the tag sets and intersecting `polygon`.
+    """
+    merged_tags = merge_tag_sets(tag_sets)
+    print(f"Reading OSM features from {pbf_path} for {len(tag_sets)} tag sets ({len(merged_tags)} keys)...")
+
+    with span("pbf"):
+        count('read_bytes', os.path.getsize(pbf_path))
+        features = _read_pbf_features(pbf_path, polygon, merged_tags)
+        count('features', len(features))
+
+    print(f"Total OSM features: {len(features)}")
+    return features
+
+def _read_pbf_features(pbf_path, polygon, merged_tags):
+    key_filter = osmium.filter.KeyFilter(*merged_tags.keys())
+    processor = osmium.FileProcessor(pbf_path).with_areas(key_filter).with_filter(key_filter)
+    wkb_factory = osmium.geom.WKBFactory()
+
+    index, records, geometries = [], [], []
+    for obj in processor:
+        tags = dict(obj.tags)
+        if not tags_match(tags, merged_tags):
+            continue
+
+        try:
+            if obj.is_node():
+                element, geometry = "node", wkb_factory.create_point(obj)
+            elif obj.is_way():
+                # Closed polygon ways are returned again as areas
+                if obj.is_closed() and is_area_way(tags):
+                    continue
+                element, geometry = "way", wkb_factory.create_linestring(obj)
+            elif obj.is_area():
+                if obj.from_way():
+                    if not is_area_way(tags):
+                        continue
+                    element = "way"
+                else:
+                    element = "relation"
+                geometry = wkb_factory.create_multipolygon(obj)
+            else:
+                continue
+        except RuntimeError as e:
+            # Broken geometries (missing nodes at the extract border, invalid rings)
+            print(f"Error building geometry of {obj.id}: {e}, skipping.")
+            continue
+
+        index.append((element, obj.orig_id() if obj.is_area() else obj.id))
+        records.append(tags)
+        geometries.append(geometry)
+
+    if not records:
+        return gpd.GeoDataFrame(geometry=[], crs="EPSG:4326")
+
+    # The WKB factory returns hex strings, shapely decodes them in one call
+    geometries = shapely.from_wkb(geometries)
+    # Single-part multipolygons are plain polygons in osmnx
+    single = shapely.get_num_geometries(geometries) == 1
+    single &= shapely.get_type_id(geometries) == shapely.GeometryType.MULTIPOLYGON
+    geometries[single] = shapely.get_geometry(geometries[single], 0)
+
+    features = gpd.GeoDataFrame(
+        pd.DataFrame.from_records(records, index=pd.MultiIndex.from_tuples(index, names=["element", "id"])),
+        geometry=geometries,
+        crs="EPSG:4326",
+    )
+    if polygon is not None:
+        features = features[features.intersects(polygon)]
+    return features
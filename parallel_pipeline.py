@@ -0,0 +1,264 @@
+import multiprocessing
+import numpy as np
+import shapely
+from h3.api.numpy_int import get_resolution
+from inputs.config import *
+from obtain_tile_function import process_multiple_tags, process_roads_and_assign_width
+from obtain_tile_dynamics import process_tags_and_append_dynamics, mark_flood_risk_tiles
+from obtain_height_and_grad_score import (process_tile_heights, soften_tile_heights, gradient_height_differences,
+                                          normalize_gradient_scores)
+from obtain_tile_dim import process_building_heights_and_assign_width
+from obtain_tile_names import process_osm_names_and_assign_to_tiles
+from cell_index import cells_to_parents
+from tile_adjacency import csr_rows, grid_disk_adjacency
+from tile_table import TileTable
+from instrumentation import span
+
+# Inputs shared by every partition, set once per worker process by _init_worker
+_shared = {}
+
+def _init_worker(shared):
+    _shared.update(shared)
+
+def choose_partition_res(tile_ids, processes, partitions_per_process=4):
+    """
+    Pick the coarsest H3 parent resolution that still gives every process several partitions.
+
+    Args:
+        tile_ids (ndarray): uint64 H3 tile IDs, all of the same resolution.
+        processes (int): Number of worker processes.
+        partitions_per_process (int): Wanted number of partitions per process, for load balancing.
+
+    Returns:
+        int: The parent resolution.
+    """
+    tile_res = get_resolution(tile_ids[0])
+    parents = np.asarray(tile_ids, dtype=np.uint64)
+    res = tile_res
+    # Walk up the hierarchy from the unique parents of the previous level
+    while res > 0:
+        coarser = np.unique(cells_to_parents(parents, res - 1))
+        if len(coarser) < processes * partitions_per_process:
+            break
+        parents = coarser
+        res -= 1
+    return max(0, min(res, tile_res - 1))
+
+def partition_tiles(tile_ids, parent_res):
+    """
+    Split tiles by their H3 parent cell.
+
+    Args:
+        tile_ids (ndarray): uint64 H3 tile IDs.
+        parent_res (int): The H3 resolution of the partition cells.
+
+    Returns:
+        list: Row arrays, one per parent cell, ordered by parent ID. Rows keep their table order.
+    """
+    parents = cells_to_parents(tile_ids, parent_res)
+    order = np.argsort(parents, kind='stable')
+    boundaries = np.flatnonzero(np.diff(parents[order])) + 1
+    return np.split(order, boundaries)
+
+def halo_rows(indptr, indices, rows):
+    """
+    Get the rows of a partition followed by its halo, the tiles outside it within the adjacency radius.
+
+    Args:
+        indptr (ndarray): CSR row pointers of the table adjacency.
+        indices (ndarray): CSR neighbor rows of the table adjacency.
+        rows (ndarray): Rows of the partition.
+
+    Returns:
+        ndarray: `rows` followed by the sorted halo rows.
+    """
+    in_partition = np.zeros(len(indptr) - 1, dtype=bool)
+    in_partition[rows] = True
+    neighbors = np.unique(indices[in_partition[csr_rows(indptr)]])
+    return np.concatenate([rows, neighbors[~in_partition[neighbors]]])
+
+def _partition_table(tile_ids, function_codes=None, functions=None, hard_height=None, height=None):
+    tile_table = TileTable(tile_ids)
+    if function_codes is not None:
+        tile_table.functions = list(functions)
+        tile_table.function_codes[:] = function_codes
+    if hard_height is not None:
+        tile_table.hard_height[:] = hard_height
+    if height is not None:
+        tile_table.height[:] = height
+    return tile_table
+
+def _process_partition(tile_ids):
+    """Run the per-tile stages on one partition, in the serial stage order."""
+    tile_table = _partition_table(tile_ids)
+    features = _shared['features']
+    polygon = _shared['polygon']
+
+    # Only the features touching the partition can intersect its tiles. Names keep all features,
+    # tiles without an intersecting name take the nearest one, which may lie outside
+    partition_bounds = shapely.box(*shapely.total_bounds(tile_table.geometry.polygons))
+    local_features = features.iloc[np.sort(features.sindex.query(partition_bounds))]
+
+    process_multiple_tags(_shared['tags_and_functions'], polygon, tile_table, local_features,
+                          _shared['classification_mode'])
+    process_roads_and_assign_width(polygon, tile_table, _shared['roads_tags'], local_features)
+    process_tags_and_append_dynamics(_shared['tags_and_dynamics'], polygon, tile_table, local_features)
+    process_building_heights_and_assign_width(polygon, tile_table, local_features)
+    if _shared['tif_paths_with_functions'] is not None:
+        process_tile_heights(_shared['tif_paths_with_functions'], tile_table, softening_disk_k=None,
+                             window_size=_shared['window_size'], max_memory_mb=_shared['max_memory_mb'])
+    process_osm_names_and_assign_to_tiles(polygon, tile_table, features)
+
+    return {
+        'functions': tile_table.functions,
+        'function_codes': tile_table.function_codes,
+        'function_dimensions': tile_table.function_dimensions,
+        'hard_height': tile_table.hard_height,
+        'height': tile_table.height,
+        'names': tile_table.names,
+        'name1_codes': tile_table.name1_codes,
+        'name2_codes': tile_table.name2_codes,
+        'dynamic_types': tile_table.dynamic_types,
+        'dynamics': tile_table.dynamics(),
+    }
+
+def _soften_partition(task):
+    """Soften the heights of a partition, given the partition and its halo."""
+    tile_ids, own_count, function_codes, functions, hard_height, height, disk_k = task
+    tile_table = _partition_table(tile_ids, function_codes, functions, hard_height, height)
+    soften_tile_heights(tile_table, disk_k=disk_k)
+    return tile_table.height[:own_count]
+
+def _gradient_partition(task):
+    """Height differences of a partition's scored tiles, given the partition and its halo."""
+    tile_ids, own_count, function_codes, functions, height = task
+    tile_table = _partition_table(tile_ids, function_codes, functions, height=height)
+    updated, height_diffs = gradient_height_differences(tile_table)
+    own_diffs = np.full(own_count, np.nan)
+    own_diffs[updated[:own_count]] = height_diffs[:np.count_nonzero(updated[:own_count])]
+    return updated[:own_count], own_diffs
+
+def _merge_partition(tile_table, rows, result):
+    """Write the results of one partition into the full table, re-coding its categories."""
+    function_map = np.array([tile_table.function_code(f) for f in result['functions']], dtype=np.int8)
+    tile_table.function_codes[rows] = function_map[result['function_codes']]
+    tile_table.function_dimensions[rows] = result['function_dimensions']
+    tile_table.hard_height[rows] = result['hard_height']
+    tile_table.height[rows] = result['height']
+
+    name_map = tile_table.name_codes(result['names'])
+    tile_table.name1_codes[rows] = name_map[result['name1_codes']]
+    tile_table.name2_codes[rows] = name_map[result['name2_codes']]
+
+    dynamic_rows, dynamic_type_codes, dynamic_timestamps = result['dynamics']
+    tile_table.extend_dynamics(rows[dynamic_rows], result['dynamic_types'], dynamic_type_codes, dynamic_timestamps)
+
+def _halo_tasks(tile_table, partitions, k):
+    """Yield (rows with halo, own count) of every partition for a k-ring neighbor operation."""
+    indptr, indices = grid_disk_adjacency(tile_table.tile_ids, k)
+    for rows in partitions:
+        yield halo_rows(indptr, indices, rows), len(rows)
+
+def run_partitioned_stages(tile_table, polygon, features, tags_and_functions, tags_and_dynamics, roads_tags,
+                           tif_paths_with_functions=None, classification_mode="intersects",
+                           softening_disk_k=SOFTENING_STRENGTH, processes=None, parent_res=None,
+                           window_size=RASTER_WINDOW_SIZE, max_memory_mb=RASTER_MAX_MEMORY_MB):
+    """
+    Run the per-tile stages over H3 parent-cell partitions of the AOI in a process pool.
+
+    The features and stage configuration are handed to every worker once, by the pool initializer
+    (inherited without copying where the platform can fork), so tasks only carry tile IDs. Partition
+    results are merged in parent-cell order and dynamics keep their per-tile order, so the table
+    matches the serial run. Softening and gradient need neighbors from other partitions: every
+    partition gets a halo of the tiles within the neighbor radius around it, with their merged
+    values, and only its own tiles are written back. The flood marking ranks the whole AOI and
+    runs on the merged table.
+
+    With heights enabled, every partition only reads the part of the rasters under its own tiles.
+
+    Args:
+        tile_table (TileTable): The tiles of the area of interest.
+        polygon (Polygon): The bounding polygon for the area of interest.
+        features (GeoDataFrame): Shared features from osm_features.fetch_features.
+        tags_and_functions (list): A list of [tags_dict, tile_function] pairs.
+        tags_and_dynamics (list): A list of [tags_dict, dynamic_value] pairs.
+        roads_tags (dict): Tags for the roads.
+        tif_paths_with_functions (dict, optional): Height rasters, see process_tile_heights. None skips
+            heights, gradient and flood marking.
+        classification_mode (str): See process_multiple_tags.
+        softening_disk_k (int): The strength of the height softening.
+        processes (int, optional): Number of worker processes, all cores when None.
+        parent_res (int, optional): H3 resolution of the partitions, picked from `processes` when None.
+        window_size (int | str, optional): See process_tile_heights.
+        max_memory_mb (int, optional): See process_tile_heights.
+
+    Returns:
+        None: Updates `tile_table` in place.
+    """
+    if len(tile_table) == 0:
+        return
+
+    processes = processes or multiprocessing.cpu_count()
+    if parent_res is None:
+        parent_res = choose_partition_res(tile_table.tile_ids, processes)
+    partitions = partition_tiles(tile_table.tile_ids, parent_res)
+    print(f"Processing {len(tile_table)} tiles in {len(partitions)} partitions (res {parent_res}) "
+          f"on {processes} processes...")
+
+    shared = {
+        'features': features,
+        'polygon': polygon,
+        'tags_and_functions': tags_and_functions,
+        'tags_and_dynamics': tags_and_dynamics,
+        'roads_tags': roads_tags,
+        'tif_paths_with_functions': tif_paths_with_functions,
+        'classification_mode': classification_mode,
+        'window_size': window_size,
+        'max_memory_mb': max_memory_mb,
+    }
+
+    # Forked workers inherit the shared inputs without pickling them
+    if "fork" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("fork")
+    else:
+        context = multiprocessing.get_context()
+
+    with context.Pool(processes, initializer=_init_worker, initargs=(shared,)) as pool:
+        # Per-tile stages. The spans cover the pool passes, stage spans inside workers are not collected
+        with span("partitions"):
+            results = pool.map(_process_partition, [tile_table.tile_ids[rows] for rows in partitions], chunksize=1)
+            for rows, result in zip(partitions, results):
+                _merge_partition(tile_table, rows, result)
+
+        if tif_paths_with_functions is None:
+            return
+
+        # Softening, with a halo of softening_disk_k rings
+        with span("soften"):
+            halos = list(_halo_tasks(tile_table, partitions, softening_disk_k))
+            softened = pool.map(_soften_partition, [
+                (tile_table.tile_ids[halo], own_count, tile_table.function_codes[halo], tile_table.functions,
+                 tile_table.hard_height[halo], tile_table.height[halo], softening_disk_k)
+                for halo, own_count in halos
+            ], chunksize=1)
+            for rows, heights in zip(partitions, softened):
+                tile_table.height[rows] = heights
+
+        # Gradient, with a halo of one ring. Normalization needs the max over the whole AOI
+        with span("gradient"):
+            halos = list(_halo_tasks(tile_table, partitions, 1))
+            gradients = pool.map(_gradient_partition, [
+                (tile_table.tile_ids[halo], own_count, tile_table.function_codes[halo], tile_table.functions,
+                 tile_table.height[halo])
+                for halo, own_count in halos
+            ], chunksize=1)
+
+    height_diffs = np.full(len(tile_table), np.nan)
+    updated = np.zeros(len(tile_table), dtype=bool)
+    for rows, (partition_updated, partition_diffs) in zip(partitions, gradients):
+        updated[rows] = partition_updated
+        height_diffs[rows] = partition_diffs
+    tile_table.score1[updated] = height_diffs[updated]
+    normalize_gradient_scores(tile_table, height_diffs[updated])
+
+    mark_flood_risk_tiles(tile_table)
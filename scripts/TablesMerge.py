@@ -1,92 +1,287 @@
+"""
+Merge tile tables (e.g. the tables of several neighborhoods) into one tile table.
+
+    python scripts/TablesMerge.py ../Outputs/MergedTable ../Outputs/CSVs/tiles_map_a.csv ../Outputs/Columnar/tiles_map_b.parquet
+
+Inputs are CSV, Parquet or Arrow IPC exports, read chunk by chunk. Tiles present in several tables are
+merged with the rules below, inputs listed first take precedence:
+- tile_function: the highest FUNCTION_WEIGHTS weight, 'na' loses to any function
+- function_dimensions: the maximum
+- height, score1, score2, name1, name2: the first table with a value
+- dynamics: the distinct entries of all tables
+Center and neighbors are derived from the tile ID.
+"""
+import os
+import re
+import sys
+import argparse
+import numpy as np
 import pandas as pd
 
-def merge_h3_csv_files(file1, file2, output_file):
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from tile_table import TileTable
+
+# Function weights (ascending order), unknown functions weigh 0 and 'na' / missing -1
+FUNCTION_WEIGHTS = {
+    'water': 1,
+    'amenity': 2,
+    'veg': 3,
+    'park': 4,
+    'built': 5,
+    'religious': 6,
+    'school': 7,
+    'gov': 8,
+    'road': 9
+}
+
+VALUE_COLUMNS = ['height', 'score1', 'score2', 'tile_function', 'function_dimensions', 'name1', 'name2']
+# Column names of the tables exported before the tile_ prefixes were dropped
+LEGACY_COLUMNS = {
+    'tile_height': 'height',
+    'tile_grad_score': 'score1',
+    'tile_dimensions': 'function_dimensions',
+    'tile_dynamics': 'dynamics',
+}
+CHUNK_SIZE = 500_000
+
+# CSV dynamics are written as "[{'type': 'FOOD', 'timestamp': 1700000000000}, ...]", legacy tables as "['FOOD', ...]".
+# Older tables hold float seconds (time.time()) for some timestamps, and integer milliseconds for others.
+# A legacy entry is a whole list item, so it never matches the quoted keys and values inside a dict
+DYNAMICS_PATTERN = re.compile(
+    r"\{'type': '(?P<type>[^']*)', 'timestamp': (?P<timestamp>\d+(?:\.\d*)?)\}"
+    r"|(?:(?<=\[)|(?<=, ))'(?P<legacy>[^']*)'(?=,|\])"
+)
+
+def parse_tile_ids(ids):
+    """
+    Parse tile IDs written as H3 hex strings or as decimal integers.
+
+    Args:
+        ids (Series): The IDs as strings.
+
+    Returns:
+        ndarray: uint64 H3 tile IDs.
+    """
+    ids = np.asarray(ids, dtype=str)
+    # H3 hex strings have at most 16 digits, the decimal form of an H3 index has 18 or more
+    if len(ids) == 0 or np.char.str_len(ids).max() > 16:
+        return np.array([int(h3_id, 16) if len(h3_id) <= 16 else int(h3_id) for h3_id in ids], dtype=np.uint64)
+
+    # Hex digits to their values, 16 per ID after left-padding with zeros
+    digits = np.char.zfill(np.char.lower(ids), 16).astype('S16').view(np.uint8).reshape(-1, 16)
+    values = np.where(digits >= ord('a'), digits - (ord('a') - 10), digits - ord('0')).astype(np.uint64)
+    shifts = np.arange(60, -4, -4, dtype=np.uint64)
+    return np.bitwise_or.reduce(values << shifts, axis=1)
+
+def _timestamps_ms(timestamps):
+    # Decimal timestamps are seconds, integer ones milliseconds, missing ones (legacy entries) 0
+    values = pd.to_numeric(timestamps)
+    seconds = timestamps.str.contains('.', regex=False, na=False).to_numpy()
+    values = values.where(~seconds, values * 1000)
+    return values.fillna(0).round().astype(np.int64).to_numpy()
+
+def _csv_chunks(path, chunk_size):
+    wanted = set(VALUE_COLUMNS) | set(LEGACY_COLUMNS) | {'id', 'dynamics'}
+    chunks = pd.read_csv(path, chunksize=chunk_size, usecols=lambda column: column in wanted, dtype=str,
+                         keep_default_na=False, na_values=[''])
+    for chunk in chunks:
+        chunk = chunk.rename(columns=LEGACY_COLUMNS)
+        tiles = pd.DataFrame({'id': parse_tile_ids(chunk['id'])})
+        for column in VALUE_COLUMNS:
+            if column not in chunk.columns:
+                tiles[column] = np.nan
+            elif column in ('tile_function', 'name1', 'name2'):
+                tiles[column] = chunk[column].to_numpy()
+            else:
+                tiles[column] = pd.to_numeric(chunk[column], errors='coerce').to_numpy()
+
+        # Parse the dynamics of the whole chunk in one vectorized pass
+        dynamics = pd.DataFrame({'id': np.zeros(0, dtype=np.uint64), 'type': [], 'timestamp': np.zeros(0, dtype=np.int64)})
+        if 'dynamics' in chunk.columns:
+            with_dynamics = chunk['dynamics'].dropna()
+            entries = with_dynamics[with_dynamics != '[]'].str.extractall(DYNAMICS_PATTERN)
+            if len(entries):
+                rows = entries.index.get_level_values(0)
+                dynamics = pd.DataFrame({
+                    'id': tiles['id'].to_numpy()[chunk.index.get_indexer(rows)],
+                    'type': entries['type'].fillna(entries['legacy']).to_numpy(),
+                    'timestamp': _timestamps_ms(entries['timestamp']),
+                })
+        yield tiles, dynamics
+
+def _columnar_chunks(path, file_format, chunk_size):
+    # pyarrow is optional, only needed for columnar inputs
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+
+    if file_format == "parquet":
+        batches = pq.ParquetFile(path).iter_batches(batch_size=chunk_size)
+    else:
+        reader = pa.ipc.open_file(path)
+        batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+
+    for batch in batches:
+        ids = batch.column('id')
+        tile_ids = parse_tile_ids(ids.to_pylist()) if pa.types.is_string(ids.type) else ids.to_numpy().astype(np.uint64)
+        tiles = pd.DataFrame({'id': tile_ids})
+        for column in VALUE_COLUMNS:
+            values = batch.column(column)
+            if pa.types.is_dictionary(values.type):
+                values = values.cast(values.type.value_type)
+            tiles[column] = values.to_numpy(zero_copy_only=False)
+
+        dynamics = batch.column('dynamics')
+        entries = pc.list_flatten(dynamics)
+        types = entries.field('type')
+        if pa.types.is_dictionary(types.type):
+            types = types.cast(types.type.value_type)
+        yield tiles, pd.DataFrame({
+            'id': tile_ids[pc.list_parent_indices(dynamics).to_numpy()],
+            'type': types.to_numpy(zero_copy_only=False),
+            'timestamp': entries.field('timestamp').to_numpy().astype(np.int64),
+        })
+
+def read_tile_table_chunks(path, chunk_size=CHUNK_SIZE):
+    """
+    Read an exported tile table chunk by chunk.
+
+    Args:
+        path (str): A .csv, .parquet or .arrow tile table.
+        chunk_size (int): Rows per chunk.
+
+    Yields:
+        tuple: (tiles, dynamics) DataFrames. tiles has the uint64 'id' and VALUE_COLUMNS, dynamics
+        one row per entry with 'id', 'type' and 'timestamp'.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".csv":
+        yield from _csv_chunks(path, chunk_size)
+    elif extension in (".parquet", ".arrow"):
+        yield from _columnar_chunks(path, extension[1:], chunk_size)
+    else:
+        raise ValueError(f"Unknown tile table format: {path}")
+
+def function_weights(functions):
     """
-    Merge two CSV files containing H3 tile data based on specified logic.
+    Get the merge weight of every tile_function through its categorical codes.
 
     Args:
-        file1 (str): Path to the first CSV file.
-        file2 (str): Path to the second CSV file.
-        output_file (str): Path to save the merged CSV file.
+        functions (Series): tile_function values, missing ones as NaN.
+
+    Returns:
+        ndarray: Weight per value.
+    """
+    codes, categories = pd.factorize(functions)
+    for category in categories:
+        if category != 'na' and category not in FUNCTION_WEIGHTS:
+            print(f"Unknown function: '{category}'")
+    category_weights = [-1 if category == 'na' else FUNCTION_WEIGHTS.get(category, 0) for category in categories]
+    # Code -1 (missing function) takes the trailing -1
+    return np.array(category_weights + [-1])[codes]
+
+def _aggregate_chunk(tiles):
+    """Merge the rows of one chunk per tile, with the best function and its weight."""
+    for column in ('name1', 'name2'):
+        tiles[column] = tiles[column].replace('', np.nan)
+    weights = function_weights(tiles['tile_function'])
+    tiles['weight'] = weights
+
+    grouped = tiles.groupby('id', sort=False)
+    chunk = grouped.agg(
+        height=('height', 'first'),
+        score1=('score1', 'first'),
+        score2=('score2', 'first'),
+        function_dimensions=('function_dimensions', 'max'),
+        name1=('name1', 'first'),
+        name2=('name2', 'first'),
+    )
+    # First row with the highest weight per tile, ties go to the earlier row
+    best_rows = grouped['weight'].idxmax().reindex(chunk.index).to_numpy()
+    chunk['tile_function'] = tiles['tile_function'].to_numpy()[best_rows]
+    chunk['weight'] = weights[best_rows]
+    return chunk
+
+def _fold_chunk(merged, chunk):
+    """Fold an aggregated chunk into the running aggregate, whose values win ties."""
+    if merged is None:
+        return chunk
+
+    known = chunk.index.isin(merged.index)
+    seen = chunk[known]
+    current = merged.loc[seen.index]
+    for column in ('height', 'score1', 'score2', 'name1', 'name2'):
+        merged.loc[seen.index, column] = current[column].fillna(seen[column])
+    merged.loc[seen.index, 'function_dimensions'] = np.fmax(current['function_dimensions'].to_numpy(dtype=float),
+                                                            seen['function_dimensions'].to_numpy(dtype=float))
+    better = seen.index[seen['weight'].to_numpy() > current['weight'].to_numpy()]
+    merged.loc[better, ['tile_function', 'weight']] = seen.loc[better, ['tile_function', 'weight']]
+
+    # New tiles go last, in order of first appearance
+    return pd.concat([merged, chunk[~known]])
+
+def merge_tile_tables(input_paths, chunk_size=CHUNK_SIZE):
     """
-    # Load the CSV files into DataFrames
-    df1 = pd.read_csv(file1)
-    df2 = pd.read_csv(file2)
-
-    # Define the function weights (ascending order)
-    function_weights = {
-        'water': 1,
-        'amenity': 2,
-        'veg': 3,
-        'park': 4,
-        'built': 5,
-        'religious': 6,
-        'school': 7,
-        'gov': 8,
-        'road': 9
-    }
-
-    # Merge the two DataFrames on the 'id' column
-    merged = pd.merge(df1, df2, on='id', how='outer', suffixes=('_file1', '_file2'))
-
-    # Apply the merging logic
-    merged['center'] = merged['tile_center_file1']  # Always take from the first file
-    merged['neighbors'] = merged['tile_neighbors_file1']  # Always take from the first file
-    merged['function_dimensions'] = merged[['tile_dimensions_file1', 'tile_dimensions_file2']].max(axis=1)  # Take max value
-    merged['height'] = merged['tile_height_file1'].combine_first(merged['tile_height_file2'])  # Prefer first file
-    merged['score1'] = merged['tile_grad_score_file1'].combine_first(merged['tile_grad_score_file2'])  # Prefer first file
-
-    # Merge 'dynamics' by combining distinct values from both files
-    def merge_tile_dynamics(row):
-      dynamics1 = row['tile_dynamics_file1']
-      dynamics2 = row['tile_dynamics_file2']
-
-      # Convert to sets to handle distinct values
-      set1 = set(eval(dynamics1)) if pd.notna(dynamics1) and dynamics1 != "[]" else set()
-      set2 = set(eval(dynamics2)) if pd.notna(dynamics2) and dynamics2 != "[]" else set()
-
-      # Combine the sets and convert back to a comma-separated string
-      merged_dynamics = str(sorted(set1.union(set2)))
-      return merged_dynamics
-
-    merged['dynamics'] = merged.apply(merge_tile_dynamics, axis=1)
-
-    # Resolve 'tile_function' based on weights
-    def resolve_function(row):
-        func1 = row['tile_function_file1']
-        func2 = row['tile_function_file2']
-  
-        # Handle cases where func1 or func2 is NaN
-        if pd.isna(func1) or func1 == 'na':
-            return func2
-        if pd.isna(func2) or func2 == 'na':
-            return func1
-
-        # Check if func1 and func2 exist in function_weights, assign default weight if not
-        weight1 = function_weights.get(func1, 0)  # Default weight is 0 if func1 is not in function_weights
-        weight2 = function_weights.get(func2, 0)  # Default weight is 0 if func2 is not in function_weights
-
-        if(weight1 ==0):
-          print(f"Unknown function in file1: '{func1}'")
-        if(weight2 ==0): 
-          print(f"Unknown function in file2: '{func2}'")
-
-        # Compare weights and return the function with the higher weight
-        return func1 if weight1 >= weight2 else func2
-
-    merged['tile_function'] = merged.apply(resolve_function, axis=1)
-
-    # Select the final columns to save
-    final_columns = ['id', 'center', 'neighbors', 'height', 
-                    'score1', 'tile_function', 'dynamics', 'function_dimensions', 'name1', 'name2']
-    merged = merged[final_columns]
-
-    # Save the merged DataFrame to a new CSV file
-    merged.to_csv(output_file, index=False)
-    print(f"Merged file saved to {output_file}")
-
-
-file1 = '../../Outputs/CSVs/tiles_map_20250526_222224.csv'
-file2 = '../../Outputs/MergedTable/NablusTileTable.csv' 
-output_file = '../../Outputs/MergedTable/merged_tile_tables.csv' 
-merge_h3_csv_files(file1, file2, output_file)
\ No newline at end of file
+    Merge tile tables into one TileTable.
+
+    Every chunk is folded into a running per-tile aggregate as it is read, so memory follows the
+    number of distinct tiles and dynamics entries plus one chunk, not the sum of the inputs.
+
+    Args:
+        input_paths (list): Tile tables to merge, in precedence order.
+        chunk_size (int): Rows read per chunk.
+
+    Returns:
+        TileTable: The merged tiles, in order of first appearance.
+    """
+    merged, dynamics = None, None
+    total_rows = 0
+    for path in input_paths:
+        rows = 0
+        for tiles, chunk_dynamics in read_tile_table_chunks(path, chunk_size):
+            # Chunks are folded in input order, so first values come from the tables listed first
+            merged = _fold_chunk(merged, _aggregate_chunk(tiles))
+            # Distinct dynamics entries, in order of first appearance
+            dynamics = chunk_dynamics if dynamics is None else pd.concat([dynamics, chunk_dynamics])
+            dynamics = dynamics.drop_duplicates(['id', 'type', 'timestamp'], ignore_index=True)
+            rows += len(tiles)
+        print(f"Read {rows} tiles from {path}")
+        total_rows += rows
+
+    tile_table = TileTable(merged.index.to_numpy(dtype=np.uint64))
+    tile_table.height[:] = merged['height'].to_numpy(dtype=float)
+    tile_table.score1[:] = merged['score1'].fillna(0).to_numpy(dtype=float)
+    tile_table.score2[:] = merged['score2'].fillna(0).to_numpy(dtype=float)
+    tile_table.function_dimensions[:] = merged['function_dimensions'].fillna(0).to_numpy(dtype=float)
+
+    function_codes, tile_functions = pd.factorize(merged['tile_function'].fillna('na'))
+    tile_table.function_codes[:] = np.array([tile_table.function_code(f) for f in tile_functions], dtype=np.int8)[function_codes]
+    for column in ('name1', 'name2'):
+        name_codes, names = pd.factorize(merged[column])
+        getattr(tile_table, f"{column}_codes")[:] = np.append(tile_table.name_codes(names), np.int32(0))[name_codes]
+
+    if dynamics is not None and len(dynamics):
+        type_codes, dynamic_types = pd.factorize(dynamics['type'])
+        tile_table.extend_dynamics(tile_table.index.lookup(dynamics['id'].to_numpy(dtype=np.uint64)),
+                                   list(dynamic_types), type_codes, dynamics['timestamp'].to_numpy())
+
+    print(f"Merged {total_rows} tiles of {len(input_paths)} tables into {len(tile_table)} tiles")
+    return tile_table
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merge tile tables into one tile table.")
+    parser.add_argument("output_dir", help="directory of the merged table")
+    parser.add_argument("inputs", nargs="+", help="tile tables (.csv, .parquet, .arrow), earlier ones take precedence")
+    parser.add_argument("--format", choices=["csv", "parquet", "arrow"], default="csv", help="output format")
+    parser.add_argument("--prefix", default="merged_tile_tables", help="output file name prefix")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="rows read per chunk")
+    args = parser.parse_args()
+
+    tile_table = merge_tile_tables(args.inputs, args.chunk_size)
+    if args.format == "csv":
+        from csv_export import export_tiles_map_to_csv
+        export_tiles_map_to_csv(tile_table, args.prefix, output_dir=args.output_dir)
+    else:
+        from columnar_export import export_tiles_map_to_columnar
+        export_tiles_map_to_columnar(tile_table, args.prefix, file_format=args.format, output_dir=args.output_dir)
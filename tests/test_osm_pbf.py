@@ -0,0 +1,63 @@
+"""
+fetch_features_from_pbf on data/small_extract.osm.pbf, read without network access. The extract holds:
+- nodes 1-14: untagged way nodes
+- node 20: amenity=restaurant, node 21: leisure=picnic_table (no requested value)
+- way 100: closed building=yes
+- way 101: open highway=primary
+- ways 102, 103: untagged outer and inner rings of relation 200
+- way 104: barrier=fence (no requested key)
+- relation 200: type=multipolygon, leisure=park
+"""
+import os
+import shapely
+from shapely.geometry import box
+from osm_pbf import fetch_features_from_pbf
+
+PBF_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "small_extract.osm.pbf")
+
+TAG_SETS = [
+    {"building": True},
+    {"highway": ["primary", "secondary"]},
+    {"amenity": ["restaurant"]},
+    {"leisure": ["park"]},
+]
+
+def test_element_id_index():
+    features = fetch_features_from_pbf(PBF_PATH, None, TAG_SETS)
+
+    assert list(features.index.names) == ["element", "id"]
+    assert set(features.index) == {("node", 20), ("way", 100), ("way", 101), ("relation", 200)}
+
+def test_tag_columns():
+    features = fetch_features_from_pbf(PBF_PATH, None, TAG_SETS)
+
+    assert {"building", "height", "highway", "lanes", "amenity", "leisure", "name"} <= set(features.columns)
+    assert features.loc[("way", 100), "height"] == "12"
+    assert features.loc[("node", 20), "name"] == "Cafe"
+    assert features.loc[("relation", 200), "leisure"] == "park"
+
+def test_geometry_types():
+    features = fetch_features_from_pbf(PBF_PATH, None, TAG_SETS)
+
+    assert features.crs.to_epsg() == 4326
+    assert features.geometry[("node", 20)].geom_type == "Point"
+    assert features.geometry[("way", 100)].geom_type == "Polygon"
+    assert features.geometry[("way", 101)].geom_type == "LineString"
+    park = features.geometry[("relation", 200)]
+    assert park.geom_type == "Polygon"
+    assert len(park.interiors) == 1
+
+def test_way_locations_of_untagged_nodes():
+    # The key filter must not drop the untagged member nodes the way geometries are built from
+    features = fetch_features_from_pbf(PBF_PATH, None, TAG_SETS)
+
+    road = features.geometry[("way", 101)]
+    assert shapely.get_coordinates(road).tolist() == [[34.775, 32.078], [34.79, 32.078]]
+    assert shapely.equals(features.geometry[("way", 100)], box(34.780, 32.080, 34.781, 32.081))
+    park = features.geometry[("relation", 200)]
+    assert shapely.equals(park, box(34.782, 32.082, 34.784, 32.084).difference(box(34.7825, 32.0825, 34.7835, 32.0835)))
+
+def test_polygon_filter():
+    features = fetch_features_from_pbf(PBF_PATH, box(34.7795, 32.0795, 34.7815, 32.0815), TAG_SETS)
+
+    assert set(features.index) == {("node", 20), ("way", 100)}
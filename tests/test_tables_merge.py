@@ -0,0 +1,59 @@
+"""
+merge_tile_tables on CSV tile tables written by the current exporter and by older versions of the pipeline.
+"""
+import os
+import csv
+from scripts.TablesMerge import merge_tile_tables
+
+FIELDNAMES = ['id', 'center', 'neighbors', 'height', 'score1', 'score2', 'tile_function', 'dynamics',
+              'function_dimensions', 'name1', 'name2']
+
+def _write_table(path, rows):
+    with open(path, 'w', newline='') as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=FIELDNAMES)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({'center': '', 'neighbors': '[]', 'height': '', 'score1': 0.1, 'score2': 0.1,
+                             'tile_function': 'na', 'function_dimensions': 0, 'name1': '', 'name2': '', **row})
+
+def _dynamics(tile_table):
+    return {record['id']: record['dynamics'] for record in tile_table.iter_records()}
+
+def test_baseline_float_second_timestamps(tmp_path):
+    # The first pipeline versions wrote FOOD and FLOODED with time.time() seconds, simulated events in milliseconds
+    path = os.path.join(tmp_path, "baseline.csv")
+    _write_table(path, [
+        {'id': '8c2d1c1a2d6b1ff', 'tile_function': 'built',
+         'dynamics': "[{'type': 'FOOD', 'timestamp': 1748291234.123456}, {'type': 'DEMO', 'timestamp': 1748291234000}]"},
+        {'id': '8c2d1c1a2d6b3ff', 'dynamics': "[{'type': 'FLOODED', 'timestamp': 1748291234.5}]"},
+    ])
+
+    dynamics = _dynamics(merge_tile_tables([path]))
+
+    assert dynamics['8c2d1c1a2d6b1ff'] == [{'type': 'FOOD', 'timestamp': 1748291234123},
+                                          {'type': 'DEMO', 'timestamp': 1748291234000}]
+    assert dynamics['8c2d1c1a2d6b3ff'] == [{'type': 'FLOODED', 'timestamp': 1748291234500}]
+
+def test_legacy_type_lists(tmp_path):
+    path = os.path.join(tmp_path, "legacy.csv")
+    _write_table(path, [{'id': '8c2d1c1a2d6b1ff', 'dynamics': "['FOOD', 'FLOODED']"}])
+
+    dynamics = _dynamics(merge_tile_tables([path]))
+
+    assert dynamics['8c2d1c1a2d6b1ff'] == [{'type': 'FOOD', 'timestamp': 0}, {'type': 'FLOODED', 'timestamp': 0}]
+
+def test_merge_precedence(tmp_path):
+    first, second = os.path.join(tmp_path, "first.csv"), os.path.join(tmp_path, "second.csv")
+    _write_table(first, [{'id': '8c2d1c1a2d6b1ff', 'tile_function': 'park', 'height': 4, 'function_dimensions': 2,
+                          'dynamics': "[{'type': 'FOOD', 'timestamp': 1748291234000}]"}])
+    _write_table(second, [{'id': '8c2d1c1a2d6b1ff', 'tile_function': 'road', 'height': 9, 'function_dimensions': 7,
+                           'name1': 'Main', 'dynamics': "[{'type': 'FOOD', 'timestamp': 1748291234000}]"},
+                          {'id': '8c2d1c1a2d6b3ff', 'tile_function': 'water'}])
+
+    records = {record['id']: record for record in merge_tile_tables([first, second], chunk_size=1).iter_records()}
+
+    assert list(records) == ['8c2d1c1a2d6b1ff', '8c2d1c1a2d6b3ff']
+    merged = records['8c2d1c1a2d6b1ff']
+    assert (merged['tile_function'], merged['height'], merged['function_dimensions'], merged['name1']) == ('road', 4, 7, 'Main')
+    assert merged['dynamics'] == [{'type': 'FOOD', 'timestamp': 1748291234000}]
+    assert records['8c2d1c1a2d6b3ff']['tile_function'] == 'water'
@@ -0,0 +1,55 @@
+"""
+zonal_statistics on small synthetic GeoTIFFs.
+"""
+import os
+import tracemalloc
+import numpy as np
+import pytest
+import rasterio
+import shapely
+from rasterio.transform import from_origin
+from zonal_stats import zonal_statistics, raster_windows
+
+WIDTH, HEIGHT = 1200, 1000
+
+def _write_raster(path, tiled):
+    values = np.random.default_rng(0).integers(1, 250, (HEIGHT, WIDTH), dtype=np.uint8)
+    values[:100, :100] = 0
+    profile = dict(driver="GTiff", width=WIDTH, height=HEIGHT, count=1, dtype="uint8", crs="EPSG:32636",
+                   transform=from_origin(0, HEIGHT, 1, 1), nodata=0)
+    if tiled:
+        profile.update(tiled=True, blockxsize=256, blockysize=256)
+    with rasterio.open(path, "w", **profile) as dataset:
+        dataset.write(values, 1)
+    return values
+
+def _geometries():
+    # Two halves of the raster, so every pixel is selected
+    return np.array([shapely.box(0, 0, WIDTH / 2, HEIGHT), shapely.box(WIDTH / 2, 0, WIDTH, HEIGHT)])
+
+@pytest.mark.parametrize("tiled", [False, True])
+@pytest.mark.parametrize("window_size", [None, 300, "blocks"])
+@pytest.mark.parametrize("max_memory_bytes", [2_000_000, 1_000_000, 500_000])
+def test_peak_memory_stays_under_the_bound(tmp_path, tiled, window_size, max_memory_bytes):
+    path = os.path.join(tmp_path, "dtm.tif")
+    values = _write_raster(path, tiled)
+
+    with rasterio.open(path) as dataset:
+        windows = list(raster_windows(dataset, 1, window_size, max_memory_bytes, np.uint32))
+        # A first run fills the one-off caches of rasterio and GDAL, outside of the measure
+        zonal_statistics(dataset, _geometries(), dtype=np.uint32, window_size=window_size,
+                         max_memory_bytes=max_memory_bytes)
+        tracemalloc.start()
+        try:
+            start = tracemalloc.get_traced_memory()[0]
+            stats = zonal_statistics(dataset, _geometries(), dtype=np.uint32, window_size=window_size,
+                                     max_memory_bytes=max_memory_bytes)
+            peak = tracemalloc.get_traced_memory()[1] - start
+        finally:
+            tracemalloc.stop()
+
+    assert len(windows) > 1
+    assert peak <= max_memory_bytes
+    left, right = values[:, :WIDTH // 2], values[:, WIDTH // 2:]
+    assert stats["count"].tolist() == [int((left > 0).sum()), int((right > 0).sum())]
+    np.testing.assert_allclose(stats["mean"], [left[left > 0].mean(), right[right > 0].mean()])
@@ -0,0 +1,106 @@
+import numpy as np
+from h3 import H3BaseException
+from h3.api.numpy_int import cell_to_local_ij, grid_disk
+from cell_index import CellIndex
+
+def hex_offsets(k, include_center=True):
+    """
+    Get the local IJ offsets of a k-ring disk.
+
+    In H3 local IJ coordinates, the grid distance between two cells is max(|di|, |dj|, |di - dj|).
+
+    Args:
+        k (int): The disk radius.
+        include_center (bool): Whether the (0, 0) offset is part of the disk.
+
+    Returns:
+        ndarray: (n, 2) array of (di, dj) offsets.
+    """
+    di, dj = np.meshgrid(np.arange(-k, k + 1), np.arange(-k, k + 1), indexing='ij')
+    di, dj = di.ravel(), dj.ravel()
+    distance = np.maximum(np.maximum(np.abs(di), np.abs(dj)), np.abs(di - dj))
+    keep = distance <= k
+    if not include_center:
+        keep &= distance > 0
+    return np.column_stack([di[keep], dj[keep]])
+
+def grid_disk_adjacency(tile_ids, k, include_center=True):
+    """
+    Build the k-ring adjacency of a set of H3 tiles as CSR arrays of tile positions.
+
+    Tiles are placed on the local IJ grid of the first tile, and every disk offset is resolved
+    for all tiles at once with a sorted search. Neighbors outside `tile_ids` are left out. When the
+    local IJ grid cannot be used (the tiles span a pentagon or are too far apart), the disks are
+    built per tile with grid_disk.
+
+    Args:
+        tile_ids (ndarray): uint64 H3 tile IDs.
+        k (int): The disk radius.
+        include_center (bool): Whether every tile is part of its own neighbors.
+
+    Returns:
+        tuple: (indptr, indices). The neighbors of tile i are indices[indptr[i]:indptr[i + 1]].
+    """
+    tile_ids = np.asarray(tile_ids, dtype=np.uint64)
+    tile_count = len(tile_ids)
+    if tile_count == 0:
+        return np.zeros(1, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    try:
+        origin = tile_ids[0]
+        ij = np.array([cell_to_local_ij(origin, h3_id) for h3_id in tile_ids], dtype=np.int64)
+    except H3BaseException:
+        return _grid_disk_adjacency_per_tile(tile_ids, k, include_center)
+
+    # Encode (i, j) as one sortable key, with a margin of k around the tiles
+    i_min, j_min = ij.min(axis=0) - k
+    span = int(ij[:, 1].max() + k - j_min + 1)
+
+    def encode(i, j):
+        return (i - i_min) * span + (j - j_min)
+
+    keys = encode(ij[:, 0], ij[:, 1])
+    order = np.argsort(keys)
+    sorted_keys = keys[order]
+
+    rows, cols = [], []
+    for di, dj in hex_offsets(k, include_center):
+        neighbor_keys = encode(ij[:, 0] + di, ij[:, 1] + dj)
+        positions = np.minimum(np.searchsorted(sorted_keys, neighbor_keys), tile_count - 1)
+        found = sorted_keys[positions] == neighbor_keys
+        rows.append(np.flatnonzero(found))
+        cols.append(order[positions[found]])
+
+    return _pairs_to_csr(np.concatenate(rows), np.concatenate(cols), tile_count)
+
+def _grid_disk_adjacency_per_tile(tile_ids, k, include_center):
+    index = CellIndex(tile_ids)
+    rows, cols = [], []
+    for i, h3_id in enumerate(tile_ids):
+        disk = grid_disk(h3_id, k)
+        if not include_center:
+            disk = disk[disk != h3_id]
+        neighbors = index.lookup(disk)
+        neighbors = neighbors[neighbors >= 0]
+        rows.append(np.full(len(neighbors), i, dtype=np.int64))
+        cols.append(neighbors)
+
+    return _pairs_to_csr(np.concatenate(rows), np.concatenate(cols), len(tile_ids))
+
+def _pairs_to_csr(rows, cols, tile_count):
+    order = np.argsort(rows, kind='stable')
+    indptr = np.zeros(tile_count + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=tile_count), out=indptr[1:])
+    return indptr, cols[order]
+
+def csr_rows(indptr):
+    """
+    Expand CSR row pointers to the row of every stored neighbor.
+
+    Args:
+        indptr (ndarray): CSR row pointers.
+
+    Returns:
+        ndarray: The tile position owning each entry of the CSR indices.
+    """
+    return np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
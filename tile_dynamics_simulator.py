@@ -1,34 +1,71 @@
-import random
 import time
-from datetime import datetime, timedelta
+import numpy as np
 
-def random_recent_timestamp_ms(days: int) -> int:
-    """Returns a random timestamp in milliseconds from the last `days` days."""
-    now = datetime.utcnow()
-    past = now - timedelta(days=days)
-    random_seconds = random.randint(0, int((now - past).total_seconds()))
-    dt = past + timedelta(seconds=random_seconds)
-    return int(dt.timestamp() * 1000)  # milliseconds
+# Simulated event types, their position is the type code of the events table
+DYNAMIC_TYPES = ['FLOOD', 'CONSTRUCTION', 'MAINTENANCE', 'EMERGENCY', 'PUBLIC_EVENT', 'CLOSURE', 'DEMO', 'POLICE']
+# Probability of a tile having 0, 1, 2... events
+EVENT_COUNT_WEIGHTS = [0.997, 0.002, 0.001]
 
-def simulate_tile_dynamics(tiles_map):
+def simulate_dynamics_events(tile_count, seed=None, days=7, now_ms=None, count_weights=EVENT_COUNT_WEIGHTS):
+    """
+    Draw random events for every tile as a columnar events table.
+
+    Every tile gets a number of distinct event types drawn from `count_weights`, each with a
+    timestamp at a random second of the last `days` days. Only the tiles receiving events are
+    drawn, so memory follows the number of events rather than the number of tiles.
+
+    Args:
+        tile_count (int): Number of tiles.
+        seed (int, optional): Seed of the NumPy Generator, the same seed gives the same events.
+        days (int): How far back the timestamps go.
+        now_ms (int, optional): The current time in milliseconds, the wall clock when None.
+        count_weights (list): Probability of 0, 1, 2... events per tile, at most len(DYNAMIC_TYPES) events.
+
+    Returns:
+        tuple: (rows, type_codes, timestamps) arrays sorted by row. Type codes are int8 and index
+        DYNAMIC_TYPES, timestamps are int64 milliseconds.
+    """
+    rng = np.random.default_rng(seed)
+    if now_ms is None:
+        now_ms = int(time.time() * 1000)
+
+    # Number of tiles per event count, then which tiles get them
+    tiles_per_count = rng.multinomial(tile_count, count_weights)
+    event_tiles = rng.choice(tile_count, size=tile_count - tiles_per_count[0], replace=False)
+
+    rows, type_codes = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int8)]
+    start = 0
+    for event_count, count_tiles in enumerate(tiles_per_count[1:], start=1):
+        count_rows = event_tiles[start:start + count_tiles]
+        start += count_tiles
+        # Distinct types per tile: the first `event_count` positions of a random permutation
+        types = np.argsort(rng.random((count_tiles, len(DYNAMIC_TYPES))), axis=1)[:, :event_count]
+        rows.append(np.repeat(count_rows, event_count))
+        type_codes.append(types.reshape(-1).astype(np.int8))
+
+    rows = np.concatenate(rows)
+    type_codes = np.concatenate(type_codes)
+    seconds_ago = rng.integers(0, days * 24 * 3600, size=len(rows), endpoint=True)
+    timestamps = now_ms - seconds_ago * 1000
+
+    order = np.argsort(rows, kind='stable')
+    return rows[order], type_codes[order], timestamps[order]
+
+def simulate_tile_dynamics(tile_table, seed=None, days=7):
+    """
+    Append random events to the dynamics of the tiles.
+
+    Args:
+        tile_table (TileTable): The tiles of the area of interest.
+        seed (int, optional): Seed of the simulation, random when None.
+        days (int): How far back the event timestamps go.
+
+    Returns:
+        None: Appends to the dynamics of `tile_table` in place.
+    """
     print("simulate_tile_dynamics...")
     try:
-        # random Dynamics
-        event_to_dynamic = {
-            'flood': 'FLOOD',
-            'construction': 'CONSTRUCTION',
-            'maintenance': 'MAINTENANCE',
-            'emergency': 'EMERGENCY',
-            'public_event': 'PUBLIC_EVENT',
-            'closure': 'CLOSURE',
-            'demo': 'DEMO',
-            'police': 'POLICE'
-        }
-        event_pool = list(event_to_dynamic.keys())
-        for tile_id in tiles_map.keys():
-            num_events = random.choices([0, 1, 2], weights=[0.997, 0.002, 0.001])[0]
-            chosen_events = random.sample(event_pool, num_events)
-            dynamics = [{'type': event_to_dynamic[event], 'timestamp': random_recent_timestamp_ms(7)} for event in chosen_events]
-            tiles_map[tile_id]['dynamics'] = dynamics
+        rows, type_codes, timestamps = simulate_dynamics_events(len(tile_table), seed, days)
+        tile_table.extend_dynamics(rows, DYNAMIC_TYPES, type_codes, timestamps)
     except Exception as e:
         print(f"Error simulate_tile_dynamics: {e}")
@@ -0,0 +1,243 @@
+import numpy as np
+import shapely
+from h3 import geo_to_h3shape
+from h3.api.numpy_int import cell_to_boundary, get_resolution, h3shape_to_cells_experimental, latlng_to_cell
+from cell_index import CellIndex, cells_to_parents
+from tile_adjacency import grid_disk_adjacency
+from inputs.config import *
+
+def cells_to_polygons(tile_ids):
+    """
+    Build the (lng, lat) hexagon of every H3 tile as a shapely geometry array.
+
+    Args:
+        tile_ids (ndarray): uint64 H3 tile IDs.
+
+    Returns:
+        ndarray: Shapely polygons aligned with `tile_ids`.
+    """
+    # h3 has no batched boundary call, one call per tile on plain integers
+    boundaries = [cell_to_boundary(h3_id) for h3_id in tile_ids]
+    if not boundaries:
+        return np.empty(0, dtype=object)
+
+    # Pentagons have 5 vertices, repeat their last vertex so every ring has the same length
+    ring_size = max(len(boundary) for boundary in boundaries)
+    coords = np.array([boundary + (boundary[-1],) * (ring_size - len(boundary)) for boundary in boundaries])
+
+    # cell_to_boundary returns (lat, lng), shapely expects (x=lng, y=lat)
+    return shapely.polygons(coords[:, :, ::-1])
+
+def project_geometries(geometries, crs):
+    """
+    Re-project (lng, lat) geometries to another CRS in one vectorized call.
+
+    Args:
+        geometries (ndarray): Shapely geometries in EPSG:4326.
+        crs: Target CRS, anything pyproj.CRS accepts.
+
+    Returns:
+        ndarray: The projected geometries.
+    """
+    # pyproj is imported on first projection, runs that never project do not load it
+    import pyproj
+    transformer = pyproj.Transformer.from_crs("EPSG:4326", crs, always_xy=True)
+    return shapely.transform(geometries, lambda coords: np.column_stack(transformer.transform(coords[:, 0], coords[:, 1])))
+
+class TileGeometry:
+    """
+    The hexagons of the AOI tiles, built once per run and shared by every stage.
+
+    Attributes:
+        tile_ids (ndarray): uint64 H3 tile IDs, in the order of the geometry arrays.
+        polygons (ndarray): Shapely (lng, lat) hexagons aligned with `tile_ids`.
+    """
+
+    def __init__(self, tile_ids):
+        self.tile_ids = np.asarray(tile_ids, dtype=np.uint64)
+        self.polygons = cells_to_polygons(self.tile_ids)
+        self._index = None
+        self._tree = None
+        self._projected = {}
+        self._adjacency = {}
+        self._hierarchy = None
+
+    def __len__(self):
+        return len(self.tile_ids)
+
+    @property
+    def res(self):
+        return get_resolution(self.tile_ids[0]) if len(self.tile_ids) else None
+
+    @property
+    def index(self):
+        """CellIndex: Finds the position of H3 tile IDs in the geometry arrays."""
+        if self._index is None:
+            self._index = CellIndex(self.tile_ids)
+        return self._index
+
+    @property
+    def tree(self):
+        """STRtree: Spatial index of the (lng, lat) hexagons, built on first use."""
+        if self._tree is None:
+            self._tree = shapely.STRtree(self.polygons)
+        return self._tree
+
+    def projected(self, crs):
+        """
+        Get the hexagons in another CRS, projected on first use and cached.
+
+        Args:
+            crs: Target CRS, anything pyproj.CRS accepts.
+
+        Returns:
+            ndarray: The projected hexagons aligned with `tile_ids`.
+        """
+        import pyproj
+        key = pyproj.CRS.from_user_input(crs).to_string()
+        if key not in self._projected:
+            self._projected[key] = project_geometries(self.polygons, crs)
+        return self._projected[key]
+
+    def adjacency(self, k, include_center=True):
+        """
+        Get the k-ring adjacency of the tiles, built on first use and cached.
+
+        Args:
+            k (int): The disk radius.
+            include_center (bool): Whether every tile is part of its own neighbors.
+
+        Returns:
+            tuple: (indptr, indices) CSR arrays of tile positions, see grid_disk_adjacency.
+        """
+        key = (k, include_center)
+        if key not in self._adjacency:
+            self._adjacency[key] = grid_disk_adjacency(self.tile_ids, k, include_center)
+        return self._adjacency[key]
+
+    def metric_crs(self):
+        """
+        Get the UTM zone CRS covering the tiles, for distances and areas in meters.
+
+        Returns:
+            pyproj.CRS: The UTM CRS of the tiles center.
+        """
+        import pyproj
+        from pyproj.aoi import AreaOfInterest
+        from pyproj.database import query_utm_crs_info
+
+        west, south, east, north = shapely.total_bounds(self.polygons)
+        utm_crs_info = query_utm_crs_info(
+            datum_name="WGS 84",
+            area_of_interest=AreaOfInterest(west, south, east, north),
+        )
+        return pyproj.CRS.from_epsg(utm_crs_info[0].code)
+
+    def hierarchy(self):
+        """
+        Get the parent cell groups of the tiles, from the coarsest level to the finest, built on first use.
+
+        Each level groups the tiles by their parent at that resolution and holds the convex hull of
+        every group's hexagons. H3 children can stick out of their parent hexagon, the hull of the
+        actual tiles always covers them.
+
+        Returns:
+            list: (groups, hulls) per level, `groups` the group of every tile and `hulls` the group hulls.
+        """
+        if self._hierarchy is None:
+            self._hierarchy = []
+            if len(self.tile_ids) >= HIERARCHY_MIN_TILES:
+                # Fine to coarse, the hulls of a level are the hulls of the groups of the level below
+                cell_ids, geometries = self.tile_ids, self.polygons
+                for parent_res in range(self.res - 1, max(0, self.res - HIERARCHY_LEVELS) - 1, -1):
+                    parent_ids, members = np.unique(cells_to_parents(cell_ids, parent_res), return_inverse=True)
+                    order = np.argsort(members, kind='stable')
+                    hulls = shapely.convex_hull(shapely.multipolygons(geometries[order], indices=members[order]))
+                    groups = np.searchsorted(parent_ids, cells_to_parents(self.tile_ids, parent_res))
+                    self._hierarchy.insert(0, (groups, hulls))
+                    cell_ids, geometries = parent_ids, hulls
+        return self._hierarchy
+
+    def intersects(self, geometry):
+        """
+        Test every tile against one geometry, typically the union of a feature class.
+
+        On large tile sets the parent cells are tested first, coarse to fine: the tiles of a parent
+        whose hull lies inside the geometry all hit, the tiles of a parent disjoint from it all miss,
+        and only the parents on the geometry boundary are refined, down to the tiles themselves.
+
+        Args:
+            geometry: A shapely (lng, lat) geometry.
+
+        Returns:
+            ndarray: Boolean mask aligned with `tile_ids`.
+        """
+        shapely.prepare(geometry)
+        hits = np.zeros(len(self.tile_ids), dtype=bool)
+        undecided = np.ones(len(self.tile_ids), dtype=bool)
+
+        for groups, hulls in self.hierarchy():
+            # Groups nest, the undecided tiles always make up whole groups of the next level
+            tested = np.unique(groups[undecided])
+            touching = shapely.intersects(geometry, hulls[tested])
+            inside = np.zeros(len(hulls), dtype=bool)
+            inside[tested[touching]] = shapely.contains(geometry, hulls[tested[touching]])
+            refine = np.zeros(len(hulls), dtype=bool)
+            refine[tested[touching]] = ~inside[tested[touching]]
+
+            hits |= undecided & inside[groups]
+            undecided &= refine[groups]
+
+        # Tiles of the boundary parents
+        rows = np.flatnonzero(undecided)
+        hits[rows] = shapely.intersects(geometry, self.polygons[rows])
+        return hits
+
+def features_to_cells(geometries, tile_geometry):
+    """
+    Find the H3 tiles touched by features, working from the features instead of testing every tile.
+
+    Polygons are clipped to the tiles extent and polyfilled with the 'overlap' containment mode,
+    points map to the tile containing them, and lines are joined against the tile hexagons through
+    their spatial index. Feature parts outside the tiles extent cost nothing.
+
+    Args:
+        geometries (list): Shapely (lng, lat) geometries of the features.
+        tile_geometry (TileGeometry): The tiles of the area of interest.
+
+    Returns:
+        ndarray: Sorted positions of the tiles of `tile_geometry` touched by at least one feature.
+    """
+    res = tile_geometry.res
+    tile_index = tile_geometry.index
+    parts = shapely.get_parts(np.asarray(geometries, dtype=object))
+    while len(parts) and (shapely.get_type_id(parts) >= 4).any():
+        parts = shapely.get_parts(parts)
+
+    type_ids = shapely.get_type_id(parts)
+    rows = [np.zeros(0, dtype=np.int64)]
+
+    # Areal features: clip to the tiles extent padded by one cell, then polyfill the rest. Every tile
+    # lies inside the clip rectangle, so it overlaps the clipped part exactly where it overlaps the feature
+    polygons = parts[type_ids == 3]
+    if len(polygons):
+        west, south, east, north = shapely.total_bounds(tile_geometry.polygons)
+        cell_west, cell_south, cell_east, cell_north = tile_geometry.polygons[0].bounds
+        pad = max(cell_east - cell_west, cell_north - cell_south)
+        clipped = shapely.clip_by_rect(polygons, west - pad, south - pad, east + pad, north + pad)
+        clipped = shapely.get_parts(clipped[~shapely.is_empty(clipped)])
+        for part in clipped[shapely.get_type_id(clipped) == 3]:
+            rows.append(tile_index.lookup(h3shape_to_cells_experimental(geo_to_h3shape(part), res, contain='overlap')))
+
+    # Point features: the tile containing the point
+    point_cells = [latlng_to_cell(y, x, res) for x, y in shapely.get_coordinates(parts[type_ids == 0])]
+    rows.append(tile_index.lookup(point_cells))
+
+    # Linear features: exact intersection test on the tiles the index returns
+    lines = parts[(type_ids == 1) | (type_ids == 2)]
+    if len(lines):
+        _, tile_rows = tile_geometry.tree.query(lines, predicate='intersects')
+        rows.append(tile_rows)
+
+    rows = np.unique(np.concatenate(rows))
+    return rows[rows >= 0]
@@ -0,0 +1,316 @@
+import numpy as np
+from h3 import int_to_str
+from h3.api.numpy_int import cell_to_latlng, grid_ring
+from cell_index import CellIndex
+from tile_geometry import TileGeometry
+
+# Tile functions known up front, their position is the stored int8 code
+TILE_FUNCTIONS = ['na', 'road', 'veg', 'park', 'built', 'school', 'religious', 'amenity', 'water', 'food', 'gov']
+
+class TileTable:
+    """
+    Struct-of-arrays store of the AOI tiles, replacing the former dict-of-dicts tiles_map.
+
+    Tiles are identified by 64-bit integer H3 IDs, hex strings only appear in exports.
+    Every per-tile attribute is a NumPy column indexed by tile position. Categorical columns
+    (tile_function, name1, name2) hold integer codes into shared category lists, neighbors come
+    from the tile adjacency, and dynamics live in a side table of (row, type code, timestamp).
+
+    Attributes:
+        tile_ids (ndarray): uint64 H3 tile IDs, the row order of every column.
+        center_lat (ndarray): Tile center latitude.
+        center_lng (ndarray): Tile center longitude.
+        height (ndarray): Tile height, NaN when unknown.
+        hard_height (ndarray): Raster height before softening, NaN when unknown.
+        score1 (ndarray): Gradient score.
+        score2 (ndarray): Secondary score.
+        function_codes (ndarray): int8 codes into `functions`.
+        functions (list): tile_function categories.
+        function_dimensions (ndarray): Road width or building height of the tile.
+        name1_codes (ndarray): int32 codes into `names`.
+        name2_codes (ndarray): int32 codes into `names`.
+        names (list): Interned names, code 0 is the empty name.
+        dynamic_types (list): Dynamic type categories.
+    """
+
+    def __init__(self, tile_ids):
+        self.tile_ids = np.asarray(tile_ids, dtype=np.uint64)
+        tile_count = len(self.tile_ids)
+
+        centers = np.array([cell_to_latlng(h3_id) for h3_id in self.tile_ids], dtype=float).reshape(tile_count, 2)
+        self.center_lat = centers[:, 0]
+        self.center_lng = centers[:, 1]
+
+        self.height = np.full(tile_count, np.nan)
+        self.hard_height = np.full(tile_count, np.nan)
+        self.score1 = np.zeros(tile_count)
+        self.score2 = np.zeros(tile_count)
+        self.function_codes = np.zeros(tile_count, dtype=np.int8)
+        self.functions = list(TILE_FUNCTIONS)
+        self.function_dimensions = np.zeros(tile_count)
+        self.name1_codes = np.zeros(tile_count, dtype=np.int32)
+        self.name2_codes = np.zeros(tile_count, dtype=np.int32)
+        self.names = ['']
+        self._name_codes = {'': 0}
+
+        self.dynamic_types = []
+        self._dynamic_rows = []
+        self._dynamic_type_codes = []
+        self._dynamic_timestamps = []
+
+        self._index = None
+        self._geometry = None
+
+    def __len__(self):
+        return len(self.tile_ids)
+
+    @property
+    def index(self):
+        """CellIndex: Finds the rows of H3 tile IDs."""
+        if self._index is None:
+            self._index = CellIndex(self.tile_ids)
+        return self._index
+
+    @property
+    def geometry(self):
+        """TileGeometry: The tile hexagons and adjacency, built on first use."""
+        if self._geometry is None:
+            self._geometry = TileGeometry(self.tile_ids)
+        return self._geometry
+
+    # --- tile_function ---
+    def function_code(self, tile_function):
+        """
+        Get the code of a tile_function, registering it when new.
+
+        Args:
+            tile_function (str): The tile_function name.
+
+        Returns:
+            int: The code stored in `function_codes`.
+        """
+        if tile_function not in self.functions:
+            self.functions.append(tile_function)
+        return self.functions.index(tile_function)
+
+    def set_function(self, rows, tile_function):
+        """
+        Set the tile_function of some rows.
+
+        Args:
+            rows (ndarray): Rows (positions or boolean mask) to update.
+            tile_function (str): The tile_function name.
+        """
+        self.function_codes[rows] = self.function_code(tile_function)
+
+    def has_function(self, tile_functions):
+        """
+        Test every tile's function against a list of tile_function names.
+
+        Args:
+            tile_functions (list): tile_function names.
+
+        Returns:
+            ndarray: Boolean mask aligned with the rows.
+        """
+        codes = [self.functions.index(f) for f in tile_functions if f in self.functions]
+        return np.isin(self.function_codes, codes)
+
+    def tile_functions(self):
+        """ndarray: The tile_function name of every row."""
+        return np.array(self.functions, dtype=object)[self.function_codes]
+
+    # --- names ---
+    def name_code(self, name):
+        """
+        Get the code of a name, interning it when new.
+
+        Args:
+            name (str): The name, None is stored as the empty name.
+
+        Returns:
+            int: The code stored in `name1_codes` / `name2_codes`.
+        """
+        name = name or ''
+        code = self._name_codes.get(name)
+        if code is None:
+            code = self._name_codes[name] = len(self.names)
+            self.names.append(name)
+        return code
+
+    def name_codes(self, names):
+        """
+        Intern a sequence of names.
+
+        Args:
+            names (list): Names, None entries are stored as the empty name.
+
+        Returns:
+            ndarray: int32 codes aligned with `names`.
+        """
+        return np.array([self.name_code(name) for name in names], dtype=np.int32)
+
+    # --- column state ---
+    def column_arrays(self, columns):
+        """
+        Copy some columns, with the category lists their codes index, e.g. to persist them.
+
+        Args:
+            columns (list): Column attribute names, e.g. ['function_codes', 'height'].
+
+        Returns:
+            dict: Arrays by name, 'functions' / 'names' added for coded columns.
+        """
+        arrays = {column: getattr(self, column).copy() for column in columns}
+        if 'function_codes' in columns:
+            arrays['functions'] = np.array(self.functions, dtype=str)
+        if 'name1_codes' in columns or 'name2_codes' in columns:
+            arrays['names'] = np.array(self.names, dtype=str)
+        return arrays
+
+    def load_columns(self, arrays):
+        """
+        Overwrite columns from arrays returned by `column_arrays`.
+
+        Args:
+            arrays (dict): Arrays by column name.
+        """
+        for column, values in arrays.items():
+            if column == 'functions':
+                self.functions = values.tolist()
+            elif column == 'names':
+                self.names = values.tolist()
+                self._name_codes = {name: code for code, name in enumerate(self.names)}
+            else:
+                getattr(self, column)[:] = values
+
+    # --- dynamics side table ---
+    def dynamic_type_code(self, dynamic_type):
+        """
+        Get the code of a dynamic type, registering it when new.
+
+        Args:
+            dynamic_type (str): The dynamic type, e.g. "FOOD".
+
+        Returns:
+            int: The int8 code stored in the dynamics side table.
+        """
+        if dynamic_type not in self.dynamic_types:
+            self.dynamic_types.append(dynamic_type)
+        return self.dynamic_types.index(dynamic_type)
+
+    def append_dynamics(self, rows, dynamic_type, timestamps):
+        """
+        Append one dynamic to each of some rows.
+
+        Args:
+            rows (ndarray): Tile rows receiving the dynamic.
+            dynamic_type (str): The dynamic type.
+            timestamps (int | ndarray): Timestamps in milliseconds, one per row or one for all.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        self._dynamic_rows.append(rows)
+        self._dynamic_type_codes.append(np.full(len(rows), self.dynamic_type_code(dynamic_type), dtype=np.int8))
+        self._dynamic_timestamps.append(np.broadcast_to(np.asarray(timestamps, dtype=np.int64), rows.shape).copy())
+
+    def extend_dynamics(self, rows, dynamic_types, type_codes, timestamps):
+        """
+        Append dynamics coded against another list of dynamic types, e.g. from another TileTable.
+
+        Args:
+            rows (ndarray): Tile rows of the entries.
+            dynamic_types (list): The dynamic types `type_codes` index.
+            type_codes (ndarray): Type code of every entry.
+            timestamps (ndarray): Timestamp in milliseconds of every entry.
+        """
+        code_map = np.array([self.dynamic_type_code(dynamic_type) for dynamic_type in dynamic_types], dtype=np.int8)
+        self._dynamic_rows.append(np.asarray(rows, dtype=np.int64))
+        self._dynamic_type_codes.append(code_map[np.asarray(type_codes, dtype=np.int64)])
+        self._dynamic_timestamps.append(np.asarray(timestamps, dtype=np.int64))
+
+    def dynamics(self):
+        """
+        Get the dynamics side table, sorted by row and in insertion order within a row.
+
+        Returns:
+            tuple: (rows, type_codes, timestamps) arrays. Type codes index `dynamic_types`.
+        """
+        if not self._dynamic_rows:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int8), np.zeros(0, dtype=np.int64)
+
+        rows = np.concatenate(self._dynamic_rows)
+        type_codes = np.concatenate(self._dynamic_type_codes)
+        timestamps = np.concatenate(self._dynamic_timestamps)
+        order = np.argsort(rows, kind='stable')
+        self._dynamic_rows, self._dynamic_type_codes, self._dynamic_timestamps = [rows[order]], [type_codes[order]], [timestamps[order]]
+        return rows[order], type_codes[order], timestamps[order]
+
+    def dynamics_count(self):
+        """int: Number of dynamics entries appended so far."""
+        return sum(len(rows) for rows in self._dynamic_rows)
+
+    def dynamics_since(self, start):
+        """
+        Get the dynamics entries appended after the first `start` ones, in insertion order.
+
+        Only valid while `dynamics()` has not been called since `start` was taken, it reorders the entries.
+
+        Args:
+            start (int): Number of entries to skip, from `dynamics_count()`.
+
+        Returns:
+            tuple: (rows, type_codes, timestamps) arrays. Type codes index `dynamic_types`.
+        """
+        if not self._dynamic_rows:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int8), np.zeros(0, dtype=np.int64)
+        return (np.concatenate(self._dynamic_rows)[start:], np.concatenate(self._dynamic_type_codes)[start:],
+                np.concatenate(self._dynamic_timestamps)[start:])
+
+    # --- export views ---
+    def neighbor_ids(self, row):
+        """
+        Get the H3 IDs of the neighbors of a tile, including neighbors outside the AOI.
+
+        Args:
+            row (int): The tile row.
+
+        Returns:
+            ndarray: uint64 neighbor H3 tile IDs.
+        """
+        h3_id = self.tile_ids[row]
+        neighbors = grid_ring(h3_id, 1)
+        return neighbors[neighbors != h3_id]
+
+    def iter_records(self, string_ids=True, rows=None):
+        """
+        Iterate the tiles as dicts in the former tiles_map layout, for row-oriented exports.
+
+        Args:
+            string_ids (bool): Write tile and neighbor IDs as H3 hex strings instead of integers.
+            rows (ndarray, optional): Rows to iterate, in order. All rows when None.
+
+        Yields:
+            dict: One record per tile.
+        """
+        format_id = int_to_str if string_ids else int
+        dynamic_rows, dynamic_type_codes, dynamic_timestamps = self.dynamics()
+        dynamic_bounds = np.searchsorted(dynamic_rows, np.arange(len(self) + 1))
+        tile_functions = self.tile_functions()
+
+        for row in (range(len(self)) if rows is None else rows):
+            h3_id = self.tile_ids[row]
+            start, end = dynamic_bounds[row], dynamic_bounds[row + 1]
+            yield {
+                'id': format_id(h3_id),
+                'center': [float(self.center_lat[row]), float(self.center_lng[row])],
+                'neighbors': [format_id(neighbor) for neighbor in self.neighbor_ids(row)],
+                'height': None if np.isnan(self.height[row]) else float(self.height[row]),
+                'score1': float(self.score1[row]),
+                'score2': float(self.score2[row]),
+                'tile_function': tile_functions[row],
+                'dynamics': [{'type': self.dynamic_types[code], 'timestamp': int(timestamp)}
+                             for code, timestamp in zip(dynamic_type_codes[start:end], dynamic_timestamps[start:end])],
+                'function_dimensions': float(self.function_dimensions[row]),
+                'name1': self.names[self.name1_codes[row]],
+                'name2': self.names[self.name2_codes[row]],
+            }
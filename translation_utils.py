@@ -20,14 +20,23 @@ overrides_map = {
     'نابلس': 'Nablus'
 }
 
+# char_map as a single str.translate table, and the cleanup patterns compiled once
+TRANSLITERATION_TABLE = str.maketrans(char_map)
+ARABIC_PATTERN = re.compile(r'[\u0600-\u06FF]')
+APOSTROPHES_PATTERN = re.compile(r"'+")
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+def is_arabic(text):
+    return bool(ARABIC_PATTERN.search(text))
+
 def capitalize_name(name):
     return ' '.join(word.capitalize() for word in name.split())
 
 def transliterate_arabic_name(text):
     if text in overrides_map:
         return overrides_map[text]
-    translit = ''.join(char_map.get(c, c) for c in text)
-    translit = re.sub(r"'+", "'", translit)  # collapse multiple apostrophes
-    translit = re.sub(r'\s+', ' ', translit).strip()
+    translit = text.translate(TRANSLITERATION_TABLE)
+    translit = APOSTROPHES_PATTERN.sub("'", translit)  # collapse multiple apostrophes
+    translit = WHITESPACE_PATTERN.sub(' ', translit).strip()
     return capitalize_name(translit)
 
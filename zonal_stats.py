@@ -0,0 +1,261 @@
+import math
+import time
+import numpy as np
+import shapely
+from shapely import STRtree
+from rasterio.features import rasterize
+from rasterio.windows import Window
+import instrumentation
+
+# Part of the memory bound kept for what is not per pixel: the loop state, and the objects rasterio
+# creates on every rasterize call until the garbage collector frees them
+WINDOW_RESERVED_BYTES = 64 * 1024
+
+def window_bytes_per_pixel(raster_dtype, dtype=None):
+    """
+    Get the peak bytes _zonal_statistics holds per window pixel, every pixel counted as selected.
+
+    Args:
+        raster_dtype (numpy dtype): The dtype of the raster band.
+        dtype (numpy dtype, optional): The dtype pixel values are cast to, see zonal_statistics.
+
+    Returns:
+        int: Bytes per pixel.
+    """
+    raster_size = np.dtype(raster_dtype).itemsize
+    cast_size = np.dtype(dtype).itemsize if dtype is not None else 0
+    return max(
+        # The raster values, int32 labels, valid mask, and the selected labels and values
+        2 * raster_size + 4 + 1 + 4,
+        # Selected int32 labels, the selected values in their largest dtype and their float64 copy
+        4 + max(raster_size, cast_size) + 8,
+        # int32 labels, float64 values and the intp copy of the labels np.bincount makes
+        4 + 8 + 8,
+    )
+
+def _fit_window_shape(height, width, max_pixels, block_height, block_width):
+    """
+    Shrink a window shape to at most `max_pixels` pixels, keeping whole native blocks when possible.
+
+    The width is kept as long as one row of blocks fits, so striped files (blocks of one row by
+    the full width) are read as full-width strips, otherwise it is narrowed to whole blocks. The
+    height is then the number of rows that fit, rounded down to whole blocks.
+
+    Args:
+        height (int): Window height in pixels.
+        width (int): Window width in pixels.
+        max_pixels (int): Pixel budget of a window.
+        block_height (int): Native block height, 1 to ignore the block layout.
+        block_width (int): Native block width, 1 to ignore the block layout.
+
+    Returns:
+        tuple: (height, width) of at most `max_pixels` pixels.
+    """
+    if height * width <= max_pixels:
+        return height, width
+
+    unit_height = min(block_height, height)
+    if width * unit_height > max_pixels:
+        max_width = max_pixels // unit_height
+        # Blocks taller than the budget can only be split into narrower columns
+        width = max(1, max_width // block_width * block_width or max_width)
+
+    fit_height = max_pixels // width
+    if fit_height < height:
+        height = fit_height // block_height * block_height or fit_height
+    return height, width
+
+def _split_window(window, height, width):
+    for row_off in range(0, window.height, height):
+        for col_off in range(0, window.width, width):
+            yield Window(window.col_off + col_off, window.row_off + row_off,
+                         min(width, window.width - col_off), min(height, window.height - row_off))
+
+def _crop_window(window, area):
+    # The part of `window` inside `area`, None when they do not overlap
+    col_off, row_off = max(window.col_off, area.col_off), max(window.row_off, area.row_off)
+    col_end = min(window.col_off + window.width, area.col_off + area.width)
+    row_end = min(window.row_off + window.height, area.row_off + area.height)
+    if col_end <= col_off or row_end <= row_off:
+        return None
+    return Window(col_off, row_off, col_end - col_off, row_end - row_off)
+
+def bounds_window(dataset, bounds):
+    """
+    Get the whole-pixel window of a raster covering bounds, clipped to the raster.
+
+    Args:
+        dataset (DatasetReader): An open rasterio dataset.
+        bounds (tuple): (left, bottom, right, top) in the dataset CRS.
+
+    Returns:
+        Window: Integer window of every pixel whose footprint meets `bounds`, None outside the raster.
+    """
+    window = dataset.window(*bounds)
+    col_off, row_off = math.floor(window.col_off), math.floor(window.row_off)
+    area = Window(col_off, row_off, math.ceil(window.col_off + window.width) - col_off,
+                  math.ceil(window.row_off + window.height) - row_off)
+    return _crop_window(area, Window(0, 0, dataset.width, dataset.height))
+
+def raster_windows(dataset, band=1, window_size=None, max_memory_bytes=None, dtype=None, bounds=None):
+    """
+    Split a raster into the windows the zonal statistics are computed on.
+
+    Args:
+        dataset (DatasetReader): An open rasterio dataset.
+        band (int): The band that will be read.
+        window_size (int | str, optional): Side of a square window grid in pixels, or "blocks" to walk
+            the file's native blocks. None reads the whole raster (or `bounds`) as one window.
+        max_memory_bytes (int, optional): Upper bound for the buffers of a single window. Windows are
+            shrunk (keeping whole native blocks where possible) until they fit, native blocks over the
+            bound are split.
+        dtype (numpy dtype, optional): The dtype the zonal statistics cast pixel values to.
+        bounds (tuple, optional): (left, bottom, right, top) in the dataset CRS. Only the pixels
+            meeting them are covered, None covers the whole raster.
+
+    Yields:
+        Window: rasterio Windows covering the raster, generated one at a time so large rasters cut in
+        small windows hold no window list.
+    """
+    area = Window(0, 0, dataset.width, dataset.height)
+    if bounds is not None:
+        area = bounds_window(dataset, bounds)
+        if area is None:
+            return
+
+    block_height, block_width = dataset.block_shapes[band - 1]
+    max_pixels = None
+    if max_memory_bytes is not None:
+        bytes_per_pixel = window_bytes_per_pixel(dataset.dtypes[band - 1], dtype)
+        max_pixels = max(1, (max_memory_bytes - WINDOW_RESERVED_BYTES) // bytes_per_pixel)
+
+    if window_size == "blocks":
+        # Blocks over the bound are split into pieces that fit, the other blocks are read whole
+        height, width = block_height, block_width
+        if max_pixels is not None:
+            height, width = _fit_window_shape(block_height, block_width, max_pixels, 1, 1)
+        for _, block in dataset.block_windows(band):
+            block = _crop_window(block, area)
+            if block is not None:
+                yield from _split_window(block, height, width)
+        return
+
+    if window_size is None:
+        window_height, window_width = area.height, area.width
+    else:
+        window_height = window_width = int(window_size)
+    window_width = min(window_width, area.width)
+    window_height = min(window_height, area.height)
+
+    if max_pixels is not None:
+        window_height, window_width = _fit_window_shape(window_height, window_width, max_pixels,
+                                                        block_height, block_width)
+
+    # Along an axis where windows span whole blocks the grid starts at the raster origin, so the
+    # windows stay aligned with the blocks, otherwise at the covered area
+    first_row = area.row_off // window_height * window_height if window_height % block_height == 0 else area.row_off
+    first_col = area.col_off // window_width * window_width if window_width % block_width == 0 else area.col_off
+    for row_off in range(first_row, area.row_off + area.height, window_height):
+        for col_off in range(first_col, area.col_off + area.width, window_width):
+            yield _crop_window(Window(col_off, row_off, window_width, window_height), area)
+
+def zonal_statistics(dataset, geometries, band=1, dtype=None, window_size=None, max_memory_bytes=None):
+    """
+    Compute per-geometry pixel statistics of a raster band, streaming it window by window.
+
+    In every window, the positions of the geometries overlapping it are burned into a label grid,
+    a pixel belongs to a geometry when its center lies inside it (the rule rasterio.mask.mask uses),
+    and the statistics are reduced with np.bincount. Geometries straddling window edges accumulate
+    over all their windows. Pixels equal to the dataset nodata value are ignored. Only the part of
+    the raster under the total bounds of the geometries is read.
+
+    Args:
+        dataset (DatasetReader): An open rasterio dataset.
+        geometries (ndarray): Shapely geometries in the dataset CRS. They must not overlap.
+        band (int): The band to read.
+        dtype (numpy dtype, optional): Cast pixel values to this type before computing statistics.
+        window_size (int | str, optional): See raster_windows. None reads the raster under the geometries at once.
+        max_memory_bytes (int, optional): See raster_windows.
+
+    Returns:
+        dict: 'mean', 'count', 'min' and 'max' arrays aligned with `geometries`. Geometries
+        without valid pixels get a count of 0 and NaN statistics.
+    """
+    with instrumentation.span("zonal_statistics"):
+        return _zonal_statistics(dataset, geometries, band, dtype, window_size, max_memory_bytes)
+
+def _zonal_statistics(dataset, geometries, band, dtype, window_size, max_memory_bytes):
+    geometries = np.asarray(geometries, dtype=object)
+    geometry_count = len(geometries)
+    count = np.zeros(geometry_count, dtype=np.int64)
+    total = np.zeros(geometry_count)
+    minimum = np.full(geometry_count, np.inf)
+    maximum = np.full(geometry_count, -np.inf)
+
+    geometries_tree = STRtree(geometries)
+    # Only the raster under the geometries is read
+    bounds = shapely.total_bounds(geometries)
+    windows = []
+    if np.isfinite(bounds).all():
+        windows = raster_windows(dataset, band, window_size, max_memory_bytes, dtype, bounds)
+
+    for window in windows:
+        # Only the geometries overlapping this window are burned
+        candidates = geometries_tree.query(shapely.box(*dataset.window_bounds(window)))
+        candidates = candidates[~shapely.is_empty(geometries[candidates])]
+        if len(candidates) == 0:
+            continue
+
+        read_start = time.perf_counter()
+        values = dataset.read(band, window=window)
+        instrumentation.count('read_s', time.perf_counter() - read_start)
+        instrumentation.count('read_bytes', values.nbytes)
+        instrumentation.count('windows')
+        labels = rasterize(
+            zip(geometries[candidates], range(1, len(candidates) + 1)),
+            out_shape=values.shape,
+            transform=dataset.window_transform(window),
+            fill=0,
+            dtype="int32",
+        )
+
+        # Select the labelled pixels first, every later step only works on the selection
+        valid = labels > 0
+        pixel_labels = labels[valid]
+        pixel_values = values[valid]
+        del values, labels, valid
+        pixel_labels -= 1
+
+        if dataset.nodata is not None:
+            keep = pixel_values != dataset.nodata
+            if not keep.all():
+                pixel_labels, pixel_values = pixel_labels[keep], pixel_values[keep]
+            del keep
+
+        if dtype is not None:
+            pixel_values = pixel_values.astype(dtype)
+        pixel_values = pixel_values.astype(np.float64)
+
+        # Window-local reductions, folded into the totals of the candidates
+        window_minimum = np.full(len(candidates), np.inf)
+        window_maximum = np.full(len(candidates), -np.inf)
+        np.minimum.at(window_minimum, pixel_labels, pixel_values)
+        np.maximum.at(window_maximum, pixel_labels, pixel_values)
+
+        count[candidates] += np.bincount(pixel_labels, minlength=len(candidates))
+        total[candidates] += np.bincount(pixel_labels, weights=pixel_values, minlength=len(candidates))
+        minimum[candidates] = np.minimum(minimum[candidates], window_minimum)
+        maximum[candidates] = np.maximum(maximum[candidates], window_maximum)
+        # Free the selection before the next window is read
+        del pixel_labels, pixel_values
+
+    has_pixels = count > 0
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.where(has_pixels, total / count, np.nan)
+
+    return {
+        "mean": mean,
+        "count": count,
+        "min": np.where(has_pixels, minimum, np.nan),
+        "max": np.where(has_pixels, maximum, np.nan),
+    }